@@ -58,6 +58,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     # OTP Middleware DEBE ir después de AuthenticationMiddleware
     'django_otp.middleware.OTPMiddleware',
+    # Deja la empresa del usuario en request.empresa (una vez por petición)
+    'inventario.middleware.EmpresaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -121,6 +123,13 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Carga el perfil y la empresa junto con el usuario de la sesión.
+# ModelBackend se conserva para las sesiones que se iniciaron antes de este cambio.
+AUTHENTICATION_BACKENDS = [
+    'inventario.backends.EmpresaModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = 'login'
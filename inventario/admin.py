@@ -1,11 +1,11 @@
 # inventario/admin.py
 from django.contrib import admin
-from django.db.models import Sum
-from datetime import datetime, timedelta
+from django.db.models import OuterRef, Subquery, Sum
 
 # --- 1. IMPORTACIONES NECESARIAS ---
 # Modelos de tu aplicación
-from .models import Empresa, UserProfile, Pedido, Cliente, Producto, Retiro
+from .models import Empresa, UserProfile, Pedido, Cliente, Producto, Retiro, VentaDia
+from .metricas import metricas_plataforma
 # Modelos de Autenticación de Django (¡ESTA PARTE FALTABA!)
 from django.contrib.auth.models import User, Group
 # Paneles de Admin de Autenticación de Django (¡Y ESTA!)
@@ -20,23 +20,34 @@ class EmpresaAdmin(admin.ModelAdmin):
     search_fields = ('nombre', 'giro', 'userprofile__user__email')
     list_filter = ('giro',)
 
+    def get_queryset(self, request):
+        # Dueño (primer perfil), fecha de alta y ventas en la misma consulta del listado,
+        # en lugar de tres consultas por renglón.
+        primer_perfil = UserProfile.objects.filter(empresa=OuterRef('pk')).order_by('id')
+        ventas = VentaDia.objects.filter(empresa=OuterRef('pk')).values('empresa').annotate(suma=Sum('total')).values('suma')
+        return super().get_queryset(request).annotate(
+            email_dueno=Subquery(primer_perfil.values('user__email')[:1]),
+            alta_dueno=Subquery(primer_perfil.values('user__date_joined')[:1]),
+            ventas_totales=Subquery(ventas),
+        )
+
     def dueño_de_la_cuenta(self, obj):
-        profile = UserProfile.objects.filter(empresa=obj).first()
-        return profile.user.email if profile else "No asignado"
-    
+        return obj.email_dueno or "No asignado"
+
     def fecha_registro(self, obj):
-        profile = UserProfile.objects.filter(empresa=obj).first()
-        if profile:
-            return profile.user.date_joined.strftime("%d/%m/%Y")
+        if obj.alta_dueno:
+            return obj.alta_dueno.strftime("%d/%m/%Y")
         return "N/A"
 
     def total_ventas(self, obj):
-        total = Pedido.objects.filter(empresa=obj).aggregate(total_sum=Sum('total'))['total_sum']
-        return f"${total or 0:,.2f}"
+        return f"${obj.ventas_totales or 0:,.2f}"
 
     dueño_de_la_cuenta.short_description = 'Email del Dueño'
     fecha_registro.short_description = 'Fecha de Registro'
     total_ventas.short_description = 'Ventas Totales'
+    dueño_de_la_cuenta.admin_order_field = 'email_dueno'
+    fecha_registro.admin_order_field = 'alta_dueno'
+    total_ventas.admin_order_field = 'ventas_totales'
 
 
 # -----------------------------------------------------------------------------
@@ -46,22 +57,15 @@ from django.contrib.admin import AdminSite
 
 class MyAdminSite(AdminSite):
     def index(self, request, extra_context=None):
-        hoy = datetime.now().date()
-        inicio_semana = hoy - timedelta(days=hoy.weekday())
-        inicio_mes = hoy.replace(day=1)
-
-        total_empresas = Empresa.objects.count()
-        nuevas_semana = Empresa.objects.filter(userprofile__user__date_joined__gte=inicio_semana).count()
-        nuevas_mes = Empresa.objects.filter(userprofile__user__date_joined__gte=inicio_mes).count()
-        total_pedidos = Pedido.objects.count()
-        monto_total_vendido = Pedido.objects.aggregate(total=Sum('total'))['total'] or 0
-
+        # Foto periódica de las métricas (ver inventario/metricas.py), no agregados en vivo.
+        metricas = metricas_plataforma()
         stats = {
-            'total_empresas': total_empresas,
-            'nuevas_semana': nuevas_semana,
-            'nuevas_mes': nuevas_mes,
-            'total_pedidos': total_pedidos,
-            'monto_total_vendido': f"${monto_total_vendido:,.2f}",
+            'total_empresas': metricas.total_empresas,
+            'nuevas_semana': metricas.nuevas_semana,
+            'nuevas_mes': metricas.nuevas_mes,
+            'total_pedidos': metricas.total_pedidos,
+            'monto_total_vendido': f"${metricas.monto_total_vendido:,.2f}",
+            'calculado': metricas.calculado,
         }
         
         extra_context = extra_context or {}
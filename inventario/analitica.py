@@ -0,0 +1,138 @@
+# inventario/analitica.py
+
+from datetime import timedelta
+from uuid import uuid4
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import VentaProductoDia
+
+DIAS_ANALISIS = getattr(settings, 'ANALITICA_DIAS', 30)
+TIMEOUT_ANALITICA = 60 * 60 * 24
+
+# Cortes de la clasificación ABC sobre el ingreso acumulado (Pareto).
+CORTE_A = 0.80
+CORTE_B = 0.95
+
+
+def matrices_por_producto(empresa, fecha_inicio, fecha_fin):
+    """
+    Lee el resumen VentaProductoDia del rango y lo acomoda en arreglos producto × día.
+    Devuelve (ids de producto, cantidad, ingreso, costo); los días sin venta quedan en cero.
+    """
+    filas = list(VentaProductoDia.objects.filter(
+        empresa=empresa, fecha__range=[fecha_inicio, fecha_fin]
+    ).values_list('producto_id', 'fecha', 'cantidad', 'total', 'costo'))
+    dias = (fecha_fin - fecha_inicio).days + 1
+    if not filas:
+        vacio = np.zeros((0, dias))
+        return np.zeros(0, dtype=np.int64), vacio, vacio.copy(), vacio.copy()
+
+    producto_ids, fechas, cantidades, totales, costos = zip(*filas)
+    ids, fila = np.unique(np.array(producto_ids, dtype=np.int64), return_inverse=True)
+    columna = np.array([(fecha - fecha_inicio).days for fecha in fechas])
+
+    def matriz(valores):
+        resultado = np.zeros((len(ids), dias))
+        np.add.at(resultado, (fila, columna), np.array(valores, dtype=float))
+        return resultado
+
+    return ids, matriz(cantidades), matriz(totales), matriz(costos)
+
+
+def clasificar_abc(ingresos):
+    """Clase A/B/C por producto según su lugar en el ingreso acumulado, de mayor a menor."""
+    clases = np.full(len(ingresos), 'C')
+    total = ingresos.sum()
+    if total <= 0:
+        return clases
+    orden = np.argsort(-ingresos, kind='stable')
+    # Participación acumulada de los productos que van antes de cada uno.
+    previo = (np.cumsum(ingresos[orden]) - ingresos[orden]) / total
+    clases[orden[previo < CORTE_B]] = 'B'
+    clases[orden[previo < CORTE_A]] = 'A'
+    clases[ingresos <= 0] = 'C'
+    return clases
+
+
+def pendientes(serie):
+    """Pendiente por mínimos cuadrados de cada fila contra el número de día (unidades por día)."""
+    dias = serie.shape[1]
+    if dias < 2:
+        return np.zeros(serie.shape[0])
+    t = np.arange(dias) - (dias - 1) / 2
+    return (serie - serie.mean(axis=1, keepdims=True)) @ t / (t @ t)
+
+
+def analizar_productos(empresa, dias=DIAS_ANALISIS, hasta=None, top=5):
+    """
+    Desempeño de cada producto en los últimos `dias` días terminando en `hasta` (hoy por
+    defecto): ingreso, margen, venta diaria promedio, tendencia y clase ABC, más los `top`
+    productos por ingreso y por margen. Todo se calcula sobre los arreglos, sin ciclos por producto.
+    """
+    hasta = hasta or timezone.localdate()
+    desde = hasta - timedelta(days=dias - 1)
+    ids, cantidad, ingreso, costo = matrices_por_producto(empresa, desde, hasta)
+
+    ingreso_total = ingreso.sum(axis=1)
+    margen_total = ingreso_total - costo.sum(axis=1)
+    promedio_diario = cantidad.mean(axis=1) if len(ids) else np.zeros(0)
+    tendencia = pendientes(cantidad)
+    clases = clasificar_abc(ingreso_total)
+
+    productos = {
+        int(producto_id): {
+            'ingreso': round(float(ingreso_total[i]), 2),
+            'margen': round(float(margen_total[i]), 2),
+            'promedio_diario': round(float(promedio_diario[i]), 3),
+            'tendencia': round(float(tendencia[i]), 4),
+            'clase': str(clases[i]),
+        } for i, producto_id in enumerate(ids)
+    }
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'dias': dias,
+        'productos': productos,
+        'top_ingreso': [int(ids[i]) for i in np.argsort(-ingreso_total, kind='stable')[:top] if ingreso_total[i] > 0],
+        'top_margen': [int(ids[i]) for i in np.argsort(-margen_total, kind='stable')[:top] if margen_total[i] > 0],
+    }
+
+
+def clave_generacion(empresa_id):
+    return f"analitica:{empresa_id}:generacion"
+
+
+def analitica_del_dia(empresa, dias=DIAS_ANALISIS):
+    """
+    analizar_productos sobre los días ya terminados (hasta ayer), en cache por empresa, día y
+    generación. Los días pasados todavía cambian: una cancelación o devolución de un ticket
+    anterior, o una venta en lote con fecha pasada. Esas escrituras pasan por resumenes.py, que
+    cambia la generación (ver invalidar_analitica) y deja atrás el resultado guardado.
+    """
+    ayer = timezone.localdate() - timedelta(days=1)
+    generacion = cache.get(clave_generacion(empresa.id), 0)
+    clave = f"analitica:{empresa.id}:{ayer:%Y%m%d}:{dias}:{generacion}"
+    resultado = cache.get(clave)
+    if resultado is None:
+        resultado = analizar_productos(empresa, dias=dias, hasta=ayer)
+        cache.set(clave, resultado, TIMEOUT_ANALITICA)
+    return resultado
+
+
+def renovar_generacion(empresa_id):
+    """
+    Cambia la generación ahora y otra vez al confirmar, igual que invalidar_reportes: un cálculo
+    concurrente que aún veía los datos anteriores queda guardado bajo una generación ya vieja.
+    """
+    cache.set(clave_generacion(empresa_id), uuid4().hex, None)
+    transaction.on_commit(lambda: cache.set(clave_generacion(empresa_id), uuid4().hex, None))
+
+
+def invalidar_analitica(empresa, fechas):
+    """Renueva la generación si alguna de esas fechas (datetimes) cae antes de hoy."""
+    hoy = timezone.localdate()
+    if any(timezone.localdate(fecha) < hoy for fecha in fechas):
+        renovar_generacion(empresa.id)
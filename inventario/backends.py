@@ -0,0 +1,19 @@
+# inventario/backends.py
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class EmpresaModelBackend(ModelBackend):
+    """
+    Igual que ModelBackend, pero al cargar el usuario de la sesión trae también su perfil
+    y su empresa en la misma consulta (ver EmpresaMiddleware).
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('profile__empresa').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
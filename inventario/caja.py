@@ -0,0 +1,313 @@
+# inventario/caja.py
+
+from datetime import date
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count, Min, Q, Case, When, Value, OuterRef, Subquery, DecimalField, IntegerField
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import Arqueo, CajaDia, Empresa, Pedido, Retiro, Turno
+from .rangos import filtro_de_dias
+from .reportes import invalidar_reportes
+from .resumenes import cerrar_dias_en_resumen
+
+CAMPOS_CAJA = ('ventas_efectivo', 'ventas_tarjeta', 'retiros', 'movimientos_pendientes')
+
+
+def registrar_en_caja(empresa, fecha, **importes):
+    """
+    Suma (o resta, con importes negativos) al libro de caja del día con un UPDATE basado en F().
+    Si la fila del día aún no existe, se crea; si otra terminal la crea al mismo tiempo, se reintenta.
+    Ej.: registrar_en_caja(empresa, fecha, ventas_efectivo=Decimal('250.00'), movimientos_pendientes=1)
+    Como todo movimiento de caja pasa por aquí, también se borran los reportes guardados del día
+    y, si el movimiento queda pendiente de arqueo, se marca el día en Empresa.pendiente_desde.
+    """
+    cambios = {campo: F(campo) + valor for campo, valor in importes.items() if valor}
+    if not cambios:
+        return
+    invalidar_reportes(empresa, [fecha])
+    with transaction.atomic(savepoint=False):
+        if importes.get('movimientos_pendientes', 0) > 0:
+            _marcar_pendiente(empresa, fecha)
+        if CajaDia.objects.filter(empresa=empresa, fecha=fecha).update(**cambios):
+            return
+        try:
+            with transaction.atomic():
+                CajaDia.objects.create(empresa=empresa, fecha=fecha, **importes)
+        except IntegrityError:
+            CajaDia.objects.filter(empresa=empresa, fecha=fecha).update(**cambios)
+
+
+def _marcar_pendiente(empresa, fecha):
+    """
+    Retrasa Empresa.pendiente_desde hasta `fecha` si hoy apunta a un día posterior o a ninguno.
+    Es un UPDATE condicional: casi siempre no toca ninguna fila (el marcador ya es de hoy o
+    anterior), así que no bloquea la empresa. Cuando sí la toca, va antes del UPDATE al libro,
+    en el mismo orden de bloqueo que cerrar_dias: primero Empresa, luego CajaDia.
+    """
+    if Empresa.objects.filter(Q(pendiente_desde__isnull=True) | Q(pendiente_desde__gt=fecha), id=empresa.id).update(pendiente_desde=fecha):
+        empresa.pendiente_desde = fecha
+
+
+def recalcular_pendiente(empresa):
+    """
+    Vuelve a leer del libro el día pendiente más antiguo (índice parcial caja_dia_pendiente) y
+    lo guarda en Empresa.pendiente_desde. Se llama con la fila de la empresa ya bloqueada.
+    """
+    empresa.pendiente_desde = CajaDia.objects.filter(empresa=empresa, movimientos_pendientes__gt=0).aggregate(f=Min('fecha'))['f']
+    Empresa.objects.filter(id=empresa.id).update(pendiente_desde=empresa.pendiente_desde)
+    return empresa.pendiente_desde
+
+
+class TurnoCerrado(Exception):
+    """El turno al que iba un movimiento se cerró mientras se registraba."""
+
+
+def registrar_en_turno(empresa, turno_id, fecha, **importes):
+    """
+    Suma (o resta) a los totales de un turno abierto con un UPDATE basado en F(). Si el turno
+    ya se cerró, lanza TurnoCerrado para que el movimiento se revierta en lugar de quedar fuera
+    de su arqueo. Como en registrar_en_caja, también se borran los reportes guardados del día.
+    """
+    cambios = {campo: F(campo) + valor for campo, valor in importes.items() if valor}
+    if not cambios:
+        return
+    invalidar_reportes(empresa, [fecha])
+    if not Turno.objects.filter(id=turno_id, cierre__isnull=True).update(**cambios):
+        raise TurnoCerrado("El turno de caja ya fue cerrado.")
+
+
+def registrar_venta_en_caja(pedido, signo=1):
+    """
+    Refleja una venta (signo=1) o su cancelación (signo=-1) en el turno del pedido o, si no
+    tiene turno, en el libro del día.
+    """
+    campo = 'ventas_efectivo' if pedido.metodo_pago == 'Efectivo' else 'ventas_tarjeta'
+    importes = {campo: pedido.total * signo}
+    fecha = timezone.localdate(pedido.fecha)
+    if pedido.turno_id:
+        if signo > 0:
+            importes['movimientos'] = 1
+        registrar_en_turno(pedido.empresa, pedido.turno_id, fecha, **importes)
+        return
+    if signo > 0:
+        importes['movimientos_pendientes'] = 1
+    registrar_en_caja(pedido.empresa, fecha, **importes)
+
+
+def registrar_devolucion_en_caja(pedido, importe):
+    """
+    Descuenta del turno del pedido o del libro del día el dinero de una devolución parcial.
+    El pedido sigue siendo un solo movimiento pendiente de arqueo, ya con su total reducido.
+    """
+    campo = 'ventas_efectivo' if pedido.metodo_pago == 'Efectivo' else 'ventas_tarjeta'
+    fecha = timezone.localdate(pedido.fecha)
+    if pedido.turno_id:
+        registrar_en_turno(pedido.empresa, pedido.turno_id, fecha, **{campo: -importe})
+        return
+    registrar_en_caja(pedido.empresa, fecha, **{campo: -importe})
+
+
+def registrar_retiro_en_caja(retiro):
+    fecha = timezone.localdate(retiro.fecha)
+    if retiro.turno_id:
+        registrar_en_turno(retiro.empresa, retiro.turno_id, fecha, retiros=retiro.monto, movimientos=1)
+        return
+    registrar_en_caja(retiro.empresa, fecha, retiros=retiro.monto, movimientos_pendientes=1)
+
+
+def caja_del_dia(empresa, fecha, bloquear=False):
+    """Devuelve la fila del libro para ese día, o una en ceros (sin guardar) si no hubo movimientos."""
+    consulta = CajaDia.objects.filter(empresa=empresa, fecha=fecha)
+    if bloquear:
+        consulta = consulta.select_for_update()
+    return consulta.first() or CajaDia(empresa=empresa, fecha=fecha)
+
+
+def dia_pendiente_mas_antiguo(empresa, antes_de):
+    """
+    Primer día anterior a `antes_de` con movimientos sin arqueo, o None. Sale del marcador
+    Empresa.pendiente_desde, así que no consulta la base de datos.
+    """
+    if empresa.pendiente_desde is not None and empresa.pendiente_desde < antes_de:
+        return empresa.pendiente_desde
+    return None
+
+
+def dias_pendientes(empresa, antes_de):
+    """Días anteriores a `antes_de` con movimientos sin arqueo, del más antiguo al más reciente."""
+    return list(CajaDia.objects.filter(
+        empresa=empresa, fecha__lt=antes_de, movimientos_pendientes__gt=0
+    ).order_by('fecha').values_list('fecha', flat=True))
+
+
+def suma_sellada(modelo, campo, **filtro):
+    """Subconsulta con la suma de `campo` de los renglones de `modelo` sellados con el arqueo exterior."""
+    suma = modelo.objects.filter(arqueo=OuterRef('pk'), **filtro).values('arqueo').annotate(s=Sum(campo)).values('s')
+    return Coalesce(Subquery(suma, output_field=DecimalField(max_digits=12, decimal_places=2)), Value(Decimal('0.00')))
+
+
+def cuenta_sellada(modelo):
+    cuenta = modelo.objects.filter(arqueo=OuterRef('pk')).values('arqueo').annotate(c=Count('id')).values('c')
+    return Coalesce(Subquery(cuenta, output_field=IntegerField()), Value(0))
+
+
+def cerrar_dias(empresa, montos, usuario=None):
+    """
+    Cierra de una vez los días de `montos` ({fecha: monto contado}) y devuelve un Arqueo por
+    día, en orden de fecha. Si el monto de un día es None el arqueo queda sin conteo:
+    monto_contado y diferencia en NULL (cierre de días atrasados sin contar el efectivo).
+
+    Primero se bloquean la empresa y las filas del libro de esos días, así que una venta que
+    llegue a la mitad espera y queda pendiente para el siguiente arqueo. Luego se sellan los
+    pedidos y retiros pendientes sin turno (los de un turno se cierran con su turno, ver
+    turnos.py) con un UPDATE por tabla y los totales de cada arqueo se calculan en una sola
+    consulta sobre lo que quedó sellado: lo que se cuenta es exactamente lo que se selló.
+    El número de consultas no depende de cuántos días se cierren.
+    """
+    fechas = sorted(montos)
+    if not fechas:
+        return []
+    with transaction.atomic():
+        # Primero la empresa (por su marcador de día pendiente) y luego el libro: el mismo orden
+        # que sigue una venta en registrar_en_caja, así que ambas no pueden esperarse en círculo.
+        list(Empresa.objects.select_for_update().filter(id=empresa.id).values_list('id', flat=True))
+        list(CajaDia.objects.select_for_update().filter(empresa=empresa, fecha__in=fechas).values_list('id', flat=True))
+        arqueos = Arqueo.objects.bulk_create([Arqueo(empresa=empresa, fecha=fecha, cerrado_por=usuario) for fecha in fechas])
+        por_fecha = dict(zip(fechas, arqueos))
+
+        for modelo in (Pedido, Retiro):
+            dias = {fecha: Q(**filtro_de_dias('fecha', fecha)) for fecha in fechas}
+            modelo.objects.filter(reduce(or_, dias.values()), empresa=empresa, arqueo__isnull=True, turno__isnull=True).update(arqueo_id=Case(
+                *[When(condicion, then=Value(por_fecha[fecha].id)) for fecha, condicion in dias.items()],
+                output_field=IntegerField(),
+            ))
+
+        sellado = {fila['id']: fila for fila in Arqueo.objects.filter(id__in=[a.id for a in arqueos]).annotate(
+            efectivo=suma_sellada(Pedido, 'total', estado='Completado', metodo_pago='Efectivo'),
+            tarjeta=suma_sellada(Pedido, 'total', estado='Completado', metodo_pago='Tarjeta'),
+            suma_retiros=suma_sellada(Retiro, 'monto'),
+            pedidos_sellados=cuenta_sellada(Pedido),
+            retiros_sellados=cuenta_sellada(Retiro),
+        ).values('id', 'efectivo', 'tarjeta', 'suma_retiros', 'pedidos_sellados', 'retiros_sellados')}
+
+        for fecha, arqueo in por_fecha.items():
+            fila = sellado[arqueo.id]
+            arqueo.ventas_efectivo, arqueo.ventas_tarjeta, arqueo.retiros = fila['efectivo'], fila['tarjeta'], fila['suma_retiros']
+            arqueo.efectivo_esperado = arqueo.ventas_efectivo - arqueo.retiros
+            arqueo.monto_contado = montos[fecha]
+            arqueo.diferencia = None if arqueo.monto_contado is None else arqueo.monto_contado - arqueo.efectivo_esperado
+        Arqueo.objects.bulk_update(arqueos, [
+            'ventas_efectivo', 'ventas_tarjeta', 'retiros', 'efectivo_esperado', 'monto_contado', 'diferencia',
+        ])
+
+        # Se descuenta del libro lo que se selló (no lo que decía el libro), con un solo UPDATE.
+        restas = {
+            'ventas_efectivo': 'efectivo', 'ventas_tarjeta': 'tarjeta', 'retiros': 'suma_retiros',
+        }
+        cambios = {
+            campo: Case(
+                *[When(fecha=fecha, then=F(campo) - sellado[a.id][columna]) for fecha, a in por_fecha.items()],
+                default=F(campo), output_field=CajaDia._meta.get_field(campo),
+            ) for campo, columna in restas.items()
+        }
+        cambios['movimientos_pendientes'] = Case(
+            *[When(fecha=fecha, then=F('movimientos_pendientes') - sellado[a.id]['pedidos_sellados'] - sellado[a.id]['retiros_sellados'])
+              for fecha, a in por_fecha.items()],
+            default=F('movimientos_pendientes'), output_field=IntegerField(),
+        )
+        CajaDia.objects.filter(empresa=empresa, fecha__in=fechas).update(**cambios)
+        recalcular_pendiente(empresa)
+        cerrar_dias_en_resumen(empresa, por_fecha)
+        invalidar_reportes(empresa, fechas)
+    return arqueos
+
+
+def calcular_libro_desde_tablas(empresa=None):
+    """
+    Recalcula el libro a partir de Pedido y Retiro sin arqueo (los de un turno se llevan en el turno).
+    Devuelve {(empresa_id, fecha): {campo: valor}}.
+    """
+    pedidos = Pedido.objects.filter(arqueo__isnull=True, turno__isnull=True)
+    retiros = Retiro.objects.filter(arqueo__isnull=True, turno__isnull=True)
+    if empresa is not None:
+        pedidos = pedidos.filter(empresa=empresa)
+        retiros = retiros.filter(empresa=empresa)
+
+    libro = {}
+
+    def fila(empresa_id, fecha):
+        return libro.setdefault((empresa_id, fecha), {
+            'ventas_efectivo': Decimal('0.00'), 'ventas_tarjeta': Decimal('0.00'),
+            'retiros': Decimal('0.00'), 'movimientos_pendientes': 0,
+        })
+
+    completados = Q(estado='Completado')
+    for dato in pedidos.annotate(dia=TruncDate('fecha')).values('empresa_id', 'dia').annotate(
+        efectivo=Sum('total', filter=completados & Q(metodo_pago='Efectivo')),
+        tarjeta=Sum('total', filter=completados & Q(metodo_pago='Tarjeta')),
+        movimientos=Count('id'),
+    ).order_by():
+        registro = fila(dato['empresa_id'], dato['dia'])
+        registro['ventas_efectivo'] = dato['efectivo'] or Decimal('0.00')
+        registro['ventas_tarjeta'] = dato['tarjeta'] or Decimal('0.00')
+        registro['movimientos_pendientes'] += dato['movimientos']
+
+    for dato in retiros.annotate(dia=TruncDate('fecha')).values('empresa_id', 'dia').annotate(
+        monto=Sum('monto'), movimientos=Count('id'),
+    ).order_by():
+        registro = fila(dato['empresa_id'], dato['dia'])
+        registro['retiros'] = dato['monto'] or Decimal('0.00')
+        registro['movimientos_pendientes'] += dato['movimientos']
+
+    return libro
+
+
+def comparar_libro(empresa=None):
+    """
+    Lista de diferencias (empresa_id, fecha, campo, en_libro, esperado) entre el libro y las tablas.
+    Un marcador Empresa.pendiente_desde desfasado aparece con campo 'pendiente_desde'.
+    """
+    esperado = calcular_libro_desde_tablas(empresa)
+    actuales = CajaDia.objects.all() if empresa is None else CajaDia.objects.filter(empresa=empresa)
+    en_libro = {(c.empresa_id, c.fecha): {campo: getattr(c, campo) for campo in CAMPOS_CAJA} for c in actuales}
+
+    diferencias = []
+    vacio = {campo: 0 for campo in CAMPOS_CAJA}
+    for clave in sorted(set(esperado) | set(en_libro)):
+        for campo in CAMPOS_CAJA:
+            valor_libro = en_libro.get(clave, vacio)[campo]
+            valor_esperado = esperado.get(clave, vacio)[campo]
+            if valor_libro != valor_esperado:
+                diferencias.append((clave[0], clave[1], campo, valor_libro, valor_esperado))
+
+    mas_antiguos = {}
+    for (empresa_id, fecha), valores in esperado.items():
+        if valores['movimientos_pendientes'] and fecha < mas_antiguos.get(empresa_id, date.max):
+            mas_antiguos[empresa_id] = fecha
+    empresas = Empresa.objects.all() if empresa is None else Empresa.objects.filter(id=empresa.id)
+    for empresa_id, marcador in empresas.values_list('id', 'pendiente_desde').order_by('id'):
+        if marcador != mas_antiguos.get(empresa_id):
+            diferencias.append((empresa_id, marcador or mas_antiguos[empresa_id], 'pendiente_desde', marcador, mas_antiguos.get(empresa_id)))
+    return diferencias
+
+
+@transaction.atomic
+def reconstruir_libro(empresa=None):
+    """
+    Reemplaza el libro de caja con lo calculado desde las tablas, junto con el marcador
+    Empresa.pendiente_desde. Devuelve cuántas filas quedaron.
+    """
+    esperado = calcular_libro_desde_tablas(empresa)
+    actuales = CajaDia.objects.all() if empresa is None else CajaDia.objects.filter(empresa=empresa)
+    actuales.delete()
+    CajaDia.objects.bulk_create([
+        CajaDia(empresa_id=empresa_id, fecha=fecha, **valores)
+        for (empresa_id, fecha), valores in esperado.items()
+    ])
+    empresas = [empresa] if empresa is not None else Empresa.objects.select_for_update()
+    for actual in empresas:
+        recalcular_pendiente(actual)
+    return len(esperado)
@@ -0,0 +1,77 @@
+# inventario/carrito.py
+
+from decimal import Decimal
+from django.http import Http404
+from .catalogo import consulta_catalogo, obtener_catalogo
+
+
+def precio_aplicable(producto, cantidad):
+    """Devuelve el precio unitario que corresponde a la cantidad (regla de mayoreo)."""
+    if producto.precio_mayoreo and producto.mayoreo_desde_kg and cantidad >= producto.mayoreo_desde_kg:
+        return producto.precio_mayoreo
+    return producto.precio
+
+
+def cotizar_carrito(empresa, carrito):
+    """
+    Calcula las líneas y el total de un carrito de sesión ({producto_id: cantidad}).
+    Los productos salen del catálogo en cache; si falta alguno (p. ej. se archivó
+    después de agregarlo) se cargan los faltantes con una sola consulta `id__in`.
+    """
+    ids = [int(producto_id) for producto_id in carrito]
+    productos = {producto.id: producto for producto in obtener_catalogo(empresa)}
+    faltantes = [producto_id for producto_id in ids if producto_id not in productos]
+    if faltantes:
+        productos.update(consulta_catalogo(empresa).filter(id__in=faltantes).in_bulk())
+    if any(producto_id not in productos for producto_id in ids):
+        raise Http404("Uno de los productos del carrito ya no existe.")
+
+    items_del_carrito = []
+    total_carrito = Decimal('0.00')
+    for producto_id, cantidad in carrito.items():
+        producto = productos[int(producto_id)]
+        cantidad_decimal = Decimal(str(cantidad))
+        precio_unitario = precio_aplicable(producto, cantidad_decimal)
+        subtotal = precio_unitario * cantidad_decimal
+        total_carrito += subtotal
+        items_del_carrito.append({
+            'producto': producto,
+            'cantidad': cantidad_decimal,
+            'precio_unitario': precio_unitario,
+            'subtotal': subtotal,
+        })
+    return items_del_carrito, total_carrito
+
+
+def aplicar_operaciones(carrito, operaciones):
+    """
+    Aplica una lista de operaciones sobre el carrito (se modifica en sitio) y
+    devuelve los ids de producto tocados, en orden. Cada operación es un dict:
+      {'op': 'agregar', 'producto_id': 3, 'cantidad': '1'}
+      {'op': 'actualizar', 'producto_id': 3, 'cantidad': '1.250', 'mode': 'add' | 'replace'}
+      {'op': 'eliminar', 'producto_id': 3}
+    Lanza ValueError/KeyError/InvalidOperation si una operación no es válida.
+    """
+    tocados = []
+    for operacion in operaciones:
+        tipo = operacion.get('op')
+        producto_id = str(int(operacion['producto_id']))
+
+        if tipo == 'eliminar':
+            carrito.pop(producto_id, None)
+        elif tipo in ('agregar', 'actualizar'):
+            cantidad = Decimal(str(operacion.get('cantidad', '1')))
+            if not cantidad.is_finite():
+                raise ValueError(f"Cantidad inválida: {cantidad}")
+            if tipo == 'agregar' or operacion.get('mode') == 'add':
+                cantidad += Decimal(str(carrito.get(producto_id, '0')))
+            if cantidad > 0:
+                carrito[producto_id] = str(cantidad)
+            else:
+                carrito.pop(producto_id, None)
+        else:
+            raise ValueError(f"Operación de carrito desconocida: {tipo}")
+
+        if producto_id not in tocados:
+            tocados.append(producto_id)
+    return tocados
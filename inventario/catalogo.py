@@ -0,0 +1,84 @@
+# inventario/catalogo.py
+
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from .models import Producto
+
+# Tamaño de la capa en memoria (catálogos por proceso) y vigencia en el cache de Django.
+TAMANO_LRU = getattr(settings, 'CATALOGO_LRU_TAMANO', 64)
+TIMEOUT_CACHE = getattr(settings, 'CATALOGO_CACHE_TIMEOUT', 60 * 60 * 24)
+
+_lru = OrderedDict()
+_candado = threading.Lock()
+_estadisticas = {'aciertos_memoria': 0, 'aciertos_cache': 0, 'fallos': 0}
+
+
+def _contar(evento):
+    with _candado:
+        _estadisticas[evento] += 1
+
+
+def _clave(empresa):
+    return f"catalogo:{empresa.id}:v{empresa.version_catalogo}"
+
+
+def consulta_catalogo(empresa):
+    """
+    Productos de la empresa tal como se guardan en el catálogo: sin el stock (diferido), pero
+    con `stock_indefinido`, que solo cambia al guardar el producto y por eso sí se puede guardar.
+    """
+    return Producto.objects.filter(empresa=empresa).defer('stock').annotate(
+        stock_indefinido=ExpressionWrapper(Q(stock__isnull=True), output_field=BooleanField()),
+    )
+
+
+def obtener_catalogo(empresa):
+    """
+    Productos activos de la empresa ordenados por nombre. La clave incluye la versión del
+    catálogo guardada en Empresa, así que un cambio de versión deja atrás las copias viejas
+    sin tener que borrarlas. Primero se busca en el LRU del proceso, luego en el cache de
+    Django y solo al final en la base de datos.
+
+    El stock no forma parte del catálogo (ver consulta_catalogo): cambia con cada venta y se
+    lee al momento con stock_actual, así que vender no invalida el cache ni toca Empresa.
+    """
+    clave = _clave(empresa)
+    with _candado:
+        productos = _lru.get(clave)
+        if productos is not None:
+            _lru.move_to_end(clave)
+            _estadisticas['aciertos_memoria'] += 1
+            return list(productos)
+
+    productos = cache.get(clave)
+    if productos is not None:
+        _contar('aciertos_cache')
+    else:
+        _contar('fallos')
+        productos = list(consulta_catalogo(empresa).filter(is_active=True).order_by('nombre'))
+        cache.set(clave, productos, TIMEOUT_CACHE)
+
+    with _candado:
+        _lru[clave] = productos
+        _lru.move_to_end(clave)
+        while len(_lru) > TAMANO_LRU:
+            _lru.popitem(last=False)
+    return list(productos)
+
+
+def stock_actual(empresa):
+    """{producto_id: stock} de los productos activos, leído de la base de datos en una consulta."""
+    return dict(Producto.objects.filter(empresa=empresa, is_active=True).values_list('id', 'stock'))
+
+
+def estadisticas_catalogo():
+    """Contadores de aciertos y fallos del proceso actual."""
+    with _candado:
+        datos = dict(_estadisticas)
+        datos['entradas_memoria'] = len(_lru)
+    consultas = datos['aciertos_memoria'] + datos['aciertos_cache'] + datos['fallos']
+    datos['tasa_aciertos'] = round((consultas - datos['fallos']) / consultas, 3) if consultas else None
+    return datos
@@ -0,0 +1,67 @@
+# inventario/etiquetas.py
+
+from decimal import Decimal
+from django.conf import settings
+
+# Formato de las etiquetas de báscula (EAN-13 con peso o importe incrustado).
+# Las posiciones cuentan desde 0 sobre los 13 dígitos. El formato por defecto es el
+# más común en básculas de mostrador: 2 dígitos de prefijo, 5 de PLU, 5 de peso en
+# gramos y el dígito verificador (2P PPPPP VVVVV C).
+FORMATO_ETIQUETA_POR_DEFECTO = {
+    'prefijos': [str(prefijo) for prefijo in range(20, 30)],
+    'inicio_plu': 2,
+    'longitud_plu': 5,
+    'inicio_valor': 7,
+    'longitud_valor': 5,
+    'tipo_valor': 'peso',   # 'peso' o 'importe'
+    'decimales_valor': 3,   # 3 = gramos -> kg; 2 = centavos -> pesos
+}
+
+
+class CodigoInvalido(Exception):
+    """El código escaneado no es un EAN-13 válido o no corresponde al formato configurado."""
+
+
+def formato_etiqueta():
+    """Formato configurado en settings.ETIQUETA_BASCULA, completado con los valores por defecto."""
+    return {**FORMATO_ETIQUETA_POR_DEFECTO, **getattr(settings, 'ETIQUETA_BASCULA', {})}
+
+
+def digito_verificador_ean13(doce_digitos):
+    suma = sum(int(digito) * (3 if posicion % 2 else 1) for posicion, digito in enumerate(doce_digitos))
+    return str((10 - suma % 10) % 10)
+
+
+def interpretar_codigo(codigo):
+    """
+    Devuelve (plu, tipo_valor, valor). Para etiquetas de báscula `tipo_valor` es 'peso'
+    (kg) o 'importe' (pesos) según el formato; para cualquier otro código el PLU es el
+    código completo y `tipo_valor` y `valor` son None.
+    """
+    codigo = (codigo or '').strip()
+    if not codigo:
+        raise CodigoInvalido("El código está vacío.")
+
+    formato = formato_etiqueta()
+    if len(codigo) == 13 and codigo.isdigit() and codigo[:2] in formato['prefijos']:
+        if digito_verificador_ean13(codigo[:12]) != codigo[12]:
+            raise CodigoInvalido("El dígito verificador de la etiqueta no coincide. Vuelve a escanearla.")
+        plu = codigo[formato['inicio_plu']:formato['inicio_plu'] + formato['longitud_plu']]
+        digitos = codigo[formato['inicio_valor']:formato['inicio_valor'] + formato['longitud_valor']]
+        valor = Decimal(digitos).scaleb(-formato['decimales_valor'])
+        if valor <= 0:
+            raise CodigoInvalido("La etiqueta no trae peso ni importe.")
+        return plu, formato['tipo_valor'], valor
+    return codigo, None, None
+
+
+def variantes_plu(plu):
+    """
+    Formas en que puede estar capturado un PLU en Producto.codigo: tal cual viene en la
+    etiqueta ('00042') o sin ceros a la izquierda ('42'). Se buscan todas con un solo `IN`.
+    """
+    variantes = [plu]
+    sin_ceros = plu.lstrip('0')
+    if plu.isdigit() and sin_ceros and sin_ceros != plu:
+        variantes.append(sin_ceros)
+    return variantes
@@ -0,0 +1,75 @@
+# inventario/exportar.py
+
+import csv
+import zlib
+from django.utils import timezone
+from .models import Pedido, PedidoItem
+from .rangos import filtro_de_dias
+
+# Filas leídas por viaje a la base de datos y filas por trozo enviado al cliente.
+TAMANO_LOTE = 2000
+FILAS_POR_TROZO = 500
+
+ENCABEZADO_PEDIDOS = ['ticket', 'fecha', 'cliente', 'metodo_pago', 'estado', 'total', 'monto_recibido', 'cambio_entregado']
+ENCABEZADO_LINEAS = ['ticket', 'fecha', 'estado', 'metodo_pago', 'producto', 'codigo', 'cantidad', 'unidad',
+                     'precio_unitario', 'subtotal', 'costo_unitario']
+
+
+class _Eco:
+    """Objeto tipo archivo que devuelve lo que se le escribe, para usar csv.writer sin buffer."""
+
+    def write(self, valor):
+        return valor
+
+
+def _hora_local(fecha):
+    return timezone.localtime(fecha).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def filas_pedidos(empresa, fecha_inicio, fecha_fin):
+    yield ENCABEZADO_PEDIDOS
+    pedidos = Pedido.objects.filter(
+        empresa=empresa, **filtro_de_dias('fecha', fecha_inicio, fecha_fin)
+    ).order_by('fecha', 'id').values_list(
+        'ticket_numero', 'fecha', 'cliente__nombre', 'metodo_pago', 'estado', 'total', 'monto_recibido', 'cambio_entregado'
+    )
+    for ticket, fecha, cliente, metodo_pago, estado, total, monto_recibido, cambio in pedidos.iterator(chunk_size=TAMANO_LOTE):
+        yield [ticket, _hora_local(fecha), cliente or 'Mostrador', metodo_pago, estado, total, monto_recibido, cambio]
+
+
+def filas_lineas(empresa, fecha_inicio, fecha_fin):
+    yield ENCABEZADO_LINEAS
+    lineas = PedidoItem.objects.filter(
+        pedido__empresa=empresa, **filtro_de_dias('pedido__fecha', fecha_inicio, fecha_fin)
+    ).order_by('pedido__fecha', 'pedido_id', 'id').values_list(
+        'pedido__ticket_numero', 'pedido__fecha', 'pedido__estado', 'pedido__metodo_pago', 'producto__nombre',
+        'producto__codigo', 'cantidad', 'producto__unidad_medida', 'precio_unitario', 'subtotal', 'costo_unitario',
+    )
+    for fila in lineas.iterator(chunk_size=TAMANO_LOTE):
+        fila = list(fila)
+        fila[1] = _hora_local(fila[1])
+        yield fila
+
+
+def csv_en_flujo(filas):
+    """Convierte filas en trozos de CSV codificados en UTF-8 (con BOM para que Excel respete los acentos)."""
+    escritor = csv.writer(_Eco())
+    yield '\ufeff'.encode('utf-8')
+    trozo = []
+    for fila in filas:
+        trozo.append(escritor.writerow(fila))
+        if len(trozo) == FILAS_POR_TROZO:
+            yield ''.join(trozo).encode('utf-8')
+            trozo = []
+    if trozo:
+        yield ''.join(trozo).encode('utf-8')
+
+
+def gzip_en_flujo(trozos):
+    """Comprime al vuelo un flujo de bytes en formato gzip, sin juntarlo en memoria."""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for trozo in trozos:
+        comprimido = compresor.compress(trozo)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
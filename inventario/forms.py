@@ -1,7 +1,7 @@
 # inventario/forms.py
 from django import forms
 from django.contrib.auth.models import User
-from .models import Retiro, Producto, Cliente, Empresa
+from .models import Retiro, Producto, Cliente, Empresa, Turno
 
 class RetiroForm(forms.ModelForm):
     class Meta:
@@ -16,6 +16,19 @@ class RetiroForm(forms.ModelForm):
             'concepto': 'Concepto del Retiro',
         }
 
+class TurnoForm(forms.ModelForm):
+    class Meta:
+        model = Turno
+        fields = ['caja', 'fondo_inicial']
+        widgets = {
+            'caja': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej. Caja 1'}),
+            'fondo_inicial': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'placeholder': 'Ej. 500.00'}),
+        }
+        labels = {
+            'caja': 'Caja Registradora',
+            'fondo_inicial': 'Fondo Inicial en Efectivo',
+        }
+
 class UserRegistrationForm(forms.ModelForm):
     password = forms.CharField(
         label="Contraseña", 
@@ -71,19 +84,31 @@ class EmpresaOnboardingForm(forms.ModelForm):
 
 class ProductoForm(forms.ModelForm):
     # --- NUEVO MÉTODO __init__ ---
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, empresa=None, **kwargs):
         super().__init__(*args, **kwargs)
+        # La empresa no es un campo del formulario; se recibe aparte para validar el código.
+        self.empresa = empresa
         # Esta lógica se asegura de que el cambio solo aplique al crear un producto nuevo,
         # no al editar uno existente.
         if not self.instance.pk:
             self.fields['requiere_stock'].initial = False
     # --------------------------
 
+    def clean_codigo(self):
+        # Vacío se guarda como NULL para que varios productos puedan quedarse sin código.
+        codigo = (self.cleaned_data.get('codigo') or '').strip() or None
+        if codigo and self.empresa is not None:
+            repetido = Producto.objects.filter(empresa=self.empresa, codigo=codigo).exclude(pk=self.instance.pk).first()
+            if repetido:
+                raise forms.ValidationError(f'El código ya lo usa "{repetido.nombre}".')
+        return codigo
+
     class Meta:
         model = Producto
-        fields = ['nombre', 'precio', 'unidad_medida', 'requiere_stock', 'stock', 'precio_mayoreo', 'mayoreo_desde_kg']
+        fields = ['nombre', 'codigo', 'precio', 'unidad_medida', 'requiere_stock', 'stock', 'precio_mayoreo', 'mayoreo_desde_kg']
         labels = {
             'nombre': 'Nombre del Producto o Servicio',
+            'codigo': 'PLU o Código de Barras (Opcional)',
             'precio': 'Precio de Venta',
             'stock': 'Stock Inicial (si aplica)',
             'precio_mayoreo': 'Precio de Mayoreo (Opcional)',
@@ -93,6 +118,7 @@ class ProductoForm(forms.ModelForm):
         }
         widgets = {
             'nombre': forms.TextInput(attrs={'class': 'form-control'}),
+            'codigo': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej. 00042'}),
             'precio': forms.NumberInput(attrs={'class': 'form-control'}),
             'stock': forms.NumberInput(attrs={'class': 'form-control'}),
             'precio_mayoreo': forms.NumberInput(attrs={'class': 'form-control'}),
@@ -0,0 +1,100 @@
+# inventario/histograma.py
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from .models import Pedido, VentaDia
+
+# Las cubetas cerradas no cambian salvo por una cancelación o una venta capturada con fecha
+# pasada, y esas las borran explícitamente (ver invalidar_histograma), así que pueden vivir mucho.
+TIMEOUT_HISTOGRAMA = getattr(settings, 'HISTOGRAMA_CACHE_TIMEOUT', 60 * 60 * 24 * 40)
+
+
+def clave_hora(empresa_id, inicio_hora):
+    return f"histograma:{empresa_id}:h:{inicio_hora:%Y%m%d%H}"
+
+
+def clave_dia(empresa_id, fecha):
+    return f"histograma:{empresa_id}:d:{fecha:%Y%m%d}"
+
+
+def ventas_por_hora(empresa, dia=None):
+    """
+    {hora (0-23): ventas netas} para un día local (hoy por defecto). Las horas que ya
+    terminaron salen del cache; solo la hora en curso se consulta siempre, y las cerradas
+    que falten se calculan juntas con una sola consulta agrupada.
+    """
+    ahora = timezone.localtime()
+    dia = dia or ahora.date()
+    inicios = [timezone.make_aware(datetime.combine(dia, time(hora))) for hora in range(24)]
+    cerradas = {clave_hora(empresa.id, inicio): hora for hora, inicio in enumerate(inicios) if inicio + timedelta(hours=1) <= ahora}
+
+    guardadas = cache.get_many(cerradas)
+    resultado = {cerradas[clave]: valor for clave, valor in guardadas.items()}
+    faltantes = [hora for clave, hora in cerradas.items() if clave not in guardadas]
+    if faltantes:
+        calculadas = dict.fromkeys(faltantes, Decimal('0.00'))
+        for dato in Pedido.objects.filter(
+            empresa=empresa, estado='Completado',
+            fecha__gte=inicios[min(faltantes)], fecha__lt=inicios[max(faltantes)] + timedelta(hours=1),
+        ).annotate(hora=TruncHour('fecha')).values('hora').annotate(total=Sum('total')).order_by():
+            calculadas[timezone.localtime(dato['hora']).hour] = dato['total']
+        calculadas = {hora: total for hora, total in calculadas.items() if hora in faltantes}
+        cache.set_many({clave_hora(empresa.id, inicios[hora]): total for hora, total in calculadas.items()}, TIMEOUT_HISTOGRAMA)
+        resultado.update(calculadas)
+
+    hora_actual = next((hora for hora, inicio in enumerate(inicios) if inicio <= ahora < inicio + timedelta(hours=1)), None)
+    if hora_actual is not None:
+        resultado[hora_actual] = Pedido.objects.filter(
+            empresa=empresa, estado='Completado', fecha__gte=inicios[hora_actual], fecha__lte=ahora,
+        ).aggregate(total=Sum('total'))['total'] or Decimal('0.00')
+    return resultado
+
+
+def ventas_por_dia(empresa, fecha_inicio, fecha_fin):
+    """
+    {fecha: ventas netas de cancelaciones} entre dos fechas locales. Los días anteriores
+    a hoy salen del cache y los que falten se leen juntos del resumen diario; hoy se lee
+    siempre de su fila de VentaDia.
+    """
+    hoy = timezone.localdate()
+    fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+    cerrados = {clave_dia(empresa.id, fecha): fecha for fecha in fechas if fecha < hoy}
+
+    guardados = cache.get_many(cerrados)
+    resultado = {cerrados[clave]: valor for clave, valor in guardados.items()}
+    pendientes = [fecha for clave, fecha in cerrados.items() if clave not in guardados]
+    if hoy in fechas:
+        pendientes.append(hoy)
+    if pendientes:
+        calculados = dict.fromkeys(pendientes, Decimal('0.00'))
+        for fecha, total, total_cancelado in VentaDia.objects.filter(
+            empresa=empresa, fecha__in=pendientes
+        ).values_list('fecha', 'total', 'total_cancelado'):
+            calculados[fecha] = total - total_cancelado
+        cache.set_many({clave_dia(empresa.id, fecha): total for fecha, total in calculados.items() if fecha < hoy}, TIMEOUT_HISTOGRAMA)
+        resultado.update(calculados)
+    return resultado
+
+
+def invalidar_histograma(empresa, fechas):
+    """Borra las cubetas de hora y de día que contienen esas fechas (p. ej. al cancelar un ticket de la mañana)."""
+    # Una venta de la hora en curso no toca ninguna cubeta guardada.
+    hora_en_curso = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+    claves = set()
+    for fecha in fechas:
+        local = timezone.localtime(fecha)
+        if local >= hora_en_curso:
+            continue
+        claves.add(clave_hora(empresa.id, local))
+        claves.add(clave_dia(empresa.id, local.date()))
+    if claves:
+        # Ahora y otra vez al confirmar, igual que invalidar_reportes: una lectura concurrente
+        # que todavía ve el pedido sin cancelar podría volver a guardar la cubeta vieja.
+        cache.delete_many(claves)
+        transaction.on_commit(lambda: cache.delete_many(claves))
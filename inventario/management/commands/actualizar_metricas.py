@@ -0,0 +1,21 @@
+# inventario/management/commands/actualizar_metricas.py
+
+from django.core.management.base import BaseCommand
+from inventario.models import MetricasPlataforma
+from inventario.metricas import actualizar_metricas
+
+
+class Command(BaseCommand):
+    help = "Guarda una foto nueva de las métricas de crecimiento del admin y borra las fotos viejas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conservar', type=int, default=500, help="Fotos más recientes que se conservan.")
+
+    def handle(self, *args, **options):
+        metricas = actualizar_metricas()
+        viejas = MetricasPlataforma.objects.order_by('-calculado').values_list('id', flat=True)[options['conservar']:]
+        borradas, _ = MetricasPlataforma.objects.filter(id__in=list(viejas)).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Métricas actualizadas: {metricas.total_empresas} empresas, {metricas.total_pedidos} pedidos"
+            f" (${metricas.monto_total_vendido:,.2f}). Fotos viejas borradas: {borradas}."
+        ))
@@ -0,0 +1,42 @@
+# inventario/management/commands/actualizar_pronosticos.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Min
+from inventario.models import Empresa
+from inventario.pronostico import actualizar_pronosticos
+
+
+class Command(BaseCommand):
+    help = ("Recalcula el pronóstico de demanda y el punto de reorden de los productos con inventario. "
+            "Pensado para correr cada noche; empieza por las empresas con el pronóstico más viejo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa', type=int, help="ID de la empresa a procesar (por defecto, todas).")
+        parser.add_argument('--presupuesto', type=float, default=300,
+                            help="Segundos máximos de trabajo; las empresas que no alcancen quedan para la siguiente corrida.")
+
+    def handle(self, *args, **options):
+        empresas = Empresa.objects.annotate(
+            ultimo=Min('pronosticoproducto__calculado')
+        ).order_by(F('ultimo').asc(nulls_first=True), 'id')
+        if options['empresa']:
+            empresas = empresas.filter(id=options['empresa'])
+            if not empresas.exists():
+                raise CommandError(f"No existe la empresa {options['empresa']}.")
+
+        limite = time.monotonic() + options['presupuesto']
+        procesadas = productos = 0
+        pendientes = []
+        for empresa in empresas:
+            if time.monotonic() >= limite:
+                pendientes.append(empresa.nombre)
+                continue
+            productos += actualizar_pronosticos(empresa)
+            procesadas += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Pronósticos actualizados: {procesadas} empresas, {productos} productos."))
+        if pendientes:
+            self.stdout.write(self.style.WARNING(
+                f"Se agotó el presupuesto de tiempo; quedan {len(pendientes)} empresas para la siguiente corrida: {', '.join(pendientes)}"
+            ))
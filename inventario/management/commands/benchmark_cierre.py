@@ -0,0 +1,63 @@
+# inventario/management/commands/benchmark_cierre.py
+
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from inventario.caja import cerrar_dias, reconstruir_libro
+from inventario.models import Empresa, Pedido, Retiro
+
+
+class Command(BaseCommand):
+    help = "Mide el cierre de varios días atrasados de una vez contra cerrarlos uno por uno."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=28, help="Días atrasados sin arqueo.")
+        parser.add_argument('--ventas', type=int, default=200, help="Ventas por día.")
+        parser.add_argument('--retiros', type=int, default=3, help="Retiros por día.")
+
+    def _sembrar(self, dias, ventas, retiros):
+        empresa = Empresa.objects.create(nombre=f"benchmark-cierre-{uuid.uuid4().hex[:8]}")
+        hoy = timezone.localdate()
+        fechas = [hoy - timedelta(days=dia) for dia in range(dias, 0, -1)]
+        minutos = 12 * 60 // max(ventas, 1)
+        for fecha in fechas:
+            apertura = timezone.make_aware(datetime.combine(fecha, datetime.min.time())) + timedelta(hours=8)
+            Pedido.objects.bulk_create([
+                Pedido(empresa=empresa, fecha=apertura + timedelta(minutes=minutos * n), total=Decimal('150.00'),
+                       metodo_pago='Efectivo' if n % 3 else 'Tarjeta', estado='Cancelado' if n % 50 == 0 else 'Completado')
+                for n in range(ventas)
+            ], batch_size=1000)
+            Retiro.objects.bulk_create([
+                Retiro(empresa=empresa, fecha=apertura + timedelta(hours=n + 1), monto=Decimal('200.00'), concepto="Gasto")
+                for n in range(retiros)
+            ])
+        reconstruir_libro(empresa)
+        return empresa, fechas
+
+    def _medir(self, funcion):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            funcion()
+            duracion = time.perf_counter() - inicio
+        return len(consultas), duracion
+
+    def handle(self, *args, **options):
+        dias, ventas, retiros = options['dias'], options['ventas'], options['retiros']
+        self.stdout.write(f"Días atrasados: {dias}  Ventas por día: {ventas}  Retiros por día: {retiros}")
+
+        lote, fechas = self._sembrar(dias, ventas, retiros)
+        consultas, duracion = self._medir(lambda: cerrar_dias(lote, dict.fromkeys(fechas)))
+        self.stdout.write(f"De una vez:   {consultas} consultas, {duracion * 1000:.0f} ms")
+
+        uno_por_uno, fechas = self._sembrar(dias, ventas, retiros)
+        consultas, duracion = self._medir(lambda: [cerrar_dias(uno_por_uno, {fecha: None}) for fecha in fechas])
+        self.stdout.write(f"Uno por uno:  {consultas} consultas, {duracion * 1000:.0f} ms")
+
+        for empresa in (lote, uno_por_uno):
+            Pedido.objects.filter(empresa=empresa).delete()
+            empresa.delete()
@@ -0,0 +1,70 @@
+# inventario/management/commands/benchmark_ventas.py
+
+import threading
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from inventario.carrito import cotizar_carrito
+from inventario.models import Empresa, Pedido, Producto
+from inventario.ventas import registrar_venta
+
+
+class Command(BaseCommand):
+    help = "Mide consultas por venta y ventas por segundo de finalizar_venta con varias terminales concurrentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terminales', type=int, default=4, help="Número de terminales (hilos) vendiendo a la vez.")
+        parser.add_argument('--ventas', type=int, default=50, help="Ventas que registra cada terminal.")
+        parser.add_argument('--lineas', type=int, default=10, help="Líneas por venta.")
+
+    def handle(self, *args, **options):
+        terminales, ventas, lineas = options['terminales'], options['ventas'], options['lineas']
+
+        empresa = Empresa.objects.create(nombre=f"benchmark-{uuid.uuid4().hex[:8]}")
+        productos = Producto.objects.bulk_create([
+            Producto(empresa=empresa, nombre=f"Corte {i}", precio=Decimal('150.00'), stock=Decimal('1000000.000'))
+            for i in range(lineas)
+        ])
+        carrito = {str(p.id): '0.750' for p in productos}
+
+        consultas, errores = [], []
+        candado = threading.Lock()
+
+        def terminal():
+            try:
+                for _ in range(ventas):
+                    try:
+                        with CaptureQueriesContext(connection) as capturadas:
+                            items, total = cotizar_carrito(empresa, carrito)
+                            registrar_venta(empresa, items, total, 'Tarjeta')
+                        with candado:
+                            consultas.append(len(capturadas))
+                    except Exception as error:
+                        with candado:
+                            errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=terminal) for _ in range(terminales)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        vendidas = len(consultas)
+        self.stdout.write(f"Terminales: {terminales}  Líneas por venta: {lineas}")
+        self.stdout.write(f"Ventas registradas: {vendidas}  Errores: {len(errores)}")
+        if vendidas:
+            self.stdout.write(f"Consultas por venta: {sum(consultas) / vendidas:.1f}")
+            self.stdout.write(f"Ventas por segundo: {vendidas / duracion:.1f}")
+        for error in errores[:5]:
+            self.stderr.write(f"  {type(error).__name__}: {error}")
+
+        # Los productos están protegidos por PedidoItem: primero se borran los pedidos de prueba.
+        Pedido.objects.filter(empresa=empresa).delete()
+        empresa.delete()
@@ -0,0 +1,33 @@
+# inventario/management/commands/reconstruir_caja.py
+
+from django.core.management.base import BaseCommand, CommandError
+from inventario.caja import comparar_libro, reconstruir_libro
+from inventario.models import Empresa
+
+
+class Command(BaseCommand):
+    help = "Verifica o reconstruye el libro de caja (CajaDia) a partir de los pedidos y retiros sin arqueo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa', type=int, help="ID de la empresa a procesar (por defecto, todas).")
+        parser.add_argument('--verificar', action='store_true', help="Solo compara el libro contra las tablas, sin modificar nada.")
+
+    def handle(self, *args, **options):
+        empresa = None
+        if options['empresa']:
+            try:
+                empresa = Empresa.objects.get(id=options['empresa'])
+            except Empresa.DoesNotExist:
+                raise CommandError(f"No existe la empresa {options['empresa']}.")
+
+        if options['verificar']:
+            diferencias = comparar_libro(empresa)
+            for empresa_id, fecha, campo, en_libro, esperado in diferencias:
+                self.stdout.write(f"Empresa {empresa_id} {fecha:%d/%m/%Y} {campo}: libro={en_libro} tablas={esperado}")
+            if diferencias:
+                raise CommandError(f"El libro de caja tiene {len(diferencias)} diferencias. Ejecuta el comando sin --verificar para reconstruirlo.")
+            self.stdout.write(self.style.SUCCESS("El libro de caja coincide con los pedidos y retiros."))
+            return
+
+        filas = reconstruir_libro(empresa)
+        self.stdout.write(self.style.SUCCESS(f"Libro de caja reconstruido: {filas} días con movimientos pendientes."))
@@ -0,0 +1,33 @@
+# inventario/management/commands/reconstruir_resumenes.py
+
+from django.core.management.base import BaseCommand, CommandError
+from inventario.models import Empresa
+from inventario.resumenes import comparar_resumenes, reconstruir_resumenes
+
+
+class Command(BaseCommand):
+    help = "Verifica o reconstruye los resúmenes diarios de ventas (VentaDia y VentaProductoDia) a partir de los pedidos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa', type=int, help="ID de la empresa a procesar (por defecto, todas).")
+        parser.add_argument('--verificar', action='store_true', help="Solo compara los resúmenes contra los pedidos, sin modificar nada.")
+
+    def handle(self, *args, **options):
+        empresa = None
+        if options['empresa']:
+            try:
+                empresa = Empresa.objects.get(id=options['empresa'])
+            except Empresa.DoesNotExist:
+                raise CommandError(f"No existe la empresa {options['empresa']}.")
+
+        if options['verificar']:
+            diferencias = comparar_resumenes(empresa)
+            for clave, campo, guardado, esperado in diferencias:
+                self.stdout.write(f"{clave} {campo}: resumen={guardado} pedidos={esperado}")
+            if diferencias:
+                raise CommandError(f"Los resúmenes tienen {len(diferencias)} diferencias. Ejecuta el comando sin --verificar para reconstruirlos.")
+            self.stdout.write(self.style.SUCCESS("Los resúmenes coinciden con los pedidos."))
+            return
+
+        dias, filas_producto = reconstruir_resumenes(empresa)
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes reconstruidos: {dias} días y {filas_producto} filas por producto."))
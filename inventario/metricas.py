@@ -0,0 +1,50 @@
+# inventario/metricas.py
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from .models import Empresa, MetricasPlataforma, VentaDia
+from .rangos import inicio_del_dia
+
+# Segundos que se reutiliza una foto de métricas antes de recalcularla al abrir el admin.
+VIGENCIA_METRICAS = getattr(settings, 'METRICAS_ADMIN_VIGENCIA', 60 * 15)
+
+
+def calcular_metricas(hoy=None):
+    """
+    Métricas de crecimiento de la plataforma en dos consultas: empresas (totales y nuevas,
+    contadas por la fecha de alta de sus usuarios) y pedidos desde el resumen VentaDia.
+    """
+    hoy = hoy or timezone.localdate()
+    inicio_semana = hoy - timedelta(days=hoy.weekday())
+    inicio_mes = hoy.replace(day=1)
+    empresas = Empresa.objects.aggregate(
+        total_empresas=Count('id', distinct=True),
+        nuevas_semana=Count('id', distinct=True, filter=Q(userprofile__user__date_joined__gte=inicio_del_dia(inicio_semana))),
+        nuevas_mes=Count('id', distinct=True, filter=Q(userprofile__user__date_joined__gte=inicio_del_dia(inicio_mes))),
+    )
+    ventas = VentaDia.objects.aggregate(total_pedidos=Sum('pedidos'), monto_total_vendido=Sum('total'))
+    return {
+        'fecha': hoy,
+        **empresas,
+        'total_pedidos': ventas['total_pedidos'] or 0,
+        'monto_total_vendido': ventas['monto_total_vendido'] or 0,
+    }
+
+
+def actualizar_metricas(hoy=None):
+    """Calcula y guarda una foto nueva de las métricas."""
+    return MetricasPlataforma.objects.create(**calcular_metricas(hoy))
+
+
+def metricas_plataforma():
+    """
+    La foto más reciente si sigue vigente y es de hoy; si no, se recalcula y se guarda.
+    En la mayoría de las cargas del admin esto es una sola lectura por índice.
+    """
+    hoy = timezone.localdate()
+    ultima = MetricasPlataforma.objects.order_by('-calculado').first()
+    if ultima is None or ultima.fecha != hoy or ultima.calculado < timezone.now() - timedelta(seconds=VIGENCIA_METRICAS):
+        ultima = actualizar_metricas(hoy)
+    return ultima
@@ -0,0 +1,21 @@
+# inventario/middleware.py
+
+
+class EmpresaMiddleware:
+    """
+    Resuelve una sola vez por petición la empresa del usuario y la deja en `request.empresa`
+    (None si no hay sesión o el usuario aún no registra su negocio). Con EmpresaModelBackend
+    el perfil y la empresa llegan junto con el usuario, así que esto no agrega consultas ni
+    escribe en la sesión.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.empresa = None
+        if request.user.is_authenticated:
+            perfil = getattr(request.user, 'profile', None)
+            if perfil is not None:
+                request.empresa = perfil.empresa
+        return self.get_response(request)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def crear_contadores(apps, schema_editor):
+    """Arranca cada contador en el último ticket_numero que ya tiene la empresa."""
+    Empresa = apps.get_model('inventario', 'Empresa')
+    ContadorTicket = apps.get_model('inventario', 'ContadorTicket')
+    ContadorTicket.objects.bulk_create([
+        ContadorTicket(empresa_id=empresa['id'], ultimo_numero=empresa['ultimo'] or 0)
+        for empresa in Empresa.objects.annotate(ultimo=Max('pedido__ticket_numero')).values('id', 'ultimo')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_numero', models.PositiveIntegerField(default=0)),
+                ('empresa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='contador_ticket', to='inventario.empresa')),
+            ],
+        ),
+        migrations.RunPython(crear_contadores, migrations.RunPython.noop),
+    ]
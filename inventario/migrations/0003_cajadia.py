@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:04
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def llenar_libro_de_caja(apps, schema_editor):
+    """Carga el libro con los pedidos y retiros que hoy siguen sin arqueo (igual que `reconstruir_caja`)."""
+    Pedido = apps.get_model('inventario', 'Pedido')
+    Retiro = apps.get_model('inventario', 'Retiro')
+    CajaDia = apps.get_model('inventario', 'CajaDia')
+
+    libro = {}
+    completados = Q(estado='Completado')
+    for dato in Pedido.objects.filter(arqueo__isnull=True).annotate(dia=TruncDate('fecha')).values('empresa_id', 'dia').annotate(
+        efectivo=Sum('total', filter=completados & Q(metodo_pago='Efectivo')),
+        tarjeta=Sum('total', filter=completados & Q(metodo_pago='Tarjeta')),
+        movimientos=Count('id'),
+    ).order_by():
+        fila = libro.setdefault((dato['empresa_id'], dato['dia']), CajaDia(empresa_id=dato['empresa_id'], fecha=dato['dia']))
+        fila.ventas_efectivo = dato['efectivo'] or Decimal('0.00')
+        fila.ventas_tarjeta = dato['tarjeta'] or Decimal('0.00')
+        fila.movimientos_pendientes += dato['movimientos']
+
+    for dato in Retiro.objects.filter(arqueo__isnull=True).annotate(dia=TruncDate('fecha')).values('empresa_id', 'dia').annotate(
+        monto=Sum('monto'), movimientos=Count('id'),
+    ).order_by():
+        fila = libro.setdefault((dato['empresa_id'], dato['dia']), CajaDia(empresa_id=dato['empresa_id'], fecha=dato['dia']))
+        fila.retiros = dato['monto'] or Decimal('0.00')
+        fila.movimientos_pendientes += dato['movimientos']
+
+    CajaDia.objects.bulk_create(libro.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0002_contadorticket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CajaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('ventas_efectivo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('ventas_tarjeta', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('retiros', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('movimientos_pendientes', models.PositiveIntegerField(default=0)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.empresa')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('empresa', 'fecha'), name='caja_dia_unica_por_empresa')],
+            },
+        ),
+        migrations.RunPython(llenar_libro_de_caja, migrations.RunPython.noop),
+    ]
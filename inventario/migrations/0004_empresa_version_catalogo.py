@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0003_cajadia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empresa',
+            name='version_catalogo',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0005_pedido_uuid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='codigo',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='producto',
+            constraint=models.UniqueConstraint(fields=('empresa', 'codigo'), name='producto_codigo_unico_por_empresa'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:14
+
+import django.db.models.deletion
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def llenar_resumenes(apps, schema_editor):
+    """Carga los resúmenes con todos los pedidos existentes (igual que `reconstruir_resumenes`)."""
+    Pedido = apps.get_model('inventario', 'Pedido')
+    PedidoItem = apps.get_model('inventario', 'PedidoItem')
+    VentaDia = apps.get_model('inventario', 'VentaDia')
+    VentaProductoDia = apps.get_model('inventario', 'VentaProductoDia')
+    centavos = lambda valor: valor.quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+    dias, productos = {}, {}
+    for pedido in Pedido.objects.values('empresa_id', 'fecha', 'total', 'estado').iterator():
+        clave = (pedido['empresa_id'], timezone.localdate(pedido['fecha']))
+        dia = dias.setdefault(clave, VentaDia(empresa_id=clave[0], fecha=clave[1]))
+        dia.pedidos += 1
+        dia.total += pedido['total']
+        if pedido['estado'] == 'Cancelado':
+            dia.cancelados += 1
+            dia.total_cancelado += pedido['total']
+
+    for item in PedidoItem.objects.filter(pedido__estado='Completado').values(
+        'pedido__empresa_id', 'pedido__fecha', 'producto_id', 'producto__costo', 'producto__unidad_medida',
+        'cantidad', 'precio_unitario',
+    ).iterator():
+        empresa_id, fecha = item['pedido__empresa_id'], timezone.localdate(item['pedido__fecha'])
+        costo = centavos(item['cantidad'] * item['producto__costo'])
+        dia = dias[(empresa_id, fecha)]
+        dia.costo += costo
+        if item['producto__unidad_medida'] == 'kg':
+            dia.kg_vendidos += item['cantidad']
+        fila = productos.setdefault((item['producto_id'], fecha), VentaProductoDia(
+            empresa_id=empresa_id, producto_id=item['producto_id'], fecha=fecha
+        ))
+        fila.cantidad += item['cantidad']
+        fila.total += centavos(item['cantidad'] * item['precio_unitario'])
+        fila.costo += costo
+
+    VentaDia.objects.bulk_create(dias.values(), batch_size=1000)
+    VentaProductoDia.objects.bulk_create(productos.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0006_producto_codigo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('pedidos', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('cancelados', models.PositiveIntegerField(default=0)),
+                ('total_cancelado', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('costo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('kg_vendidos', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=14)),
+                ('arqueo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventario.arqueo')),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.empresa')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('empresa', 'fecha'), name='venta_dia_unica_por_empresa')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaProductoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cantidad', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=14)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('costo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.empresa')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.producto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['empresa', 'fecha'], name='venta_prod_dia_empresa_fecha')],
+                'constraints': [models.UniqueConstraint(fields=('producto', 'fecha'), name='venta_producto_dia_unica')],
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
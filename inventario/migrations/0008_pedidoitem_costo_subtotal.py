@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:17
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def copiar_costo_y_subtotal(apps, schema_editor):
+    """
+    Las líneas viejas no guardaron su costo; se usa el costo actual del producto, que es
+    lo que los reportes venían usando. El subtotal sí se puede calcular exacto.
+    """
+    PedidoItem = apps.get_model('inventario', 'PedidoItem')
+    lote = []
+    for item in PedidoItem.objects.select_related('producto').only(
+        'cantidad', 'precio_unitario', 'producto__costo'
+    ).iterator(chunk_size=2000):
+        item.costo_unitario = item.producto.costo
+        item.subtotal = (item.cantidad * item.precio_unitario).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        lote.append(item)
+        if len(lote) == 2000:
+            PedidoItem.objects.bulk_update(lote, ['costo_unitario', 'subtotal'])
+            lote = []
+    PedidoItem.objects.bulk_update(lote, ['costo_unitario', 'subtotal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0007_resumenes_de_ventas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedidoitem',
+            name='costo_unitario',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='pedidoitem',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(copiar_costo_y_subtotal, migrations.RunPython.noop),
+    ]
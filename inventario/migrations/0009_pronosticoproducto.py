@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0008_pedidoitem_costo_subtotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PronosticoProducto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calculado', models.DateTimeField(default=django.utils.timezone.now)),
+                ('demanda_diaria', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=10)),
+                ('punto_reorden', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=10)),
+                ('cantidad_sugerida', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=10)),
+                ('dias_cobertura', models.DecimalField(blank=True, decimal_places=1, max_digits=6, null=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.empresa')),
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pronostico', to='inventario.producto')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:26
+
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0009_pronosticoproducto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricasPlataforma',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calculado', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('fecha', models.DateField()),
+                ('total_empresas', models.PositiveIntegerField(default=0)),
+                ('nuevas_semana', models.PositiveIntegerField(default=0)),
+                ('nuevas_mes', models.PositiveIntegerField(default=0)),
+                ('total_pedidos', models.PositiveIntegerField(default=0)),
+                ('monto_total_vendido', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+            options={
+                'get_latest_by': 'calculado',
+            },
+        ),
+    ]
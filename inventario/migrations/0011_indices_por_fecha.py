@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0010_metricasplataforma'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['empresa', 'fecha'], name='pedido_empresa_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(condition=models.Q(('arqueo__isnull', True)), fields=['empresa', 'fecha'], name='pedido_sin_arqueo_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='retiro',
+            index=models.Index(fields=['empresa', 'fecha'], name='retiro_empresa_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='retiro',
+            index=models.Index(condition=models.Q(('arqueo__isnull', True)), fields=['empresa', 'fecha'], name='retiro_sin_arqueo_fecha'),
+        ),
+    ]
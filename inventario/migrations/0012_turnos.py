@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0011_indices_por_fecha'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Turno',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('caja', models.CharField(default='Caja 1', max_length=50)),
+                ('apertura', models.DateTimeField(default=django.utils.timezone.now)),
+                ('cierre', models.DateTimeField(blank=True, null=True)),
+                ('fondo_inicial', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('ventas_efectivo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('ventas_tarjeta', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('retiros', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('movimientos', models.PositiveIntegerField(default=0)),
+                ('abierto_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='turnos_abiertos', to=settings.AUTH_USER_MODEL)),
+                ('arqueo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='turno', to='inventario.arqueo')),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventario.empresa')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='turno',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pedidos', to='inventario.turno'),
+        ),
+        migrations.AddField(
+            model_name='retiro',
+            name='turno',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='retiros_del_turno', to='inventario.turno'),
+        ),
+        migrations.AddConstraint(
+            model_name='turno',
+            constraint=models.UniqueConstraint(condition=models.Q(('cierre__isnull', True)), fields=('empresa', 'caja'), name='turno_abierto_unico_por_caja'),
+        ),
+    ]
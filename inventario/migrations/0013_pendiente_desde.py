@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:42
+
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+
+
+def llenar_pendiente_desde(apps, schema_editor):
+    """Toma el día pendiente más antiguo del libro de caja de cada empresa (igual que `reconstruir_caja`)."""
+    Empresa = apps.get_model('inventario', 'Empresa')
+    CajaDia = apps.get_model('inventario', 'CajaDia')
+    mas_antiguo = CajaDia.objects.filter(empresa=OuterRef('pk'), movimientos_pendientes__gt=0).values('empresa').annotate(f=Min('fecha')).values('f')
+    Empresa.objects.update(pendiente_desde=Subquery(mas_antiguo))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0012_turnos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empresa',
+            name='pendiente_desde',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cajadia',
+            index=models.Index(condition=models.Q(('movimientos_pendientes__gt', 0)), fields=['empresa', 'fecha'], name='caja_dia_pendiente'),
+        ),
+        migrations.RunPython(llenar_pendiente_desde, migrations.RunPython.noop),
+    ]
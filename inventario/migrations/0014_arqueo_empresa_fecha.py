@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0013_pendiente_desde'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='arqueo',
+            index=models.Index(fields=['empresa', '-fecha', '-id'], name='arqueo_empresa_fecha'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 14:06
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0015_devoluciones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='arqueo',
+            name='diferencia',
+            field=models.DecimalField(blank=True, decimal_places=2, default=Decimal('0.00'), max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='arqueo',
+            name='monto_contado',
+            field=models.DecimalField(blank=True, decimal_places=2, default=Decimal('0.00'), max_digits=10, null=True),
+        ),
+    ]
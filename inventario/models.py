@@ -1,11 +1,21 @@
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import User
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 
 class Empresa(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     giro = models.CharField(max_length=100, blank=True, null=True, help_text="Ej. Abarrotes, Ropa, Ferretería, etc.")
+    # Cambia cada vez que cambia un producto; forma parte de la clave del catálogo en cache.
+    version_catalogo = models.PositiveIntegerField(default=1)
+    # Día de negocio más antiguo del libro de caja con movimientos sin arqueo (None si no hay).
+    # Lo adelantan registrar_en_caja y cerrar_dias; el POS lo lee sin consultar nada más.
+    pendiente_desde = models.DateField(null=True, blank=True)
+
+    def subir_version_catalogo(self):
+        Empresa.objects.filter(id=self.id).update(version_catalogo=F('version_catalogo') + 1)
+        self.version_catalogo += 1
 
     def __str__(self):
         return self.nombre
@@ -36,6 +46,23 @@ class Producto(models.Model):
 
     is_active = models.BooleanField(default=True)
 
+    # PLU de la báscula o código de barras del empaque; único dentro de cada empresa.
+    codigo = models.CharField(max_length=20, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # El índice de esta restricción es el que usa la búsqueda al escanear.
+            models.UniqueConstraint(fields=['empresa', 'codigo'], name='producto_codigo_unico_por_empresa'),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Cualquier cambio (alta, edición, archivar/reactivar) invalida el catálogo en cache.
+        if Producto.empresa.is_cached(self):
+            self.empresa.subir_version_catalogo()
+        else:
+            Empresa.objects.filter(id=self.empresa_id).update(version_catalogo=F('version_catalogo') + 1)
+
     def __str__(self):
         return self.nombre
 
@@ -55,13 +82,137 @@ class Arqueo(models.Model):
     ventas_tarjeta = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     retiros = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     efectivo_esperado = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
-    monto_contado = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
-    diferencia = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # Ambos quedan en NULL cuando el día se cerró sin contar el efectivo (ver caja.cerrar_dias).
+    monto_contado = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), null=True, blank=True)
+    diferencia = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), null=True, blank=True)
     cerrado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Páginas de reporte_arqueos por (fecha, id) y acumulado de 30 días por rango de fecha.
+            models.Index(fields=['empresa', '-fecha', '-id'], name='arqueo_empresa_fecha'),
+        ]
+
     def __str__(self):
         return f"Arqueo del {self.fecha.strftime('%d/%m/%Y')} - {self.empresa.nombre}"
 
+class CajaDia(models.Model):
+    """
+    Libro de caja por empresa y día de negocio (fecha local). Guarda los totales de los
+    movimientos que todavía no se sellan en un arqueo, para que el encabezado del POS y
+    la pantalla de arqueo lean una sola fila en lugar de agregar Pedido y Retiro.
+    Lo mantienen finalizar_venta, cancelar_pedido, gestion_caja y cerrar_caja
+    (ver inventario/caja.py); `manage.py reconstruir_caja` lo recalcula desde las tablas.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    ventas_efectivo = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    ventas_tarjeta = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    retiros = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Pedidos (incluidos los cancelados) y retiros del día que aún no tienen arqueo.
+    movimientos_pendientes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['empresa', 'fecha'], name='caja_dia_unica_por_empresa'),
+        ]
+        indexes = [
+            # Solo los días pendientes: recalcular Empresa.pendiente_desde no recorre los días ya cerrados.
+            models.Index(fields=['empresa', 'fecha'], name='caja_dia_pendiente',
+                         condition=models.Q(movimientos_pendientes__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"Caja del {self.fecha.strftime('%d/%m/%Y')} - {self.empresa.nombre}"
+
+class Turno(models.Model):
+    """
+    Turno de una caja registradora: desde que un cajero la abre hasta que la cierra con su
+    propio arqueo. Las ventas y retiros hechos dentro del turno se suman aquí (no en el libro
+    del día, CajaDia), así que dos cajas abiertas a la vez no compiten por esa fila ni se
+    bloquean entre sí con el arqueo pendiente del día (ver inventario/turnos.py). Cada venta
+    sigue actualizando filas compartidas por todas las cajas: el folio (ContadorTicket), el
+    stock de cada producto vendido y los resúmenes del día (VentaDia y VentaProductoDia); en
+    esas filas las cajas todavía se forman una tras otra hasta que confirma la venta anterior.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    caja = models.CharField(max_length=50, default='Caja 1')
+    abierto_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='turnos_abiertos')
+    apertura = models.DateTimeField(default=timezone.now)
+    cierre = models.DateTimeField(null=True, blank=True)
+    fondo_inicial = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    ventas_efectivo = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    ventas_tarjeta = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    retiros = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    movimientos = models.PositiveIntegerField(default=0)
+    arqueo = models.OneToOneField(Arqueo, on_delete=models.SET_NULL, null=True, blank=True, related_name='turno')
+
+    class Meta:
+        constraints = [
+            # Una caja solo puede tener un turno abierto.
+            models.UniqueConstraint(fields=['empresa', 'caja'], condition=models.Q(cierre__isnull=True), name='turno_abierto_unico_por_caja'),
+        ]
+
+    @property
+    def efectivo_esperado(self):
+        return self.fondo_inicial + self.ventas_efectivo - self.retiros
+
+    def __str__(self):
+        return f"{self.caja} desde {timezone.localtime(self.apertura).strftime('%d/%m/%Y %H:%M')}"
+
+class ContadorTicket(models.Model):
+    """
+    Último número de ticket entregado por empresa. El incremento es un UPDATE que bloquea
+    la fila hasta que termina la transacción de la venta: dos cajeros no pueden recibir el
+    mismo número y, si la venta se revierte, el número se libera (sin huecos).
+    """
+    empresa = models.OneToOneField(Empresa, on_delete=models.CASCADE, related_name='contador_ticket')
+    ultimo_numero = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def _incrementar(cls, empresa, cantidad):
+        """
+        Suma `cantidad` al contador y devuelve el nuevo último número, o None si la empresa aún
+        no tiene contador. En PostgreSQL y SQLite 3.35+ es un solo UPDATE … RETURNING; MySQL y
+        MariaDB no admiten RETURNING en un UPDATE, así que ahí se lee la fila después, cuando ya
+        está bloqueada por esta transacción y nadie más puede moverla.
+        """
+        if connection.vendor == 'postgresql' or (connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)):
+            tabla = connection.ops.quote_name(cls._meta.db_table)
+            columna = connection.ops.quote_name(cls._meta.get_field('ultimo_numero').column)
+            llave = connection.ops.quote_name(cls._meta.get_field('empresa').column)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {tabla} SET {columna} = {columna} + %s WHERE {llave} = %s RETURNING {columna}",
+                    [cantidad, empresa.id],
+                )
+                fila = cursor.fetchone()
+            return fila[0] if fila else None
+        if not cls.objects.filter(empresa=empresa).update(ultimo_numero=F('ultimo_numero') + cantidad):
+            return None
+        return cls.objects.filter(empresa=empresa).values_list('ultimo_numero', flat=True).get()
+
+    @classmethod
+    def reservar(cls, empresa, cantidad=1):
+        """Reserva `cantidad` números consecutivos y devuelve el primero del bloque."""
+        # savepoint=False: dentro de la venta no hace falta un savepoint extra, el bloqueo dura lo que dure la venta.
+        with transaction.atomic(savepoint=False):
+            ultimo_numero = cls._incrementar(empresa, cantidad)
+            if ultimo_numero is None:
+                try:
+                    with transaction.atomic():
+                        # Primer ticket de la empresa: el contador arranca donde se quedó el historial.
+                        ultimo = Pedido.objects.filter(empresa=empresa).aggregate(models.Max('ticket_numero'))['ticket_numero__max'] or 0
+                        ultimo_numero = ultimo + cantidad
+                        cls.objects.create(empresa=empresa, ultimo_numero=ultimo_numero)
+                except IntegrityError:
+                    # Otra terminal creó el contador al mismo tiempo; usamos el suyo.
+                    ultimo_numero = cls._incrementar(empresa, cantidad)
+        return ultimo_numero - cantidad + 1
+
+    def __str__(self):
+        return f"Contador de tickets de {self.empresa.nombre}: #{self.ultimo_numero}"
+
 class Pedido(models.Model):
     # --- CAMPOS NUEVOS ---
     ESTADO_CHOICES = [
@@ -80,20 +231,33 @@ class Pedido(models.Model):
         ('Tarjeta', 'Tarjeta'),
     ]
     cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True)
-    fecha = models.DateTimeField(auto_now_add=True)
+    # Por defecto es el momento del cobro; las ventas capturadas sin conexión conservan su hora original.
+    fecha = models.DateTimeField(default=timezone.now)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     metodo_pago = models.CharField(max_length=10, choices=METODO_PAGO_CHOICES, default='Efectivo')
     monto_recibido = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     cambio_entregado = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     arqueo = models.ForeignKey(Arqueo, on_delete=models.SET_NULL, null=True, blank=True, related_name='pedidos')
+    # Turno de caja en el que se cobró; nulo si la tienda usa el arqueo por día.
+    turno = models.ForeignKey(Turno, on_delete=models.SET_NULL, null=True, blank=True, related_name='pedidos')
+    # Identificador generado por la terminal; evita registrar dos veces una venta reenviada.
+    uuid = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['empresa', 'uuid'], name='pedido_uuid_unico_por_empresa'),
+        ]
+        # Los filtros por día usan rangos UTC sobre `fecha` (ver inventario/rangos.py).
+        # El índice parcial solo guarda los pedidos que esperan arqueo, así que el cierre de
+        # caja no recorre el historial ya sellado.
+        indexes = [
+            models.Index(fields=['empresa', 'fecha'], name='pedido_empresa_fecha'),
+            models.Index(fields=['empresa', 'fecha'], condition=models.Q(arqueo__isnull=True), name='pedido_sin_arqueo_fecha'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.ticket_numero:
-            last_pedido = Pedido.objects.filter(empresa=self.empresa).order_by('-ticket_numero').first()
-            if last_pedido and last_pedido.ticket_numero:
-                self.ticket_numero = last_pedido.ticket_numero + 1
-            else:
-                self.ticket_numero = 1
+            self.ticket_numero = ContadorTicket.reservar(self.empresa)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -105,17 +269,114 @@ class PedidoItem(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.PROTECT)
     cantidad = models.DecimalField(max_digits=10, decimal_places=3)
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    # Copias tomadas al momento de la venta: los reportes de margen no dependen del costo actual del producto.
+    costo_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    @property
+    def costo_total(self):
+        return (self.cantidad * self.costo_unitario).quantize(Decimal('0.01'), ROUND_HALF_UP)
 
     def __str__(self):
         return f"{self.cantidad} kg de {self.producto.nombre}"
 
+class Devolucion(models.Model):
+    """
+    Devolución parcial de una línea de pedido (algunos kilos o piezas). El importe ya se
+    descontó de Pedido.total, del libro de caja (o del turno) y de los resúmenes del día, así
+    que los reportes no vuelven a recorrer el ticket; la línea original se queda como se vendió.
+    `importe` y `costo` se reparten de modo que las devoluciones de una línea sumen, a lo más,
+    su subtotal y su costo (ver ventas.devolver_lineas).
+    """
+    pedido = models.ForeignKey(Pedido, related_name='devoluciones', on_delete=models.CASCADE)
+    item = models.ForeignKey(PedidoItem, related_name='devoluciones', on_delete=models.CASCADE)
+    cantidad = models.DecimalField(max_digits=10, decimal_places=3)
+    importe = models.DecimalField(max_digits=12, decimal_places=2)
+    costo = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    fecha = models.DateTimeField(default=timezone.now)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='devoluciones')
+
+    def __str__(self):
+        return f"Devolución de {self.cantidad} de {self.item.producto.nombre} (ticket #{self.pedido.ticket_numero})"
+
+class VentaDia(models.Model):
+    """
+    Resumen de ventas por empresa y día de negocio (fecha local) para los tableros.
+    `total` incluye los pedidos cancelados y `total_cancelado` los descuenta; costo y
+    kilos ya son netos de cancelaciones. Todo es neto de devoluciones parciales. Lo mantienen
+    registrar_venta, la captura por lote, cancelar_pedido, las devoluciones y cerrar_caja (ver inventario/resumenes.py);
+    `manage.py reconstruir_resumenes` lo recalcula desde los pedidos.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    pedidos = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    cancelados = models.PositiveIntegerField(default=0)
+    total_cancelado = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    costo = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    kg_vendidos = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0.000'))
+    # Último arqueo que cerró el día; mientras sea nulo el día puede seguir cambiando.
+    arqueo = models.ForeignKey(Arqueo, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['empresa', 'fecha'], name='venta_dia_unica_por_empresa'),
+        ]
+
+    def __str__(self):
+        return f"Ventas del {self.fecha.strftime('%d/%m/%Y')} - {self.empresa.nombre}"
+
+class VentaProductoDia(models.Model):
+    """Resumen por producto y día de negocio; cantidades, importes y costos netos de cancelaciones."""
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    cantidad = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0.000'))
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    costo = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'fecha'], name='venta_producto_dia_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['empresa', 'fecha'], name='venta_prod_dia_empresa_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto.nombre} el {self.fecha.strftime('%d/%m/%Y')}"
+
+class PronosticoProducto(models.Model):
+    """
+    Último pronóstico de demanda de un producto con inventario (ver inventario/pronostico.py).
+    Lo recalcula cada noche `manage.py actualizar_pronosticos`.
+    """
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    producto = models.OneToOneField(Producto, on_delete=models.CASCADE, related_name='pronostico')
+    calculado = models.DateTimeField(default=timezone.now)
+    # Demanda promedio por día pronosticada para la próxima semana (kg o piezas).
+    demanda_diaria = models.DecimalField(max_digits=10, decimal_places=3, default=Decimal('0.000'))
+    punto_reorden = models.DecimalField(max_digits=10, decimal_places=3, default=Decimal('0.000'))
+    cantidad_sugerida = models.DecimalField(max_digits=10, decimal_places=3, default=Decimal('0.000'))
+    # Días que alcanza el stock actual; nulo si alcanza más allá del horizonte del pronóstico.
+    dias_cobertura = models.DecimalField(max_digits=6, decimal_places=1, null=True, blank=True)
+
+    def __str__(self):
+        return f"Pronóstico de {self.producto.nombre}"
+
 class Retiro(models.Model):
     empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
     fecha = models.DateTimeField(default=timezone.now)
     monto = models.DecimalField(max_digits=10, decimal_places=2)
     concepto = models.CharField(max_length=255)
     arqueo = models.ForeignKey(Arqueo, on_delete=models.SET_NULL, null=True, blank=True, related_name='retiros_del_arqueo')
+    turno = models.ForeignKey(Turno, on_delete=models.SET_NULL, null=True, blank=True, related_name='retiros_del_turno')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['empresa', 'fecha'], name='retiro_empresa_fecha'),
+            models.Index(fields=['empresa', 'fecha'], condition=models.Q(arqueo__isnull=True), name='retiro_sin_arqueo_fecha'),
+        ]
 
     def __str__(self):
         return f"Retiro de ${self.monto} el {self.fecha.strftime('%d/%m/%Y')} - {self.concepto}"
@@ -125,4 +386,24 @@ class UserProfile(models.Model):
     empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
 
     def __str__(self):
-        return f"Perfil de {self.user.username} en {self.empresa.nombre}"
\ No newline at end of file
+        return f"Perfil de {self.user.username} en {self.empresa.nombre}"
+
+class MetricasPlataforma(models.Model):
+    """
+    Foto de las métricas de crecimiento que muestra la portada del admin. Se recalcula a lo
+    más cada METRICAS_ADMIN_VIGENCIA segundos (o con `manage.py actualizar_metricas`) en lugar
+    de agregar todas las empresas y pedidos en cada carga (ver inventario/metricas.py).
+    """
+    calculado = models.DateTimeField(default=timezone.now, db_index=True)
+    fecha = models.DateField()
+    total_empresas = models.PositiveIntegerField(default=0)
+    nuevas_semana = models.PositiveIntegerField(default=0)
+    nuevas_mes = models.PositiveIntegerField(default=0)
+    total_pedidos = models.PositiveIntegerField(default=0)
+    monto_total_vendido = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        get_latest_by = 'calculado'
+
+    def __str__(self):
+        return f"Métricas del {timezone.localtime(self.calculado).strftime('%d/%m/%Y %H:%M')}"
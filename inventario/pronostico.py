@@ -0,0 +1,127 @@
+# inventario/pronostico.py
+
+from datetime import timedelta
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .analitica import matrices_por_producto
+from .models import Producto, PronosticoProducto
+
+# Semanas de historia, suavizamiento del nivel y parámetros de resurtido (configurables en settings).
+DIAS_HISTORIA = getattr(settings, 'PRONOSTICO_DIAS_HISTORIA', 56)
+ALFA = getattr(settings, 'PRONOSTICO_ALFA', 0.3)
+DIAS_ENTREGA = getattr(settings, 'PRONOSTICO_DIAS_ENTREGA', 2)
+DIAS_COBERTURA = getattr(settings, 'PRONOSTICO_DIAS_COBERTURA', 7)
+NIVEL_SERVICIO_Z = getattr(settings, 'PRONOSTICO_Z', 1.65)
+HORIZONTE = 60
+# Semanas "ficticias" con índice 1 que se mezclan con el índice observado de cada día de la
+# semana, para que un sábado raro no dispare el pronóstico de todos los sábados.
+SUAVIZADO_ESTACIONAL = 2
+
+
+def indices_dia_semana(cantidad, dia_semana):
+    """Índice multiplicativo producto × día de la semana (promedio 1), encogido hacia 1."""
+    conteo = np.bincount(dia_semana, minlength=7)
+    suma = np.stack([cantidad[:, dia_semana == dia].sum(axis=1) for dia in range(7)], axis=1)
+    promedio_dia = suma / np.maximum(conteo, 1)
+    media = cantidad.mean(axis=1, keepdims=True)
+    bruto = np.divide(promedio_dia, media, out=np.ones_like(promedio_dia), where=media > 0)
+    indice = (conteo * bruto + SUAVIZADO_ESTACIONAL) / (conteo + SUAVIZADO_ESTACIONAL)
+    return indice / indice.mean(axis=1, keepdims=True)
+
+
+def pronosticar(cantidad, primer_dia, horizonte=HORIZONTE, alfa=ALFA):
+    """
+    Suavizamiento exponencial simple sobre la demanda desestacionalizada por día de la
+    semana, para todos los productos a la vez (filas de `cantidad`, columnas = días desde
+    `primer_dia`). Devuelve (pronóstico producto × horizonte desde el día siguiente a la
+    historia, desviación estándar del error a un día).
+    """
+    productos, dias = cantidad.shape
+    dia_semana = (primer_dia.weekday() + np.arange(dias)) % 7
+    indice = indices_dia_semana(cantidad, dia_semana)
+    desestacionalizada = cantidad / indice[:, dia_semana]
+
+    nivel = desestacionalizada[:, :7].mean(axis=1)
+    errores = np.zeros((productos, dias))
+    for t in range(dias):
+        errores[:, t] = cantidad[:, t] - nivel * indice[:, dia_semana[t]]
+        nivel = alfa * desestacionalizada[:, t] + (1 - alfa) * nivel
+    # La primera semana solo sirvió para arrancar el nivel.
+    sigma = errores[:, 7:].std(axis=1) if dias > 8 else errores.std(axis=1)
+
+    dia_semana_futuro = (primer_dia.weekday() + dias + np.arange(horizonte)) % 7
+    return nivel[:, None] * indice[:, dia_semana_futuro], sigma
+
+
+def plan_de_resurtido(pronostico, sigma, stock, dias_entrega=DIAS_ENTREGA, dias_cobertura=DIAS_COBERTURA, z=NIVEL_SERVICIO_Z):
+    """
+    Punto de reorden, cantidad sugerida y días de cobertura por producto.
+    La cantidad sugerida lleva el stock a la demanda de entrega + cobertura (más el stock de
+    seguridad) y solo se sugiere cuando el stock ya está en o bajo el punto de reorden.
+    Los días de cobertura son NaN si el stock alcanza más allá del horizonte.
+    """
+    seguridad = z * sigma * np.sqrt(dias_entrega)
+    punto_reorden = pronostico[:, :dias_entrega].sum(axis=1) + seguridad
+    objetivo = pronostico[:, :dias_entrega + dias_cobertura].sum(axis=1) + seguridad
+    sugerida = np.where(stock <= punto_reorden, np.maximum(objetivo - stock, 0), 0)
+
+    acumulada = np.cumsum(pronostico, axis=1)
+    se_agota = acumulada > stock[:, None]
+    dia = se_agota.argmax(axis=1)
+    filas = np.arange(len(stock))
+    antes = acumulada[filas, dia] - pronostico[filas, dia]
+    fraccion = np.divide(stock - antes, pronostico[filas, dia], out=np.zeros(len(stock)), where=pronostico[filas, dia] > 0)
+    cobertura = np.where(se_agota.any(axis=1), dia + fraccion, np.nan)
+    return punto_reorden, sugerida, cobertura
+
+
+def _decimal(valor, decimales=3):
+    return Decimal(str(round(float(valor), decimales)))
+
+
+def actualizar_pronosticos(empresa, hoy=None):
+    """
+    Recalcula y guarda el pronóstico de todos los productos activos con inventario de la
+    empresa usando la historia hasta ayer. Devuelve cuántos productos se pronosticaron.
+    """
+    hoy = hoy or timezone.localdate()
+    hasta = hoy - timedelta(days=1)
+    desde = hasta - timedelta(days=DIAS_HISTORIA - 1)
+
+    productos = list(Producto.objects.filter(
+        empresa=empresa, is_active=True, requiere_stock=True
+    ).order_by('id').values_list('id', 'stock'))
+    if not productos:
+        PronosticoProducto.objects.filter(empresa=empresa).delete()
+        return 0
+
+    ids = np.array([producto_id for producto_id, _ in productos], dtype=np.int64)
+    stock = np.array([float(stock or 0) for _, stock in productos])
+    ids_con_ventas, cantidad_con_ventas, _, _ = matrices_por_producto(empresa, desde, hasta)
+    # Acomoda la historia en el orden de `ids`; los productos sin ventas quedan en cero.
+    cantidad = np.zeros((len(ids), DIAS_HISTORIA))
+    posicion = np.searchsorted(ids, ids_con_ventas)
+    presentes = (posicion < len(ids)) & (ids[np.minimum(posicion, len(ids) - 1)] == ids_con_ventas)
+    cantidad[posicion[presentes]] = cantidad_con_ventas[presentes]
+
+    pronostico, sigma = pronosticar(np.maximum(cantidad, 0), desde)
+    punto_reorden, sugerida, cobertura = plan_de_resurtido(pronostico, sigma, stock)
+    demanda_diaria = pronostico[:, :7].mean(axis=1)
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        PronosticoProducto.objects.bulk_create([
+            PronosticoProducto(
+                empresa=empresa, producto_id=int(producto_id), calculado=ahora,
+                demanda_diaria=_decimal(demanda_diaria[i]), punto_reorden=_decimal(punto_reorden[i]),
+                cantidad_sugerida=_decimal(sugerida[i]),
+                dias_cobertura=None if np.isnan(cobertura[i]) else _decimal(cobertura[i], 1),
+            ) for i, producto_id in enumerate(ids)
+        ], update_conflicts=True, unique_fields=['producto'],
+           update_fields=['calculado', 'demanda_diaria', 'punto_reorden', 'cantidad_sugerida', 'dias_cobertura'])
+        # Productos archivados o que dejaron de llevar inventario.
+        PronosticoProducto.objects.filter(empresa=empresa).exclude(producto_id__in=ids.tolist()).delete()
+    return len(ids)
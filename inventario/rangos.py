@@ -0,0 +1,30 @@
+# inventario/rangos.py
+
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.utils import timezone
+
+# Un filtro como fecha__date=hoy obliga a la base a convertir la fecha de cada renglón a la
+# zona horaria local antes de comparar, y así no puede usar el índice (empresa, fecha).
+# Estas funciones hacen la conversión al revés, una sola vez: el día de negocio local se
+# vuelve un rango UTC semiabierto [inicio, fin) que se compara directo contra la columna.
+
+
+def inicio_del_dia(fecha):
+    """Instante UTC en que empieza el día de negocio `fecha` en la zona horaria del sitio."""
+    local = datetime.combine(fecha, time.min, tzinfo=timezone.get_current_timezone())
+    return local.astimezone(dt_timezone.utc)
+
+
+def rango_de_dias(fecha_inicio, fecha_fin=None):
+    """(inicio, fin) UTC que cubre los días locales de `fecha_inicio` a `fecha_fin`, ambos incluidos."""
+    fecha_fin = fecha_fin or fecha_inicio
+    return inicio_del_dia(fecha_inicio), inicio_del_dia(fecha_fin + timedelta(days=1))
+
+
+def filtro_de_dias(campo, fecha_inicio, fecha_fin=None):
+    """
+    Argumentos de filter() equivalentes a `campo__date__range=[fecha_inicio, fecha_fin]`
+    (o `campo__date=fecha_inicio`), pero indexables: {campo__gte: inicio, campo__lt: fin}.
+    """
+    inicio, fin = rango_de_dias(fecha_inicio, fecha_fin)
+    return {f'{campo}__gte': inicio, f'{campo}__lt': fin}
@@ -0,0 +1,148 @@
+# inventario/reportes.py
+
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import Arqueo, CajaDia, Pedido, VentaDia
+from .rangos import filtro_de_dias
+
+# Un día ya sellado por su arqueo no vuelve a cambiar (cancelar_pedido rechaza esos tickets),
+# así que sus totales se guardan sin caducidad; solo un movimiento nuevo en ese día, que pasa
+# siempre por registrar_en_caja, los borra (ver invalidar_reportes).
+TIMEOUT_REPORTES = getattr(settings, 'REPORTES_CACHE_TIMEOUT', None)
+
+CAMPOS_REPORTE = ('total_vendido', 'total_efectivo', 'total_tarjeta', 'num_completados', 'num_cancelados',
+                  'total_cancelado', 'costo')
+
+
+def clave_reporte_dia(empresa_id, fecha):
+    return f"reporte:{empresa_id}:d:{fecha:%Y%m%d}"
+
+
+def _vacio():
+    totales = dict.fromkeys(CAMPOS_REPORTE, Decimal('0.00'))
+    totales['num_completados'] = totales['num_cancelados'] = 0
+    return totales
+
+
+def _dias_abiertos(empresa, fechas):
+    """Días del rango que todavía tienen movimientos sin arqueo, más hoy."""
+    abiertos = set(CajaDia.objects.filter(
+        empresa=empresa, fecha__in=fechas, movimientos_pendientes__gt=0
+    ).values_list('fecha', flat=True))
+    abiertos.add(timezone.localdate())
+    return abiertos
+
+
+def _calcular_dias(empresa, fechas):
+    """Totales de varios días con una consulta agrupada a Pedido y una a VentaDia (para el costo)."""
+    completados = Q(estado='Completado')
+    cancelados = Q(estado='Cancelado')
+    resultado = {fecha: _vacio() for fecha in fechas}
+    for dato in Pedido.objects.filter(
+        empresa=empresa, **filtro_de_dias('fecha', min(fechas), max(fechas))
+    ).annotate(dia=TruncDate('fecha')).values('dia').annotate(
+        total_vendido=Sum('total', filter=completados),
+        total_efectivo=Sum('total', filter=completados & Q(metodo_pago='Efectivo')),
+        total_tarjeta=Sum('total', filter=completados & Q(metodo_pago='Tarjeta')),
+        num_completados=Count('id', filter=completados),
+        num_cancelados=Count('id', filter=cancelados),
+        total_cancelado=Sum('total', filter=cancelados),
+    ).order_by():
+        if dato['dia'] in resultado:
+            resultado[dato['dia']].update({campo: valor for campo, valor in dato.items() if campo != 'dia' and valor is not None})
+    for fecha, costo in VentaDia.objects.filter(empresa=empresa, fecha__in=fechas).values_list('fecha', 'costo'):
+        resultado[fecha]['costo'] = costo
+    return resultado
+
+
+def totales_por_dia(empresa, fecha_inicio, fecha_fin):
+    """
+    {fecha: totales} de cada día local del rango (ver CAMPOS_REPORTE). Los días sellados
+    salen del cache; los abiertos (hoy y los que esperan arqueo) y los que falten se
+    calculan juntos, y de esos solo los sellados se guardan.
+    """
+    fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+    if not fechas:
+        return {}
+    abiertos = _dias_abiertos(empresa, fechas)
+    claves = {clave_reporte_dia(empresa.id, fecha): fecha for fecha in fechas if fecha not in abiertos}
+    guardados = cache.get_many(claves)
+    resultado = {claves[clave]: valor for clave, valor in guardados.items()}
+    faltantes = [fecha for fecha in fechas if fecha not in resultado]
+    if faltantes:
+        calculados = _calcular_dias(empresa, faltantes)
+        cache.set_many({
+            clave_reporte_dia(empresa.id, fecha): totales for fecha, totales in calculados.items() if fecha not in abiertos
+        }, TIMEOUT_REPORTES)
+        resultado.update(calculados)
+    return resultado
+
+
+def sumar_totales(por_dia):
+    """Suma los totales de varios días en un solo diccionario con los mismos campos."""
+    suma = _vacio()
+    for totales in por_dia:
+        for campo in CAMPOS_REPORTE:
+            suma[campo] += totales[campo]
+    return suma
+
+
+# Ventana del acumulado móvil de diferencias en el historial de arqueos.
+DIAS_ACUMULADO_ARQUEOS = 30
+
+
+def arqueos_del_periodo(empresa, desde, hasta):
+    """
+    Arqueos del período, del más reciente al más antiguo, como diccionarios. Cada renglón trae
+    `acumulado_30`: la suma de `diferencia` de los arqueos de los últimos 30 días hasta su fecha,
+    calculada en la base de datos con una subconsulta sobre el índice (empresa, fecha). Se
+    evalúa solo para los renglones de la página que se pida. Los arqueos sin conteo no suman.
+    """
+    ventana = Arqueo.objects.filter(
+        empresa=OuterRef('empresa'), fecha__lte=OuterRef('fecha'),
+        fecha__gt=OuterRef('fecha') - timedelta(days=DIAS_ACUMULADO_ARQUEOS),
+    ).values('empresa').annotate(s=Sum('diferencia')).values('s')
+    return Arqueo.objects.filter(empresa=empresa, fecha__range=(desde, hasta)).annotate(
+        acumulado_30=Coalesce(Subquery(ventana, output_field=DecimalField(max_digits=12, decimal_places=2)), Value(Decimal('0.00'))),
+    ).order_by('-fecha', '-id').values(
+        'id', 'fecha', 'ventas_efectivo', 'ventas_tarjeta', 'retiros', 'efectivo_esperado',
+        'monto_contado', 'diferencia', 'cerrado_por__username', 'turno__caja', 'acumulado_30',
+    )
+
+
+def resumen_de_arqueos(empresa, desde, hasta):
+    """
+    Diferencias del período en una sola consulta: suma, arqueos con faltante y con sobrante y el
+    peor faltante (None si no hubo). `por_cajero` repite la cuenta agrupada por quien cerró, para
+    ver de un vistazo si los faltantes se concentran en alguien. Los arqueos cerrados sin conteo
+    no tienen diferencia: solo se cuentan aparte en `sin_conteo`.
+    """
+    arqueos = Arqueo.objects.filter(empresa=empresa, fecha__range=(desde, hasta))
+    metricas = {
+        'arqueos': Count('id', filter=Q(diferencia__isnull=False)),
+        'diferencia_total': Sum('diferencia'),
+        'con_faltante': Count('id', filter=Q(diferencia__lt=0)),
+        'con_sobrante': Count('id', filter=Q(diferencia__gt=0)),
+        'peor_faltante': Min('diferencia', filter=Q(diferencia__lt=0)),
+    }
+    resumen = arqueos.aggregate(**metricas, sin_conteo=Count('id', filter=Q(diferencia__isnull=True)))
+    resumen['diferencia_total'] = resumen['diferencia_total'] or Decimal('0.00')
+    resumen['por_cajero'] = list(arqueos.filter(diferencia__isnull=False).values('cerrado_por__username').annotate(**metricas).order_by('diferencia_total'))
+    return resumen
+
+
+def invalidar_reportes(empresa, fechas):
+    """
+    Borra los totales guardados de esos días. Se borra ahora y otra vez al confirmar la
+    transacción, para que una lectura concurrente que aún veía los datos anteriores no deje
+    guardado un total viejo.
+    """
+    claves = [clave_reporte_dia(empresa.id, fecha) for fecha in fechas]
+    cache.delete_many(claves)
+    transaction.on_commit(lambda: cache.delete_many(claves))
@@ -0,0 +1,246 @@
+# inventario/resumenes.py
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction, IntegrityError
+from django.db.models import Case, When, F, Value, IntegerField
+from django.utils import timezone
+from django.core.cache import cache
+from .analitica import invalidar_analitica, renovar_generacion
+from .histograma import invalidar_histograma, clave_dia
+from .reportes import clave_reporte_dia
+from .models import Arqueo, Devolucion, Pedido, PedidoItem, VentaDia, VentaProductoDia
+
+CAMPOS_DIA = ('pedidos', 'total', 'cancelados', 'total_cancelado', 'costo', 'kg_vendidos')
+CAMPOS_PRODUCTO = ('cantidad', 'total', 'costo')
+
+
+def _centavos(valor):
+    return Decimal(valor).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+
+def _acumular_dia(empresa_id, fecha, importes):
+    """Upsert con F() sobre VentaDia, con el mismo manejo de carreras que registrar_en_caja."""
+    cambios = {campo: F(campo) + valor for campo, valor in importes.items() if valor}
+    if not cambios:
+        return
+    with transaction.atomic(savepoint=False):
+        if VentaDia.objects.filter(empresa_id=empresa_id, fecha=fecha).update(**cambios):
+            return
+        try:
+            with transaction.atomic():
+                VentaDia.objects.create(empresa_id=empresa_id, fecha=fecha, **importes)
+        except IntegrityError:
+            VentaDia.objects.filter(empresa_id=empresa_id, fecha=fecha).update(**cambios)
+
+
+def _acumular_productos(empresa_id, fecha, por_producto):
+    """
+    Suma a las filas de VentaProductoDia de un día con un UPDATE (Case/When por producto)
+    para las que ya existen y un bulk_create para las nuevas, sin importar cuántos productos
+    tenga la venta. Si otra terminal crea alguna fila en medio, se repite solo con esas.
+    """
+    pendientes = por_producto
+    while pendientes:
+        with transaction.atomic(savepoint=False):
+            existentes = set(VentaProductoDia.objects.filter(
+                fecha=fecha, producto_id__in=pendientes
+            ).values_list('producto_id', flat=True))
+            if existentes:
+                VentaProductoDia.objects.filter(fecha=fecha, producto_id__in=existentes).update(**{
+                    campo: Case(
+                        *[When(producto_id=producto_id, then=F(campo) + pendientes[producto_id][campo]) for producto_id in existentes],
+                        default=F(campo), output_field=VentaProductoDia._meta.get_field(campo),
+                    ) for campo in CAMPOS_PRODUCTO
+                })
+            nuevos = {producto_id: valores for producto_id, valores in pendientes.items() if producto_id not in existentes}
+            if not nuevos:
+                return
+            try:
+                with transaction.atomic():
+                    VentaProductoDia.objects.bulk_create([
+                        VentaProductoDia(empresa_id=empresa_id, producto_id=producto_id, fecha=fecha, **valores)
+                        for producto_id, valores in nuevos.items()
+                    ])
+                pendientes = {}
+            except IntegrityError:
+                pendientes = nuevos
+
+
+def registrar_en_resumen(empresa, ventas, signo=1):
+    """
+    Refleja en los resúmenes diarios un grupo de ventas (signo=1) o sus cancelaciones
+    (signo=-1). `ventas` es una lista de (pedido, lineas) con las PedidoItem de cada pedido;
+    importes y costos salen de lo que la línea guardó al venderse. Hace un upsert por día y uno por día y producto, así que una
+    venta suelta y un lote de cien cuestan lo mismo.
+    """
+    dias, productos = {}, {}
+    for pedido, lineas in ventas:
+        fecha = timezone.localdate(pedido.fecha)
+        dia = dias.setdefault(fecha, dict.fromkeys(CAMPOS_DIA, 0))
+        if signo > 0:
+            dia['pedidos'] += 1
+            dia['total'] += _centavos(pedido.total)
+        else:
+            dia['cancelados'] += 1
+            dia['total_cancelado'] += _centavos(pedido.total)
+        for linea in lineas:
+            costo = linea.costo_total
+            dia['costo'] += costo * signo
+            if linea.producto.unidad_medida == 'kg':
+                dia['kg_vendidos'] += linea.cantidad * signo
+            fila = productos.setdefault(fecha, {}).setdefault(linea.producto_id, dict.fromkeys(CAMPOS_PRODUCTO, 0))
+            fila['cantidad'] += linea.cantidad * signo
+            fila['total'] += linea.subtotal * signo
+            fila['costo'] += costo * signo
+
+    for fecha, importes in dias.items():
+        _acumular_dia(empresa.id, fecha, importes)
+    for fecha, por_producto in productos.items():
+        _acumular_productos(empresa.id, fecha, por_producto)
+    invalidar_histograma(empresa, [pedido.fecha for pedido, _ in ventas])
+    invalidar_analitica(empresa, [pedido.fecha for pedido, _ in ventas])
+
+
+def registrar_devoluciones_en_resumen(empresa, pedido, devoluciones):
+    """
+    Descuenta devoluciones parciales de un pedido (filas de Devolucion con su línea y producto)
+    del resumen de su día y de sus productos, con los importes y costos ya guardados en cada
+    devolución: no se vuelve a leer el ticket.
+    """
+    fecha = timezone.localdate(pedido.fecha)
+    dia, por_producto = dict.fromkeys(CAMPOS_DIA, 0), {}
+    for devolucion in devoluciones:
+        producto = devolucion.item.producto
+        dia['total'] -= devolucion.importe
+        dia['costo'] -= devolucion.costo
+        if producto.unidad_medida == 'kg':
+            dia['kg_vendidos'] -= devolucion.cantidad
+        fila = por_producto.setdefault(producto.id, dict.fromkeys(CAMPOS_PRODUCTO, 0))
+        fila['cantidad'] -= devolucion.cantidad
+        fila['total'] -= devolucion.importe
+        fila['costo'] -= devolucion.costo
+
+    _acumular_dia(empresa.id, fecha, dia)
+    _acumular_productos(empresa.id, fecha, por_producto)
+    invalidar_histograma(empresa, [pedido.fecha])
+    invalidar_analitica(empresa, [pedido.fecha])
+
+
+def cerrar_dias_en_resumen(empresa, arqueos_por_fecha):
+    """Marca cada día ({fecha: arqueo}) como cerrado por su arqueo, con un solo UPDATE."""
+    VentaDia.objects.filter(empresa=empresa, fecha__in=list(arqueos_por_fecha)).update(arqueo_id=Case(
+        *[When(fecha=fecha, then=Value(arqueo.id)) for fecha, arqueo in arqueos_por_fecha.items()],
+        output_field=IntegerField(),
+    ))
+
+
+def calcular_resumenes(empresa=None):
+    """
+    Recalcula los resúmenes desde Pedido, PedidoItem y Devolucion.
+    Devuelve ({(empresa_id, fecha): {campo: valor}}, {(empresa_id, producto_id, fecha): {campo: valor}}).
+    """
+    pedidos = Pedido.objects.all()
+    items = PedidoItem.objects.all()
+    arqueos = Arqueo.objects.all()
+    if empresa is not None:
+        pedidos = pedidos.filter(empresa=empresa)
+        items = items.filter(pedido__empresa=empresa)
+        arqueos = arqueos.filter(empresa=empresa)
+
+    dias, productos = {}, {}
+
+    def fila_dia(empresa_id, fecha):
+        return dias.setdefault((empresa_id, fecha), dict.fromkeys(CAMPOS_DIA, 0))
+
+    for pedido in pedidos.values('empresa_id', 'fecha', 'total', 'estado').iterator():
+        dia = fila_dia(pedido['empresa_id'], timezone.localdate(pedido['fecha']))
+        dia['pedidos'] += 1
+        dia['total'] += pedido['total']
+        if pedido['estado'] == 'Cancelado':
+            dia['cancelados'] += 1
+            dia['total_cancelado'] += pedido['total']
+
+    for item in items.filter(pedido__estado='Completado').values(
+        'pedido__empresa_id', 'pedido__fecha', 'producto_id', 'producto__unidad_medida',
+        'cantidad', 'subtotal', 'costo_unitario',
+    ).iterator():
+        empresa_id, fecha = item['pedido__empresa_id'], timezone.localdate(item['pedido__fecha'])
+        importe = item['subtotal']
+        costo = _centavos(item['cantidad'] * item['costo_unitario'])
+        dia = fila_dia(empresa_id, fecha)
+        dia['costo'] += costo
+        if item['producto__unidad_medida'] == 'kg':
+            dia['kg_vendidos'] += item['cantidad']
+        fila = productos.setdefault((empresa_id, item['producto_id'], fecha), dict.fromkeys(CAMPOS_PRODUCTO, 0))
+        fila['cantidad'] += item['cantidad']
+        fila['total'] += importe
+        fila['costo'] += costo
+
+    # Las devoluciones parciales de tickets vigentes ya vienen restadas de Pedido.total;
+    # aquí se restan de las líneas, que se guardan tal como se vendieron.
+    devoluciones = Devolucion.objects.filter(pedido__estado='Completado')
+    if empresa is not None:
+        devoluciones = devoluciones.filter(pedido__empresa=empresa)
+    for devolucion in devoluciones.values(
+        'pedido__empresa_id', 'pedido__fecha', 'item__producto_id', 'item__producto__unidad_medida',
+        'cantidad', 'importe', 'costo',
+    ).iterator():
+        empresa_id, fecha = devolucion['pedido__empresa_id'], timezone.localdate(devolucion['pedido__fecha'])
+        dia = fila_dia(empresa_id, fecha)
+        dia['costo'] -= devolucion['costo']
+        if devolucion['item__producto__unidad_medida'] == 'kg':
+            dia['kg_vendidos'] -= devolucion['cantidad']
+        fila = productos.setdefault((empresa_id, devolucion['item__producto_id'], fecha), dict.fromkeys(CAMPOS_PRODUCTO, 0))
+        fila['cantidad'] -= devolucion['cantidad']
+        fila['total'] -= devolucion['importe']
+        fila['costo'] -= devolucion['costo']
+
+    for arqueo in arqueos.order_by('id').values('empresa_id', 'fecha', 'id'):
+        if (arqueo['empresa_id'], arqueo['fecha']) in dias:
+            dias[(arqueo['empresa_id'], arqueo['fecha'])]['arqueo_id'] = arqueo['id']
+    return dias, productos
+
+
+def comparar_resumenes(empresa=None):
+    """Lista de diferencias (clave, campo, guardado, esperado) entre los resúmenes y los pedidos."""
+    esperados_dia, esperados_producto = calcular_resumenes(empresa)
+    filas_dia = VentaDia.objects.all() if empresa is None else VentaDia.objects.filter(empresa=empresa)
+    filas_producto = VentaProductoDia.objects.all() if empresa is None else VentaProductoDia.objects.filter(empresa=empresa)
+    guardados_dia = {(f.empresa_id, f.fecha): {campo: getattr(f, campo) for campo in CAMPOS_DIA} for f in filas_dia}
+    guardados_producto = {
+        (f.empresa_id, f.producto_id, f.fecha): {campo: getattr(f, campo) for campo in CAMPOS_PRODUCTO} for f in filas_producto
+    }
+
+    diferencias = []
+    for guardados, esperados, campos in (
+        (guardados_dia, esperados_dia, CAMPOS_DIA),
+        (guardados_producto, esperados_producto, CAMPOS_PRODUCTO),
+    ):
+        vacio = dict.fromkeys(campos, 0)
+        for clave in sorted(set(guardados) | set(esperados)):
+            for campo in campos:
+                guardado = guardados.get(clave, vacio)[campo]
+                esperado = esperados.get(clave, vacio)[campo]
+                if guardado != esperado:
+                    diferencias.append((clave, campo, guardado, esperado))
+    return diferencias
+
+
+@transaction.atomic
+def reconstruir_resumenes(empresa=None):
+    """Reemplaza los resúmenes con lo calculado desde los pedidos. Devuelve (días, filas de producto)."""
+    dias, productos = calcular_resumenes(empresa)
+    for modelo in (VentaDia, VentaProductoDia):
+        (modelo.objects.all() if empresa is None else modelo.objects.filter(empresa=empresa)).delete()
+    VentaDia.objects.bulk_create([
+        VentaDia(empresa_id=empresa_id, fecha=fecha, **valores) for (empresa_id, fecha), valores in dias.items()
+    ], batch_size=1000)
+    VentaProductoDia.objects.bulk_create([
+        VentaProductoDia(empresa_id=empresa_id, producto_id=producto_id, fecha=fecha, **valores)
+        for (empresa_id, producto_id, fecha), valores in productos.items()
+    ], batch_size=1000)
+    # Las cubetas diarias del histograma y los reportes por día se calcularon con los resúmenes anteriores.
+    cache.delete_many([clave(empresa_id, fecha) for empresa_id, fecha in dias for clave in (clave_dia, clave_reporte_dia)])
+    for empresa_id in {empresa_id for empresa_id, _ in dias}:
+        renovar_generacion(empresa_id)
+    return len(dias), len(productos)
@@ -1,6 +1,35 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import threading
+import uuid
+from datetime import datetime, time, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+import json
 from django.contrib.auth.models import User
-from .models import Empresa, Producto, Pedido, PedidoItem, Cliente
+from django.urls import reverse
+from django.utils import timezone
+from .models import Empresa, Producto, Pedido, PedidoItem, Cliente, Retiro, UserProfile, ContadorTicket, CajaDia, Arqueo, VentaDia, VentaProductoDia, PronosticoProducto, MetricasPlataforma, Turno, Devolucion
+from .caja import caja_del_dia, cerrar_dias, registrar_venta_en_caja, comparar_libro, reconstruir_libro
+from django.core.cache import cache
+from . import catalogo
+from .catalogo import obtener_catalogo, estadisticas_catalogo, stock_actual
+from .carrito import cotizar_carrito
+from .ventas import registrar_venta, registrar_ventas_en_lote, cancelar_venta, devolver_lineas, StockInsuficiente, DevolucionInvalida
+from .etiquetas import digito_verificador_ean13
+from .forms import ProductoForm
+from .resumenes import comparar_resumenes, reconstruir_resumenes
+from .histograma import clave_dia, clave_hora, invalidar_histograma, ventas_por_dia, ventas_por_hora
+from .analitica import analizar_productos, analitica_del_dia
+from .metricas import metricas_plataforma
+from .reportes import totales_por_dia
+from .turnos import abrir_turno, cerrar_turno, TurnoInvalido
+from .rangos import filtro_de_dias, rango_de_dias
+from .pronostico import actualizar_pronosticos, pronosticar, DIAS_HISTORIA
+from django.core.management import call_command
+import numpy as np
 from decimal import Decimal
 
 class InventarioTestCase(TestCase):
@@ -70,3 +99,1319 @@ class InventarioTestCase(TestCase):
         self.assertEqual(pedido.total, Decimal('500.00'))
         self.assertEqual(self.producto1.stock, stock_inicial - Decimal('2.000'))
 
+
+def limpiar_cache_catalogo():
+    """Vacía el cache de Django y la capa en memoria del catálogo, y reinicia sus contadores."""
+    cache.clear()
+    with catalogo._candado:
+        catalogo._lru.clear()
+        for evento in catalogo._estadisticas:
+            catalogo._estadisticas[evento] = 0
+
+
+class CatalogoLimpioTestCase(TestCase):
+    """Base para las pruebas que pasan por el catálogo en cache (los ids se repiten entre pruebas)."""
+    def setUp(self):
+        limpiar_cache_catalogo()
+
+
+class CarritoTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería del Carrito")
+        self.productos = [
+            Producto.objects.create(
+                empresa=self.empresa, nombre=f"Corte {i}", precio=Decimal('200.00'),
+                precio_mayoreo=Decimal('180.00'), mayoreo_desde_kg=Decimal('5.000'), stock=Decimal('100.000')
+            )
+            for i in range(15)
+        ]
+
+    def test_cotizar_carrito_una_sola_consulta(self):
+        """Un carrito de 15 líneas se cotiza con una sola consulta."""
+        carrito = {str(p.id): '1.500' for p in self.productos}
+        with self.assertNumQueries(1):
+            items, total = cotizar_carrito(self.empresa, carrito)
+        self.assertEqual(len(items), 15)
+        self.assertEqual(total, Decimal('200.00') * Decimal('1.500') * 15)
+
+    def test_cotizar_carrito_aplica_mayoreo(self):
+        """El precio de mayoreo se aplica a partir de la cantidad configurada."""
+        carrito = {str(self.productos[0].id): '5.000', str(self.productos[1].id): '4.999'}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        self.assertEqual(items[0]['precio_unitario'], Decimal('180.00'))
+        self.assertEqual(items[1]['precio_unitario'], Decimal('200.00'))
+        self.assertEqual(total, Decimal('180.00') * 5 + Decimal('200.00') * Decimal('4.999'))
+
+
+class CarritoDeltaTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Delta")
+        self.user = User.objects.create_user('cajero', 'cajero@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.bistec = Producto.objects.create(empresa=self.empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('50.000'))
+        self.chorizo = Producto.objects.create(empresa=self.empresa, nombre="Chorizo", precio=Decimal('120.00'), stock=Decimal('50.000'))
+        self.client.force_login(self.user)
+
+    def enviar(self, rev, ops):
+        return self.client.post(
+            reverse('operaciones-carrito'), data=json.dumps({'rev': rev, 'ops': ops}),
+            content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        ).json()
+
+    def test_varias_operaciones_devuelven_solo_lineas_cambiadas(self):
+        """Varias operaciones en una petición; la respuesta solo trae las líneas tocadas."""
+        data = self.enviar(0, [{'op': 'agregar', 'producto_id': self.chorizo.id}])
+        self.assertEqual(data['rev'], 1)
+        data = self.enviar(1, [
+            {'op': 'actualizar', 'producto_id': self.bistec.id, 'cantidad': '1.250', 'mode': 'add'},
+            {'op': 'actualizar', 'producto_id': self.bistec.id, 'cantidad': '0.250', 'mode': 'add'},
+        ])
+        self.assertEqual(data['rev'], 2)
+        self.assertNotIn('items', data)
+        self.assertEqual(data['lineas'], [{
+            'id': self.bistec.id, 'nombre': 'Bistec', 'cantidad': 1.5, 'subtotal': 300.0, 'unidad_medida': 'kg'
+        }])
+        self.assertEqual(data['total'], 420.0)
+
+        data = self.enviar(2, [{'op': 'eliminar', 'producto_id': self.chorizo.id}])
+        self.assertEqual(data['lineas'], [{'id': self.chorizo.id, 'eliminado': True}])
+        self.assertEqual(data['total'], 300.0)
+
+    def test_revision_desfasada_devuelve_carrito_completo(self):
+        """Si el cliente trae una revisión vieja, se le manda el carrito completo."""
+        self.client.post(reverse('agregar-al-carrito', args=[self.bistec.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = self.enviar(0, [{'op': 'agregar', 'producto_id': self.chorizo.id}])
+        self.assertTrue(data['completo'])
+        self.assertEqual([item['id'] for item in data['items']], [self.bistec.id, self.chorizo.id])
+
+    def test_operacion_invalida_no_modifica_el_carrito(self):
+        response = self.client.post(
+            reverse('operaciones-carrito'), data=json.dumps({'rev': 0, 'ops': [{'op': 'vender', 'producto_id': self.bistec.id}]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.session.get('carrito', {}), {})
+
+    def test_cantidad_no_finita_no_modifica_el_carrito(self):
+        for cantidad in ('Infinity', '-Infinity', 'NaN'):
+            response = self.client.post(
+                reverse('operaciones-carrito'),
+                data=json.dumps({'rev': 0, 'ops': [{'op': 'agregar', 'producto_id': self.bistec.id, 'cantidad': cantidad}]}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['message'], 'Operación de carrito inválida.')
+        self.assertEqual(self.client.session.get('carrito', {}), {})
+
+    def test_producto_inexistente_responde_json(self):
+        response = self.client.post(
+            reverse('operaciones-carrito'), data=json.dumps({'rev': 0, 'ops': [{'op': 'agregar', 'producto_id': 999999}]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'success': False, 'message': 'Uno de los productos del carrito ya no existe.'})
+        self.assertEqual(self.client.session.get('carrito', {}), {})
+
+        # Un carrito guardado con un producto que después se borró.
+        sesion = self.client.session
+        sesion['carrito'] = {'999999': '1'}
+        sesion.save()
+        response = self.client.post(reverse('agregar-al-carrito', args=[self.chorizo.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()['success'])
+
+
+class RegistrarVentaTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Checkout")
+        self.arrachera = Producto.objects.create(empresa=self.empresa, nombre="Arrachera", precio=Decimal('250.00'), stock=Decimal('3.000'))
+        self.costilla = Producto.objects.create(empresa=self.empresa, nombre="Costilla", precio=Decimal('160.00'), stock=Decimal('1.000'))
+        self.servicio = Producto.objects.create(empresa=self.empresa, nombre="Molido", precio=Decimal('10.00'), requiere_stock=False, unidad_medida='servicio')
+        ContadorTicket.objects.create(empresa=self.empresa)
+        CajaDia.objects.create(empresa=self.empresa, fecha=timezone.localdate())
+        VentaDia.objects.create(empresa=self.empresa, fecha=timezone.localdate())
+
+    def test_venta_en_consultas_constantes(self):
+        """Las líneas se insertan con bulk_create y el stock se descuenta con un solo UPDATE."""
+        carrito = {str(self.arrachera.id): '2.000', str(self.costilla.id): '0.500', str(self.servicio.id): '1'}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        # savepoints, UPDATE de stock, número de ticket (UPDATE … RETURNING), INSERT del pedido,
+        # bulk_create, libro de caja, marcador de día pendiente, resumen del día y resumen por
+        # producto (SELECT + bulk_create de las filas nuevas en su savepoint)
+        with self.assertNumQueries(15):
+            pedido = registrar_venta(self.empresa, items, total, 'Tarjeta')
+        self.assertEqual(pedido.items.count(), 3)
+        self.arrachera.refresh_from_db()
+        self.costilla.refresh_from_db()
+        self.assertEqual(self.arrachera.stock, Decimal('1.000'))
+        self.assertEqual(self.costilla.stock, Decimal('0.500'))
+
+    def test_stock_insuficiente_reporta_productos_y_no_deja_nada(self):
+        """Si un corte no alcanza, no se descuenta nada y se reporta exactamente cuál falló."""
+        carrito = {str(self.arrachera.id): '2.000', str(self.costilla.id): '1.500'}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        with self.assertRaises(StockInsuficiente) as contexto:
+            registrar_venta(self.empresa, items, total, 'Efectivo')
+        self.assertEqual([p.id for p in contexto.exception.productos], [self.costilla.id])
+        self.arrachera.refresh_from_db()
+        self.assertEqual(self.arrachera.stock, Decimal('3.000'))
+        self.assertFalse(Pedido.objects.filter(empresa=self.empresa).exists())
+
+
+class ContadorTicketTestCase(TestCase):
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre="Carnicería Tickets")
+
+    def test_contador_arranca_en_el_ultimo_ticket_existente(self):
+        Pedido.objects.create(empresa=self.empresa, total=Decimal('10.00'), ticket_numero=41)
+        pedido = Pedido.objects.create(empresa=self.empresa, total=Decimal('10.00'))
+        self.assertEqual(pedido.ticket_numero, 42)
+
+    def test_reservar_bloque(self):
+        """Se puede reservar un bloque de números para ingesta masiva."""
+        self.assertEqual(ContadorTicket.reservar(self.empresa, cantidad=50), 1)
+        self.assertEqual(ContadorTicket.reservar(self.empresa), 51)
+        self.assertEqual(Pedido.objects.create(empresa=self.empresa, total=Decimal('10.00')).ticket_numero, 52)
+
+    def test_reservar_en_una_consulta(self):
+        ContadorTicket.objects.create(empresa=self.empresa, ultimo_numero=7)
+        with self.assertNumQueries(1):
+            self.assertEqual(ContadorTicket.reservar(self.empresa, cantidad=3), 8)
+        self.assertEqual(ContadorTicket.objects.get(empresa=self.empresa).ultimo_numero, 10)
+
+    def test_numeros_independientes_por_empresa(self):
+        otra = Empresa.objects.create(nombre="Otra Carnicería")
+        self.assertEqual(ContadorTicket.reservar(self.empresa), 1)
+        self.assertEqual(ContadorTicket.reservar(otra), 1)
+
+
+# SQLite no admite escrituras concurrentes; esta prueba corre contra PostgreSQL.
+@skipUnlessDBFeature('has_select_for_update')
+class ContadorTicketConcurrenciaTestCase(TransactionTestCase):
+    def test_cobros_simultaneos_no_repiten_numero(self):
+        """Muchos cobros simultáneos reciben números de ticket únicos y consecutivos."""
+        empresa = Empresa.objects.create(nombre="Carnicería Concurrida")
+        producto = Producto.objects.create(empresa=empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('1000.000'))
+        ContadorTicket.objects.create(empresa=empresa)
+        terminales, ventas_por_terminal = 8, 5
+        errores = []
+
+        def terminal():
+            try:
+                for _ in range(ventas_por_terminal):
+                    items, total = cotizar_carrito(empresa, {str(producto.id): '1.000'})
+                    registrar_venta(empresa, items, total, 'Tarjeta')
+            except Exception as error:
+                errores.append(error)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=terminal) for _ in range(terminales)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        numeros = sorted(Pedido.objects.filter(empresa=empresa).values_list('ticket_numero', flat=True))
+        self.assertEqual(numeros, list(range(1, terminales * ventas_por_terminal + 1)))
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, Decimal('1000.000') - terminales * ventas_por_terminal)
+
+
+class LibroDeCajaTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Caja")
+        self.user = User.objects.create_user('encargado', 'encargado@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.producto = Producto.objects.create(empresa=self.empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('50.000'))
+        self.client.force_login(self.user)
+        self.hoy = timezone.localdate()
+
+    def vender(self, metodo_pago, cantidad='1.000'):
+        session = self.client.session
+        session['carrito'] = {str(self.producto.id): cantidad}
+        session.save()
+        self.client.post(reverse('finalizar-venta', args=[metodo_pago]), {'monto_recibido': '10000'})
+        return Pedido.objects.filter(empresa=self.empresa).latest('id')
+
+    def test_ventas_retiros_y_cancelaciones_mantienen_el_libro(self):
+        self.vender('Efectivo', '2.000')
+        cancelado = self.vender('Tarjeta')
+        self.vender('Tarjeta')
+        self.client.post(reverse('gestion-caja'), {'monto': '100.00', 'concepto': 'Proveedor'})
+        self.client.post(reverse('cancelar-pedido', args=[cancelado.id]))
+
+        caja = caja_del_dia(self.empresa, self.hoy)
+        self.assertEqual(caja.ventas_efectivo, Decimal('400.00'))
+        self.assertEqual(caja.ventas_tarjeta, Decimal('200.00'))
+        self.assertEqual(caja.retiros, Decimal('100.00'))
+        self.assertEqual(caja.movimientos_pendientes, 4)
+        self.assertEqual(comparar_libro(self.empresa), [])
+
+        response = self.client.get(reverse('arqueo-caja'))
+        self.assertEqual(response.context['efectivo_esperado'], Decimal('300.00'))
+
+    def test_cerrar_caja_descuenta_lo_sellado(self):
+        self.vender('Efectivo')
+        self.client.post(reverse('gestion-caja'), {'monto': '50.00', 'concepto': 'Gas'})
+        self.client.post(reverse('cerrar-caja'), {'fecha_arqueo': self.hoy.strftime('%Y-%m-%d'), 'monto_contado': '150.00'})
+
+        arqueo = Arqueo.objects.get(empresa=self.empresa)
+        self.assertEqual(arqueo.efectivo_esperado, Decimal('150.00'))
+        caja = caja_del_dia(self.empresa, self.hoy)
+        self.assertEqual((caja.ventas_efectivo, caja.retiros, caja.movimientos_pendientes), (Decimal('0.00'), Decimal('0.00'), 0))
+        self.assertEqual(comparar_libro(self.empresa), [])
+
+    def test_reconstruir_libro(self):
+        self.vender('Efectivo')
+        CajaDia.objects.filter(empresa=self.empresa).update(ventas_efectivo=Decimal('999.00'))
+        self.assertEqual(len(comparar_libro(self.empresa)), 1)
+        reconstruir_libro(self.empresa)
+        self.assertEqual(comparar_libro(self.empresa), [])
+        self.assertEqual(caja_del_dia(self.empresa, self.hoy).ventas_efectivo, Decimal('200.00'))
+
+
+class CierreDeDiasAtrasadosTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Atrasada")
+        self.user = User.objects.create_user('atrasado', 'atrasado@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.hoy = timezone.localdate()
+
+    def sembrar(self, dias):
+        """Un ticket en efectivo, uno con tarjeta, uno cancelado y un retiro por día, sin cerrar."""
+        fechas = [self.hoy - timedelta(days=dia) for dia in range(dias, 0, -1)]
+        for fecha in fechas:
+            mediodia = timezone.make_aware(datetime.combine(fecha, time(12)))
+            for metodo, estado in (('Efectivo', 'Completado'), ('Tarjeta', 'Completado'), ('Efectivo', 'Cancelado')):
+                Pedido.objects.create(empresa=self.empresa, fecha=mediodia, total=Decimal('100.00'), metodo_pago=metodo, estado=estado)
+            Retiro.objects.create(empresa=self.empresa, fecha=mediodia, monto=Decimal('30.00'), concepto="Hielo")
+        reconstruir_libro(self.empresa)
+        return fechas
+
+    def test_consultas_no_dependen_de_los_dias(self):
+        dos = self.sembrar(2)
+        with CaptureQueriesContext(connection) as pocos:
+            cerrar_dias(self.empresa, dict.fromkeys(dos))
+        Pedido.objects.all().delete()
+        Retiro.objects.all().delete()
+        siete = self.sembrar(7)
+        with CaptureQueriesContext(connection) as muchos:
+            arqueos = cerrar_dias(self.empresa, dict.fromkeys(siete))
+        self.assertEqual(len(pocos), len(muchos))
+        self.assertEqual([arqueo.fecha for arqueo in arqueos], siete)
+
+    def test_cada_arqueo_cuenta_lo_que_sella(self):
+        fechas = self.sembrar(3)
+        VentaDia.objects.create(empresa=self.empresa, fecha=fechas[0])
+        arqueos = cerrar_dias(self.empresa, {fechas[0]: Decimal('65.00'), fechas[1]: None, fechas[2]: None}, self.user)
+        primero = Arqueo.objects.get(id=arqueos[0].id)
+        self.assertEqual((primero.ventas_efectivo, primero.ventas_tarjeta, primero.retiros), (Decimal('100.00'), Decimal('100.00'), Decimal('30.00')))
+        self.assertEqual((primero.efectivo_esperado, primero.diferencia), (Decimal('70.00'), Decimal('-5.00')))
+        sin_conteo = Arqueo.objects.get(id=arqueos[1].id)
+        self.assertEqual((sin_conteo.efectivo_esperado, sin_conteo.monto_contado, sin_conteo.diferencia), (Decimal('70.00'), None, None))
+        for arqueo in arqueos:
+            self.assertEqual(Pedido.objects.filter(arqueo=arqueo).count(), 3)
+            self.assertEqual(Pedido.objects.filter(arqueo=arqueo).exclude(fecha__date=arqueo.fecha).count(), 0)
+        self.assertFalse(Pedido.objects.filter(arqueo__isnull=True).exists())
+        self.assertEqual(comparar_libro(self.empresa), [])
+        self.assertEqual(VentaDia.objects.get(empresa=self.empresa, fecha=fechas[0]).arqueo_id, arqueos[0].id)
+
+    def test_desbloquea_el_punto_de_venta(self):
+        fechas = self.sembrar(5)
+        response = self.client.get(reverse('pos', args=['mostrador']))
+        self.assertTemplateUsed(response, 'inventario/arqueo_pendiente.html')
+        self.assertEqual(response.context['dias_pendientes'], 5)
+        self.client.post(reverse('cerrar-dias-pendientes'))
+        self.assertEqual(list(Arqueo.objects.filter(empresa=self.empresa).order_by('fecha').values_list('fecha', flat=True)), fechas)
+        self.assertTemplateNotUsed(self.client.get(reverse('pos', args=['mostrador'])), 'inventario/arqueo_pendiente.html')
+
+    def test_solo_el_dueno_cierra_sin_conteo(self):
+        self.sembrar(3)
+        cajero = User.objects.create_user('cajero_atrasado', 'cajero_atrasado@example.com', 'password')
+        UserProfile.objects.create(user=cajero, empresa=self.empresa)
+        self.client.force_login(cajero)
+        self.assertFalse(self.client.get(reverse('pos', args=['mostrador'])).context['puede_cerrar_sin_conteo'])
+        self.client.post(reverse('cerrar-dias-pendientes'))
+        self.assertFalse(Arqueo.objects.filter(empresa=self.empresa).exists())
+
+        cajero.is_staff = True
+        cajero.save()
+        self.client.post(reverse('cerrar-dias-pendientes'))
+        self.assertEqual(Arqueo.objects.filter(empresa=self.empresa, monto_contado__isnull=True).count(), 3)
+
+
+class CatalogoCacheTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Catálogo")
+        self.user = User.objects.create_user('admin_catalogo', 'admin@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.producto = Producto.objects.create(empresa=self.empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('10.000'))
+        self.empresa.refresh_from_db()
+        self.client.force_login(self.user)
+
+    def test_segunda_lectura_no_consulta_la_base(self):
+        obtener_catalogo(self.empresa)
+        with self.assertNumQueries(0):
+            productos = obtener_catalogo(self.empresa)
+        self.assertEqual([p.nombre for p in productos], ["Bistec"])
+        estadisticas = estadisticas_catalogo()
+        self.assertEqual((estadisticas['fallos'], estadisticas['aciertos_memoria']), (1, 1))
+
+    def test_guardar_producto_sube_la_version(self):
+        version = self.empresa.version_catalogo
+        self.client.post(reverse('gestion-inventario'), {
+            'nombre': 'Chuleta', 'precio': '150.00', 'unidad_medida': 'kg', 'requiere_stock': 'on', 'stock': '5'
+        })
+        self.client.post(reverse('eliminar-producto', args=[self.producto.id]))
+        self.empresa.refresh_from_db()
+        self.assertEqual(self.empresa.version_catalogo, version + 2)
+        self.assertEqual([p.nombre for p in obtener_catalogo(self.empresa)], ["Chuleta"])
+
+    def test_venta_no_toca_el_catalogo(self):
+        """El stock no vive en el catálogo en cache: vender no sube la versión ni bloquea Empresa."""
+        obtener_catalogo(self.empresa)
+        version = self.empresa.version_catalogo
+        items, total = cotizar_carrito(self.empresa, {str(self.producto.id): '1.000'})
+        with CaptureQueriesContext(connection) as consultas:
+            registrar_venta(self.empresa, items, total, 'Tarjeta')
+        self.assertFalse([q for q in consultas.captured_queries if 'version_catalogo' in q['sql']])
+        self.empresa.refresh_from_db()
+        self.assertEqual(self.empresa.version_catalogo, version)
+        self.assertEqual(stock_actual(self.empresa), {self.producto.id: Decimal('9.000')})
+        response = self.client.get(reverse('catalogo-stock'))
+        self.assertEqual(response.json()['stock'], {str(self.producto.id): '9.000'})
+
+    def test_catalogo_json_responde_304_si_no_cambio(self):
+        response = self.client.get(reverse('catalogo-json'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response.json()['productos'][0]['nombre'], "Bistec")
+
+        response = self.client.get(reverse('catalogo-json'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.producto.precio = Decimal('210.00')
+        self.producto.save()
+        response = self.client.get(reverse('catalogo-json'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['productos'][0]['precio'], '210.00')
+
+
+class EmpresaMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre="Carnicería Middleware")
+        self.user = User.objects.create_user('dueno', 'dueno@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        Cliente.objects.create(empresa=self.empresa, nombre="Doña Mari", telefono="3121234567")
+        self.client.force_login(self.user)
+
+    def test_empresa_resuelta_en_la_misma_consulta_que_el_usuario(self):
+        """Sesión, usuario con perfil y empresa, y la lista de clientes: tres consultas en total."""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('gestion-clientes'))
+        self.assertEqual(response.wsgi_request.empresa, self.empresa)
+        self.assertNotIn('empresa_id', self.client.session)
+
+    def test_usuario_sin_empresa(self):
+        sin_empresa = User.objects.create_user('nuevo', 'nuevo@example.com', 'password')
+        self.client.force_login(sin_empresa)
+        response = self.client.get(reverse('registro-empresa'))
+        self.assertIsNone(response.wsgi_request.empresa)
+
+
+class VentasEnLoteTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Sin Red")
+        self.user = User.objects.create_user('cajero', 'cajero@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.bistec = Producto.objects.create(
+            empresa=self.empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('5.000'),
+            precio_mayoreo=Decimal('180.00'), mayoreo_desde_kg=Decimal('3.000')
+        )
+        self.ayer = (timezone.now() - timedelta(days=1)).replace(microsecond=0)
+
+    def venta(self, cantidad, metodo_pago='Efectivo', **extra):
+        datos = {
+            'uuid': str(uuid.uuid4()), 'fecha': self.ayer.isoformat(), 'metodo_pago': metodo_pago,
+            'lineas': [{'producto_id': self.bistec.id, 'cantidad': cantidad}],
+        }
+        datos.update(extra)
+        return datos
+
+    def enviar(self, ventas):
+        return self.client.post(reverse('ingresar-ventas-lote'), json.dumps({'ventas': ventas}), content_type='application/json')
+
+    def test_reenviar_el_lote_no_duplica_ventas(self):
+        lote = [self.venta('1.000'), self.venta('3.000', 'Tarjeta')]
+        primera = self.enviar(lote).json()['resultados']
+        self.assertEqual([r['estado'] for r in primera], ['registrada', 'registrada'])
+        self.assertEqual(primera[1]['total'], '540.00')  # precio de mayoreo, igual que en el POS
+        self.assertEqual(primera[1]['ticket_numero'], primera[0]['ticket_numero'] + 1)
+
+        segunda = self.enviar(lote).json()['resultados']
+        self.assertEqual([r['estado'] for r in segunda], ['duplicada', 'duplicada'])
+        self.assertEqual([r['pedido_id'] for r in segunda], [r['pedido_id'] for r in primera])
+        self.assertEqual(Pedido.objects.filter(empresa=self.empresa).count(), 2)
+        self.bistec.refresh_from_db()
+        self.assertEqual(self.bistec.stock, Decimal('1.000'))
+
+    def test_conserva_fecha_original_y_libro_de_caja_del_dia(self):
+        self.enviar([self.venta('1.000'), self.venta('1.000', 'Tarjeta')])
+        pedido = Pedido.objects.filter(empresa=self.empresa).first()
+        self.assertEqual(pedido.fecha, self.ayer)
+        caja = caja_del_dia(self.empresa, timezone.localdate(self.ayer))
+        self.assertEqual(caja.ventas_efectivo, Decimal('200.00'))
+        self.assertEqual(caja.ventas_tarjeta, Decimal('200.00'))
+        self.assertEqual(caja.movimientos_pendientes, 2)
+        self.assertEqual(comparar_libro(self.empresa), [])
+
+    def test_stock_insuficiente_solo_rechaza_la_venta_que_no_alcanza(self):
+        resultados = registrar_ventas_en_lote(self.empresa, [
+            self.venta('4.000'), self.venta('2.000'), self.venta('1.000'), self.venta('1.000', 'Cheque'),
+        ])
+        self.assertEqual([r['estado'] for r in resultados], ['registrada', 'error', 'registrada', 'error'])
+        self.assertIn('Bistec', resultados[1]['mensaje'])
+        self.bistec.refresh_from_db()
+        self.assertEqual(self.bistec.stock, Decimal('0.000'))
+
+    def test_valores_no_finitos_solo_rechazan_su_venta(self):
+        response = self.enviar([
+            self.venta('1.000', monto_recibido='NaN'), self.venta('1.000', monto_recibido='Infinity'),
+            self.venta('Infinity'), self.venta('1.000', monto_recibido='500'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        resultados = response.json()['resultados']
+        self.assertEqual([r['estado'] for r in resultados], ['error', 'error', 'error', 'registrada'])
+        self.assertEqual(resultados[0]['mensaje'], "El monto recibido no es un número válido.")
+        self.bistec.refresh_from_db()
+        self.assertEqual(self.bistec.stock, Decimal('4.000'))
+
+    def test_cantidades_se_redondean_al_gramo(self):
+        resultados = registrar_ventas_en_lote(self.empresa, [self.venta('0.0001'), self.venta('1.0004')])
+        self.assertEqual([r['estado'] for r in resultados], ['error', 'registrada'])
+        item = PedidoItem.objects.get(pedido_id=resultados[1]['pedido_id'])
+        self.assertEqual((item.cantidad, item.subtotal), (Decimal('1.000'), Decimal('200.00')))
+        self.bistec.refresh_from_db()
+        self.assertEqual(self.bistec.stock, Decimal('4.000'))
+
+
+class EscanearCodigoTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Báscula")
+        self.user = User.objects.create_user('bascula', 'bascula@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.chuleta = Producto.objects.create(empresa=self.empresa, nombre="Chuleta", codigo='42', precio=Decimal('150.00'), stock=Decimal('10.000'))
+        self.refresco = Producto.objects.create(empresa=self.empresa, nombre="Refresco", codigo='7501055300075', precio=Decimal('25.00'), unidad_medida='unidad', requiere_stock=False)
+
+    def escanear(self, codigo, rev=0):
+        return self.client.post(reverse('escanear-codigo'), json.dumps({'codigo': codigo, 'rev': rev}), content_type='application/json')
+
+    def test_etiqueta_con_peso_agrega_la_linea(self):
+        # 20 | PLU 00042 | 1.250 kg | verificador
+        codigo = '200004201250' + digito_verificador_ean13('200004201250')
+        response = self.escanear(codigo)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['carrito'], {str(self.chuleta.id): '1.250'})
+        self.assertEqual(response.json()['total'], 187.5)
+
+    def test_codigo_de_empaque_agrega_una_pieza(self):
+        self.escanear('7501055300075')
+        self.escanear('7501055300075', rev=1)
+        self.assertEqual(self.client.session['carrito'], {str(self.refresco.id): '2'})
+
+    def test_etiqueta_con_importe(self):
+        with self.settings(ETIQUETA_BASCULA={'tipo_valor': 'importe', 'decimales_valor': 2}):
+            codigo = '200004207500' + digito_verificador_ean13('200004207500')  # $75.00
+            self.escanear(codigo)
+        self.assertEqual(self.client.session['carrito'], {str(self.chuleta.id): '0.500'})
+
+    def test_verificador_incorrecto_y_codigo_desconocido(self):
+        incorrecto = str((int(digito_verificador_ean13('200004201250')) + 1) % 10)
+        self.assertEqual(self.escanear('200004201250' + incorrecto).status_code, 400)
+        self.assertEqual(self.escanear('99999').status_code, 404)
+        self.assertNotIn('carrito', self.client.session)
+
+    def test_codigo_unico_por_empresa(self):
+        form = ProductoForm({'nombre': 'Otra', 'codigo': '42', 'precio': '10', 'unidad_medida': 'kg'}, empresa=self.empresa)
+        self.assertFalse(form.is_valid())
+        self.assertIn('codigo', form.errors)
+        otra = Empresa.objects.create(nombre="Otra Carnicería")
+        self.assertTrue(ProductoForm({'nombre': 'Otra', 'codigo': '42', 'precio': '10', 'unidad_medida': 'kg'}, empresa=otra).is_valid())
+
+
+class ResumenesDeVentasTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Tablero")
+        self.user = User.objects.create_user('tablero', 'tablero@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.pierna = Producto.objects.create(
+            empresa=self.empresa, nombre="Pierna", precio=Decimal('120.00'), costo=Decimal('80.00'), stock=Decimal('20.000')
+        )
+        self.tortillas = Producto.objects.create(
+            empresa=self.empresa, nombre="Tortillas", precio=Decimal('25.00'), costo=Decimal('18.00'), unidad_medida='unidad', requiere_stock=False
+        )
+
+    def vender(self, kilos):
+        carrito = {str(self.pierna.id): kilos, str(self.tortillas.id): '1'}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        return registrar_venta(self.empresa, items, total, 'Efectivo')
+
+    def test_venta_y_cancelacion_actualizan_los_resumenes(self):
+        self.vender('1.500')
+        pedido = self.vender('2.000')
+        self.client.post(reverse('cancelar-pedido', args=[pedido.id]))
+
+        dia = VentaDia.objects.get(empresa=self.empresa, fecha=timezone.localdate())
+        self.assertEqual((dia.pedidos, dia.cancelados), (2, 1))
+        self.assertEqual(dia.total, Decimal('470.00'))
+        self.assertEqual(dia.total_cancelado, Decimal('265.00'))
+        self.assertEqual(dia.costo, Decimal('138.00'))
+        self.assertEqual(dia.kg_vendidos, Decimal('1.500'))
+        fila = VentaProductoDia.objects.get(producto=self.pierna)
+        self.assertEqual((fila.cantidad, fila.total), (Decimal('1.500'), Decimal('180.00')))
+        self.assertEqual(comparar_resumenes(self.empresa), [])
+
+    def test_tablero_lee_el_resumen(self):
+        self.vender('1.000')
+        response = self.client.get(reverse('pagina-inicio'), {'time_range': '7dias'})
+        self.assertEqual(response.context['totales']['ventas_netas'], Decimal('145.00'))
+        self.assertEqual(response.context['totales']['margen'], Decimal('47.00'))
+
+    def test_margen_usa_el_costo_del_momento_de_la_venta(self):
+        pedido = self.vender('1.333')
+        linea = pedido.items.get(producto=self.pierna)
+        self.assertEqual((linea.costo_unitario, linea.subtotal), (Decimal('80.00'), Decimal('159.96')))
+
+        self.pierna.costo = Decimal('95.00')
+        self.pierna.save()
+        reconstruir_resumenes(self.empresa)
+        self.assertEqual(VentaDia.objects.get(empresa=self.empresa).costo, Decimal('124.64'))
+
+    def test_reconstruir_resumenes(self):
+        self.vender('1.000')
+        VentaProductoDia.objects.all().delete()
+        VentaDia.objects.update(total=0)
+        self.assertNotEqual(comparar_resumenes(self.empresa), [])
+        self.assertEqual(reconstruir_resumenes(self.empresa), (1, 2))
+        self.assertEqual(comparar_resumenes(self.empresa), [])
+
+
+class HistogramaVentasTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Gráficas")
+        self.user = User.objects.create_user('graficas', 'graficas@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.res = Producto.objects.create(empresa=self.empresa, nombre="Res", precio=Decimal('100.00'), stock=Decimal('50.000'))
+        self.ayer = timezone.localdate() - timedelta(days=1)
+        ContadorTicket.objects.create(empresa=self.empresa)
+
+    def vender_ayer(self, hora, kilos):
+        datos = {
+            'uuid': str(uuid.uuid4()), 'metodo_pago': 'Efectivo', 'lineas': [{'producto_id': self.res.id, 'cantidad': kilos}],
+            'fecha': timezone.make_aware(datetime.combine(self.ayer, time(hora, 15))).isoformat(),
+        }
+        return registrar_ventas_en_lote(self.empresa, [datos])[0]
+
+    def test_horas_cerradas_salen_del_cache(self):
+        self.vender_ayer(10, '2')
+        self.vender_ayer(10, '1')
+        self.vender_ayer(13, '1')
+        with self.assertNumQueries(1):
+            horas = ventas_por_hora(self.empresa, self.ayer)
+        self.assertEqual((horas[10], horas[13], horas[9]), (Decimal('300.00'), Decimal('100.00'), Decimal('0.00')))
+        with self.assertNumQueries(0):
+            self.assertEqual(ventas_por_hora(self.empresa, self.ayer), horas)
+
+    def test_cancelacion_invalida_su_cubeta(self):
+        pedido_id = self.vender_ayer(10, '2')['pedido_id']
+        self.assertEqual(ventas_por_hora(self.empresa, self.ayer)[10], Decimal('200.00'))
+        self.assertEqual(ventas_por_dia(self.empresa, self.ayer, self.ayer)[self.ayer], Decimal('200.00'))
+
+        self.client.post(reverse('cancelar-pedido', args=[pedido_id]))
+        self.assertEqual(ventas_por_hora(self.empresa, self.ayer)[10], Decimal('0.00'))
+        self.assertEqual(ventas_por_dia(self.empresa, self.ayer, self.ayer)[self.ayer], Decimal('0.00'))
+
+    def test_cubeta_guardada_durante_la_transaccion_se_borra_al_confirmar(self):
+        fecha = timezone.make_aware(datetime.combine(self.ayer, time(10, 15)))
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar_histograma(self.empresa, [fecha])
+            # Una lectura concurrente que aún no ve la cancelación vuelve a guardar la cubeta.
+            cache.set(clave_hora(self.empresa.id, fecha), Decimal('200.00'))
+            cache.set(clave_dia(self.empresa.id, self.ayer), Decimal('200.00'))
+        self.assertIsNone(cache.get(clave_hora(self.empresa.id, fecha)))
+        self.assertIsNone(cache.get(clave_dia(self.empresa.id, self.ayer)))
+
+    def test_dias_pasados_no_se_vuelven_a_consultar(self):
+        self.vender_ayer(10, '2')
+        inicio = timezone.localdate() - timedelta(days=6)
+        with self.assertNumQueries(1):
+            dias = ventas_por_dia(self.empresa, inicio, timezone.localdate())
+        self.assertEqual(len(dias), 7)
+        self.assertEqual(dias[self.ayer], Decimal('200.00'))
+        # Solo se vuelve a leer la fila de hoy.
+        with self.assertNumQueries(1):
+            self.assertEqual(ventas_por_dia(self.empresa, inicio, timezone.localdate()), dias)
+
+
+class ReporteVentasTestCase(TestCase):
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre="Carnicería Reportes")
+        self.user = User.objects.create_user('reportes', 'reportes@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        mediodia = timezone.make_aware(datetime.combine(timezone.localdate(), time(12)))
+        # Dos pedidos con la misma fecha para probar el desempate por id.
+        fechas = [mediodia - timedelta(minutes=m) for m in (50, 40, 30, 30, 10)]
+        self.pedidos = [
+            Pedido.objects.create(empresa=self.empresa, fecha=fecha, total=Decimal('100.00'), metodo_pago=metodo)
+            for fecha, metodo in zip(fechas, ['Efectivo', 'Tarjeta', 'Efectivo', 'Efectivo', 'Tarjeta'])
+        ]
+        Pedido.objects.filter(id=self.pedidos[0].id).update(estado='Cancelado')
+
+    def test_recorre_todas_las_paginas_sin_repetir(self):
+        url = f"{reverse('reporte-ventas')}?por_pagina=2"
+        vistos = []
+        while url:
+            response = self.client.get(url)
+            vistos.extend(p['id'] for p in response.context['pedidos'])
+            siguiente = response.context['url_siguiente']
+            url = f"{reverse('reporte-ventas')}?{siguiente}" if siguiente else None
+        esperados = [p.id for p in sorted(self.pedidos, key=lambda p: (p.fecha, p.id), reverse=True)]
+        self.assertEqual(vistos, esperados)
+
+    def test_cursor_alterado_vuelve_a_la_primera_pagina(self):
+        primera = [p['id'] for p in self.client.get(reverse('reporte-ventas')).context['pedidos']]
+        for cursor in ('-99999999999999999_1', '99999999999999999999_1', 'abc_1', 'sin-separador'):
+            response = self.client.get(reverse('reporte-ventas'), {'despues': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([p['id'] for p in response.context['pedidos']], primera)
+
+    def test_totales_excluyen_cancelados(self):
+        response = self.client.get(reverse('reporte-ventas'))
+        totales = response.context['totales']
+        self.assertEqual(response.context['total_vendido'], Decimal('400.00'))
+        self.assertEqual((totales['total_efectivo'], totales['total_tarjeta']), (Decimal('200.00'), Decimal('200.00')))
+        self.assertEqual((totales['num_completados'], totales['num_cancelados']), (4, 1))
+
+
+class ExportarVentasTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Contador")
+        self.user = User.objects.create_user('contador', 'contador@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        producto = Producto.objects.create(empresa=self.empresa, nombre="Agujas", codigo='17', precio=Decimal('140.00'), stock=Decimal('10.000'))
+        items, total = cotizar_carrito(self.empresa, {str(producto.id): '1.500'})
+        self.pedido = registrar_venta(self.empresa, items, total, 'Tarjeta')
+        hoy = timezone.localdate().isoformat()
+        self.url = f"{reverse('exportar-ventas')}?fecha_inicio={hoy}&fecha_fin={hoy}"
+
+    def leer(self, response):
+        contenido = b''.join(response.streaming_content)
+        return list(csv.reader(contenido.decode('utf-8-sig').splitlines()))
+
+    def test_exporta_pedidos(self):
+        filas = self.leer(self.client.get(self.url))
+        self.assertEqual(filas[0][0], 'ticket')
+        self.assertEqual(filas[1][0], str(self.pedido.ticket_numero))
+        self.assertEqual(filas[1][5], '210.00')
+
+    def test_exporta_lineas_comprimidas(self):
+        response = self.client.get(self.url + '&detalle=lineas&gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        contenido = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8-sig')
+        filas = list(csv.reader(contenido.splitlines()))
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1][4:7], ['Agujas', '17', '1.500'])
+
+
+class AnaliticaProductosTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Pareto")
+        self.hasta = timezone.localdate() - timedelta(days=1)
+        self.productos = [
+            Producto.objects.create(empresa=self.empresa, nombre=nombre, precio=Decimal('100.00'))
+            for nombre in ("Arrachera", "Bistec", "Molida", "Hueso")
+        ]
+        # Arrachera crece 1 kg por día; los demás venden parejo.
+        for dia in range(10):
+            fecha = self.hasta - timedelta(days=9 - dia)
+            for producto, cantidad, costo in zip(self.productos, (dia + 1, 3, 1, Decimal('0.2')), (60, 90, 40, 10)):
+                VentaProductoDia.objects.create(
+                    empresa=self.empresa, producto=producto, fecha=fecha, cantidad=cantidad,
+                    total=Decimal(cantidad) * 100, costo=Decimal(cantidad) * costo,
+                )
+
+    def test_clases_tendencia_y_top(self):
+        resultado = analizar_productos(self.empresa, dias=10, hasta=self.hasta, top=2)
+        arrachera, bistec, molida, hueso = (resultado['productos'][p.id] for p in self.productos)
+        # Ingresos: 5500, 3000, 1000, 200 de 9700.
+        self.assertEqual([arrachera['clase'], bistec['clase'], molida['clase'], hueso['clase']], ['A', 'A', 'B', 'C'])
+        self.assertAlmostEqual(arrachera['tendencia'], 1.0)
+        self.assertAlmostEqual(bistec['tendencia'], 0.0)
+        self.assertAlmostEqual(arrachera['promedio_diario'], 5.5)
+        self.assertEqual(resultado['top_ingreso'], [self.productos[0].id, self.productos[1].id])
+        self.assertEqual(resultado['top_margen'][0], self.productos[0].id)
+
+    def test_en_cache_por_dia_y_visible_en_inventario(self):
+        user = User.objects.create_user('pareto', 'pareto@example.com', 'password')
+        UserProfile.objects.create(user=user, empresa=self.empresa)
+        self.client.force_login(user)
+        self.client.get(reverse('gestion-inventario'))
+        with self.assertNumQueries(0):
+            analitica_del_dia(self.empresa)
+        response = self.client.get(reverse('gestion-inventario'))
+        self.assertContains(response, 'Lo Más Vendido')
+        self.assertEqual(response.context['top_ingreso'][0][0], 'Arrachera')
+
+    def test_cambios_en_dias_pasados_renuevan_el_cache(self):
+        ContadorTicket.objects.create(empresa=self.empresa)
+        Producto.objects.filter(id=self.productos[3].id).update(stock=Decimal('500.000'))
+        self.assertEqual(analitica_del_dia(self.empresa)['top_ingreso'][0], self.productos[0].id)
+        # Una venta grande de ayer capturada en lote hoy.
+        datos = {
+            'uuid': str(uuid.uuid4()), 'metodo_pago': 'Efectivo', 'lineas': [{'producto_id': self.productos[3].id, 'cantidad': '100'}],
+            'fecha': timezone.make_aware(datetime.combine(self.hasta, time(12))).isoformat(),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido_id = registrar_ventas_en_lote(self.empresa, [datos])[0]['pedido_id']
+        self.assertEqual(analitica_del_dia(self.empresa)['top_ingreso'][0], self.productos[3].id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cancelar_venta(Pedido.objects.get(id=pedido_id))
+        self.assertEqual(analitica_del_dia(self.empresa)['top_ingreso'][0], self.productos[0].id)
+
+
+class PronosticoTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Pronóstico")
+        self.hoy = timezone.localdate()
+        self.sobrado = Producto.objects.create(empresa=self.empresa, nombre="Costilla", precio=Decimal('100.00'), stock=Decimal('10.000'))
+        self.escaso = Producto.objects.create(empresa=self.empresa, nombre="Pulpa", precio=Decimal('100.00'), stock=Decimal('3.000'))
+        self.sin_ventas = Producto.objects.create(empresa=self.empresa, nombre="Lengua", precio=Decimal('100.00'), stock=Decimal('5.000'))
+        self.sin_inventario = Producto.objects.create(empresa=self.empresa, nombre="Servicio", precio=Decimal('10.00'), requiere_stock=False)
+        # Dos kilos diarios parejos durante toda la historia.
+        VentaProductoDia.objects.bulk_create([
+            VentaProductoDia(empresa=self.empresa, producto=producto, fecha=self.hoy - timedelta(days=dia),
+                             cantidad=Decimal('2.000'), total=Decimal('200.00'), costo=Decimal('120.00'))
+            for producto in (self.sobrado, self.escaso, self.sin_inventario) for dia in range(1, DIAS_HISTORIA + 1)
+        ])
+
+    def test_efecto_dia_de_la_semana(self):
+        lunes = datetime(2026, 1, 5).date()
+        # Entre semana 10 kg, los sábados 20 kg, ocho semanas.
+        historia = np.array([[20.0 if (lunes + timedelta(days=d)).weekday() == 5 else 10.0 for d in range(56)]])
+        pronostico, _ = pronosticar(historia, lunes, horizonte=7)
+        # El horizonte empieza en lunes otra vez: el índice 5 es sábado.
+        self.assertGreater(pronostico[0, 5], 1.5 * pronostico[0, 0])
+        self.assertAlmostEqual(pronostico[0].sum(), 80.0, delta=8.0)
+
+    def test_punto_de_reorden_y_cobertura(self):
+        self.assertEqual(actualizar_pronosticos(self.empresa, hoy=self.hoy), 3)
+        sobrado, escaso, sin_ventas = (
+            PronosticoProducto.objects.get(producto=p) for p in (self.sobrado, self.escaso, self.sin_ventas)
+        )
+        self.assertEqual(sobrado.demanda_diaria, Decimal('2.000'))
+        self.assertEqual(sobrado.dias_cobertura, Decimal('5.0'))
+        self.assertEqual(sobrado.cantidad_sugerida, Decimal('0.000'))
+        # Con 2 días de entrega y 7 de cobertura hacen falta 18 kg; hay 3.
+        self.assertEqual(escaso.punto_reorden, Decimal('4.000'))
+        self.assertEqual(escaso.dias_cobertura, Decimal('1.5'))
+        self.assertEqual(escaso.cantidad_sugerida, Decimal('15.000'))
+        self.assertEqual(sin_ventas.demanda_diaria, Decimal('0.000'))
+        self.assertIsNone(sin_ventas.dias_cobertura)
+        self.assertFalse(PronosticoProducto.objects.filter(producto=self.sin_inventario).exists())
+
+        user = User.objects.create_user('pronostico', 'pronostico@example.com', 'password')
+        UserProfile.objects.create(user=user, empresa=self.empresa)
+        self.client.force_login(user)
+        response = self.client.get(reverse('gestion-inventario'))
+        self.assertContains(response, 'Alcanza 1.5 días')
+        self.assertContains(response, 'Pedir 15.00')
+
+    def test_comando_actualiza_y_quita_archivados(self):
+        actualizar_pronosticos(self.empresa, hoy=self.hoy)
+        self.escaso.is_active = False
+        self.escaso.save()
+        call_command('actualizar_pronosticos', empresa=self.empresa.id, stdout=io.StringIO())
+        self.assertEqual(PronosticoProducto.objects.filter(empresa=self.empresa).count(), 2)
+        self.assertFalse(PronosticoProducto.objects.filter(producto=self.escaso).exists())
+
+
+class AdminPlataformaTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('plataforma', 'plataforma@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def _crear_empresas(self, cuantas, inicio=0):
+        for i in range(inicio, inicio + cuantas):
+            empresa = Empresa.objects.create(nombre=f"Carnicería {i}")
+            user = User.objects.create_user(f'dueno{i}', f'dueno{i}@example.com', 'password')
+            UserProfile.objects.create(user=user, empresa=empresa)
+            VentaDia.objects.create(empresa=empresa, fecha=timezone.localdate(), pedidos=2, total=Decimal('150.00'))
+
+    def test_listado_de_empresas_sin_consultas_por_renglon(self):
+        self._crear_empresas(2)
+        url = reverse('admin:inventario_empresa_changelist')
+        with CaptureQueriesContext(connection) as pocas:
+            response = self.client.get(url)
+        self.assertContains(response, 'dueno1@example.com')
+        self.assertContains(response, '$150.00')
+        self._crear_empresas(5, inicio=2)
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(url)
+        self.assertEqual(len(pocas), len(muchas))
+
+    def test_metricas_desde_la_foto(self):
+        self._crear_empresas(3)
+        primera = metricas_plataforma()
+        self.assertEqual((primera.total_empresas, primera.nuevas_semana, primera.total_pedidos), (3, 3, 6))
+        self.assertEqual(primera.monto_total_vendido, Decimal('450.00'))
+        # La segunda carga solo lee la foto vigente.
+        with self.assertNumQueries(1):
+            self.assertEqual(metricas_plataforma().id, primera.id)
+        MetricasPlataforma.objects.filter(id=primera.id).update(calculado=timezone.now() - timedelta(days=1))
+        self.assertNotEqual(metricas_plataforma().id, primera.id)
+        response = self.client.get(reverse('admin:index'))
+        self.assertEqual(response.context['growth_stats']['total_empresas'], 3)
+
+
+class RangosDeDiasTestCase(TestCase):
+    """Los filtros por día de negocio deben dar lo mismo que __date y poder usar los índices."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.empresa = Empresa.objects.create(nombre="Carnicería Índices")
+        otra = Empresa.objects.create(nombre="Carnicería Vecina")
+        arqueo = Arqueo.objects.create(empresa=cls.empresa, fecha=timezone.localdate())
+        cls.hoy = timezone.localdate()
+        inicio = timezone.make_aware(datetime.combine(cls.hoy - timedelta(days=90), time(8)))
+        # Noventa días de historia con cien tickets diarios por empresa; lo anterior a hoy ya está sellado.
+        Pedido.objects.bulk_create([
+            Pedido(empresa=empresa, total=Decimal('10.00'), fecha=inicio + timedelta(days=dia, minutes=6 * n),
+                   arqueo=arqueo if dia < 90 and empresa is cls.empresa else None)
+            for empresa in (cls.empresa, otra) for dia in range(91) for n in range(100)
+        ], batch_size=2000)
+        Retiro.objects.bulk_create([
+            Retiro(empresa=cls.empresa, monto=Decimal('5.00'), concepto="Gasto", fecha=inicio + timedelta(days=dia))
+            for dia in range(91)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_mismo_resultado_que_date(self):
+        medianoche = timezone.make_aware(datetime.combine(self.hoy, time.min))
+        antes = Pedido.objects.create(empresa=self.empresa, total=Decimal('1.00'), fecha=medianoche - timedelta(microseconds=1))
+        justo = Pedido.objects.create(empresa=self.empresa, total=Decimal('1.00'), fecha=medianoche)
+        ayer = self.hoy - timedelta(days=1)
+        for desde, hasta in ((self.hoy, self.hoy), (ayer, ayer), (ayer - timedelta(days=6), self.hoy)):
+            por_rango = set(Pedido.objects.filter(empresa=self.empresa, **filtro_de_dias('fecha', desde, hasta)).values_list('id', flat=True))
+            por_date = set(Pedido.objects.filter(empresa=self.empresa, fecha__date__range=[desde, hasta]).values_list('id', flat=True))
+            self.assertEqual(por_rango, por_date)
+        hoy = set(Pedido.objects.filter(**filtro_de_dias('fecha', self.hoy)).values_list('id', flat=True))
+        self.assertIn(justo.id, hoy)
+        self.assertNotIn(antes.id, hoy)
+        inicio, fin = rango_de_dias(self.hoy)
+        self.assertEqual(fin - inicio, timedelta(days=1))
+        self.assertEqual(inicio.utcoffset(), timedelta(0))
+
+    def test_reporte_por_rango_usa_indice(self):
+        plan = Pedido.objects.filter(
+            empresa=self.empresa, **filtro_de_dias('fecha', self.hoy - timedelta(days=6), self.hoy)
+        ).order_by('-fecha', '-id').explain()
+        self.assertRegex(plan, r'pedido_(empresa|sin_arqueo)_fecha')
+
+    def test_cierre_usa_indice_parcial(self):
+        for consulta in (
+            Pedido.objects.filter(empresa=self.empresa, arqueo__isnull=True, **filtro_de_dias('fecha', self.hoy)),
+            Retiro.objects.filter(empresa=self.empresa, arqueo__isnull=True, **filtro_de_dias('fecha', self.hoy)),
+        ):
+            self.assertRegex(consulta.explain(), r'(pedido|retiro)_sin_arqueo_fecha')
+
+
+class CacheDeReportesTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Sellada")
+        self.user = User.objects.create_user('sellada', 'sellada@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.ayer = timezone.localdate() - timedelta(days=1)
+        self.mediodia_ayer = timezone.make_aware(datetime.combine(self.ayer, time(12)))
+        arqueo = Arqueo.objects.create(empresa=self.empresa, fecha=self.ayer)
+        # Un día ya cerrado: sus pedidos tienen arqueo y el libro no tiene pendientes.
+        for metodo in ('Efectivo', 'Tarjeta'):
+            Pedido.objects.create(empresa=self.empresa, fecha=self.mediodia_ayer, total=Decimal('100.00'), metodo_pago=metodo, arqueo=arqueo)
+
+    def test_dia_sellado_se_lee_del_cache(self):
+        primera = totales_por_dia(self.empresa, self.ayer, self.ayer)
+        self.assertEqual(primera[self.ayer]['total_vendido'], Decimal('200.00'))
+        # Solo se consulta qué días siguen abiertos.
+        with self.assertNumQueries(1):
+            self.assertEqual(totales_por_dia(self.empresa, self.ayer, self.ayer), primera)
+
+    def test_movimiento_en_el_dia_invalida(self):
+        totales_por_dia(self.empresa, self.ayer, self.ayer)
+        tardio = Pedido.objects.create(empresa=self.empresa, fecha=self.mediodia_ayer, total=Decimal('50.00'), metodo_pago='Efectivo')
+        registrar_venta_en_caja(tardio)
+        totales = totales_por_dia(self.empresa, self.ayer, self.ayer)[self.ayer]
+        self.assertEqual((totales['total_vendido'], totales['total_efectivo']), (Decimal('250.00'), Decimal('150.00')))
+
+    def test_dia_abierto_siempre_se_calcula(self):
+        hoy = timezone.localdate()
+        Pedido.objects.create(empresa=self.empresa, total=Decimal('30.00'))
+        totales_por_dia(self.empresa, hoy, hoy)
+        # Sin pasar por el libro de caja: si hoy estuviera en cache no se vería.
+        Pedido.objects.create(empresa=self.empresa, total=Decimal('20.00'))
+        self.assertEqual(totales_por_dia(self.empresa, hoy, hoy)[hoy]['total_vendido'], Decimal('50.00'))
+
+    def test_vistas_usan_el_cache(self):
+        VentaDia.objects.create(empresa=self.empresa, fecha=self.ayer, pedidos=2, total=Decimal('200.00'), costo=Decimal('120.00'))
+        response = self.client.get(reverse('pagina-inicio'))
+        fila = next(fila for fila in response.context['reporte_diario'] if fila['fecha'] == self.ayer)
+        self.assertEqual((fila['ventas'], fila['ventas_netas'], fila['margen']), (2, Decimal('200.00'), Decimal('80.00')))
+        ayer = self.ayer.strftime('%Y-%m-%d')
+        response = self.client.get(reverse('reporte-ventas'), {'fecha_inicio': ayer, 'fecha_fin': ayer})
+        self.assertEqual(response.context['total_vendido'], Decimal('200.00'))
+
+        self.assertEqual(len(self.client.get(reverse('reporte-arqueos')).context['arqueos']), 1)
+        hoy = timezone.localdate()
+        pedido = Pedido.objects.create(empresa=self.empresa, total=Decimal('80.00'), metodo_pago='Efectivo')
+        registrar_venta_en_caja(pedido)
+        self.client.post(reverse('cerrar-caja'), {'fecha_arqueo': hoy.strftime('%Y-%m-%d'), 'monto_contado': '80.00'})
+        arqueos = self.client.get(reverse('reporte-arqueos')).context['arqueos']
+        self.assertEqual([arqueo['fecha'] for arqueo in arqueos], [hoy, self.ayer])
+
+
+class TurnosDeCajaTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Dos Cajas")
+        self.producto = Producto.objects.create(empresa=self.empresa, nombre="Bistec", precio=Decimal('200.00'), stock=Decimal('50.000'))
+        self.cajeros = []
+        for nombre in ('manana', 'tarde'):
+            user = User.objects.create_user(nombre, f'{nombre}@example.com', 'password')
+            UserProfile.objects.create(user=user, empresa=self.empresa)
+            cliente = self.client_class()
+            cliente.force_login(user)
+            self.cajeros.append(cliente)
+        self.caja1, self.caja2 = self.cajeros
+
+    def abrir(self, cliente, caja, fondo='500.00'):
+        return cliente.post(reverse('turno-caja'), {'caja': caja, 'fondo_inicial': fondo})
+
+    def vender(self, cliente, metodo_pago='Efectivo'):
+        session = cliente.session
+        session['carrito'] = {str(self.producto.id): '1.000'}
+        session.save()
+        cliente.post(reverse('finalizar-venta', args=[metodo_pago]), {'monto_recibido': '10000'})
+        return Pedido.objects.filter(empresa=self.empresa).latest('id')
+
+    def test_cada_caja_lleva_y_cierra_su_turno(self):
+        self.abrir(self.caja1, 'Caja 1')
+        self.abrir(self.caja2, 'Caja 2', fondo='0.00')
+        self.vender(self.caja1)
+        self.vender(self.caja1, 'Tarjeta')
+        self.vender(self.caja2)
+        self.caja1.post(reverse('gestion-caja'), {'monto': '50.00', 'concepto': 'Hielo'})
+
+        turno1, turno2 = Turno.objects.filter(empresa=self.empresa).order_by('caja')
+        self.assertEqual((turno1.ventas_efectivo, turno1.ventas_tarjeta, turno1.retiros, turno1.movimientos),
+                         (Decimal('200.00'), Decimal('200.00'), Decimal('50.00'), 3))
+        self.assertEqual(turno2.ventas_efectivo, Decimal('200.00'))
+        # El libro del día no se toca, así que ninguna caja bloquea a la otra.
+        self.assertFalse(CajaDia.objects.filter(empresa=self.empresa).exists())
+        self.assertEqual(comparar_libro(self.empresa), [])
+
+        response = self.caja1.post(reverse('cerrar-turno'), {'monto_contado': '640.00'})
+        arqueo = Arqueo.objects.get(turno=turno1)
+        self.assertRedirects(response, reverse('cierre-caja-exitoso', args=[arqueo.id]), fetch_redirect_response=False)
+        self.assertEqual((arqueo.ventas_efectivo, arqueo.ventas_tarjeta, arqueo.retiros), (Decimal('200.00'), Decimal('200.00'), Decimal('50.00')))
+        self.assertEqual((arqueo.efectivo_esperado, arqueo.diferencia), (Decimal('650.00'), Decimal('-10.00')))
+        self.assertEqual(Pedido.objects.filter(arqueo=arqueo).count(), 2)
+        self.assertEqual(Retiro.objects.filter(arqueo=arqueo).count(), 1)
+        self.assertFalse(Pedido.objects.filter(turno=turno2, arqueo__isnull=False).exists())
+
+        # La otra caja sigue vendiendo en su turno.
+        self.vender(self.caja2, 'Tarjeta')
+        turno2.refresh_from_db()
+        self.assertEqual(turno2.ventas_tarjeta, Decimal('200.00'))
+        self.assertEqual(self.caja2.get(reverse('reporte-arqueos')).context['arqueos'][0]['turno__caja'], 'Caja 1')
+
+    def test_una_caja_no_abre_dos_turnos(self):
+        abrir_turno(self.empresa, 'Caja 1')
+        with self.assertRaises(TurnoInvalido):
+            abrir_turno(self.empresa, 'Caja 1')
+        self.assertEqual(Turno.objects.filter(empresa=self.empresa, cierre__isnull=True).count(), 1)
+
+    def test_venta_con_turno_ya_cerrado_no_se_registra(self):
+        self.abrir(self.caja1, 'Caja 1')
+        turno = Turno.objects.get(empresa=self.empresa)
+        cerrar_turno(turno, Decimal('500.00'))
+        antes = Pedido.objects.count()
+        session = self.caja1.session
+        session['carrito'] = {str(self.producto.id): '1.000'}
+        session.save()
+        response = self.caja1.post(reverse('finalizar-venta', args=['Efectivo']), {'monto_recibido': '10000'})
+        self.assertRedirects(response, reverse('turno-caja'), fetch_redirect_response=False)
+        self.assertEqual(Pedido.objects.count(), antes)
+
+    def test_cancelar_resta_del_turno(self):
+        self.abrir(self.caja1, 'Caja 1')
+        pedido = self.vender(self.caja1)
+        self.caja1.post(reverse('cancelar-pedido', args=[pedido.id]))
+        turno = Turno.objects.get(empresa=self.empresa)
+        self.assertEqual((turno.ventas_efectivo, turno.movimientos), (Decimal('0.00'), 1))
+        arqueo = cerrar_turno(turno, Decimal('500.00'))
+        self.assertEqual((arqueo.ventas_efectivo, arqueo.diferencia), (Decimal('0.00'), Decimal('0.00')))
+
+
+class MarcadorDiaPendienteTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Marcador")
+        self.user = User.objects.create_user('marcador', 'marcador@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.hoy = timezone.localdate()
+
+    def registrar(self, fecha):
+        mediodia = timezone.make_aware(datetime.combine(fecha, time(12)))
+        pedido = Pedido.objects.create(empresa=self.empresa, fecha=mediodia, total=Decimal('100.00'), metodo_pago='Efectivo')
+        registrar_venta_en_caja(pedido)
+
+    def marcador(self):
+        return Empresa.objects.values_list('pendiente_desde', flat=True).get(id=self.empresa.id)
+
+    def test_ventas_marcan_y_cierres_adelantan(self):
+        self.registrar(self.hoy - timedelta(days=1))
+        self.registrar(self.hoy - timedelta(days=3))
+        self.registrar(self.hoy)
+        self.assertEqual(self.marcador(), self.hoy - timedelta(days=3))
+
+        cerrar_dias(self.empresa, {self.hoy - timedelta(days=3): None})
+        self.assertEqual(self.marcador(), self.hoy - timedelta(days=1))
+        cerrar_dias(self.empresa, {self.hoy - timedelta(days=1): None, self.hoy: None})
+        self.assertIsNone(self.marcador())
+        self.assertEqual(comparar_libro(self.empresa), [])
+
+    def test_venta_y_cierre_bloquean_empresa_antes_que_el_libro(self):
+        """Ambos caminos toman Empresa y luego CajaDia, así que no pueden quedar en interbloqueo."""
+        def primera(consultas, tabla):
+            return next(i for i, q in enumerate(consultas.captured_queries) if f'"{tabla}"' in q['sql'])
+
+        with CaptureQueriesContext(connection) as venta:
+            self.registrar(self.hoy)
+        self.assertLess(primera(venta, 'inventario_empresa'), primera(venta, 'inventario_cajadia'))
+        with CaptureQueriesContext(connection) as cierre:
+            cerrar_dias(self.empresa, {self.hoy: None})
+        self.assertLess(primera(cierre, 'inventario_empresa'), primera(cierre, 'inventario_cajadia'))
+
+    def test_pos_sin_pendientes_no_consulta_el_libro(self):
+        for dias in range(30, 0, -1):
+            self.registrar(self.hoy - timedelta(days=dias))
+        cerrar_dias(self.empresa, {self.hoy - timedelta(days=dias): None for dias in range(30, 0, -1)})
+        self.registrar(self.hoy)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('pos', args=['mostrador']))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in consultas.captured_queries if 'movimientos_pendientes" > ' in q['sql']])
+
+        # Un día pendiente se detecta con el marcador que ya viene en la empresa.
+        self.registrar(self.hoy - timedelta(days=2))
+        response = self.client.get(reverse('pos', args=['mostrador']))
+        self.assertTemplateUsed(response, 'inventario/arqueo_pendiente.html')
+        self.assertEqual(response.context['dia_pendiente'], self.hoy - timedelta(days=2))
+
+    def test_reconstruir_corrige_el_marcador(self):
+        self.registrar(self.hoy - timedelta(days=2))
+        Empresa.objects.filter(id=self.empresa.id).update(pendiente_desde=None)
+        self.assertEqual(comparar_libro(self.empresa), [
+            (self.empresa.id, self.hoy - timedelta(days=2), 'pendiente_desde', None, self.hoy - timedelta(days=2)),
+        ])
+        reconstruir_libro(self.empresa)
+        self.assertEqual(self.marcador(), self.hoy - timedelta(days=2))
+
+
+class ReporteArqueosTestCase(TestCase):
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre="Carnicería Arqueos")
+        self.user = User.objects.create_user('auditor', 'auditor@example.com', 'password')
+        self.cajero = User.objects.create_user('cajero', 'cajero@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.hoy = timezone.localdate()
+        # 40 días seguidos: el cajero queda corto $10 cada día, el encargado sobra $5 los días pares.
+        for dias in range(40):
+            faltante = dias % 2
+            Arqueo.objects.create(
+                empresa=self.empresa, fecha=self.hoy - timedelta(days=dias),
+                diferencia=Decimal('-10.00') if faltante else Decimal('5.00'),
+                cerrado_por=self.cajero if faltante else self.user,
+            )
+        Arqueo.objects.create(empresa=Empresa.objects.create(nombre="Otra"), fecha=self.hoy, diferencia=Decimal('-999.00'))
+
+    def test_resumen_del_periodo(self):
+        desde = (self.hoy - timedelta(days=9)).strftime('%Y-%m-%d')
+        response = self.client.get(reverse('reporte-arqueos'), {'fecha_inicio': desde, 'fecha_fin': self.hoy.strftime('%Y-%m-%d')})
+        resumen = response.context['resumen']
+        self.assertEqual((resumen['arqueos'], resumen['con_faltante'], resumen['con_sobrante']), (10, 5, 5))
+        self.assertEqual((resumen['diferencia_total'], resumen['peor_faltante']), (Decimal('-25.00'), Decimal('-10.00')))
+        self.assertEqual(resumen['por_cajero'][0]['cerrado_por__username'], 'cajero')
+        self.assertEqual(resumen['por_cajero'][0]['diferencia_total'], Decimal('-50.00'))
+        # El acumulado de 30 días ve hacia atrás más allá del período filtrado.
+        self.assertEqual(response.context['arqueos'][-1]['acumulado_30'], Decimal('-75.00'))
+
+    def test_arqueos_sin_conteo_no_cuentan_en_las_diferencias(self):
+        Arqueo.objects.create(empresa=self.empresa, fecha=self.hoy, monto_contado=None, diferencia=None, cerrado_por=self.cajero)
+        response = self.client.get(reverse('reporte-arqueos'), {'fecha_inicio': self.hoy.strftime('%Y-%m-%d'), 'fecha_fin': self.hoy.strftime('%Y-%m-%d')})
+        resumen = response.context['resumen']
+        self.assertEqual((resumen['arqueos'], resumen['sin_conteo'], resumen['diferencia_total']), (1, 1, Decimal('5.00')))
+        self.assertEqual([cajero['cerrado_por__username'] for cajero in resumen['por_cajero']], ['auditor'])
+        self.assertContains(response, 'Sin conteo')
+
+    def test_paginas_por_llave(self):
+        vistos = []
+        parametros = {'fecha_inicio': (self.hoy - timedelta(days=39)).strftime('%Y-%m-%d'), 'fecha_fin': self.hoy.strftime('%Y-%m-%d')}
+        response = self.client.get(reverse('reporte-arqueos'), parametros)
+        while True:
+            vistos += [arqueo['fecha'] for arqueo in response.context['arqueos']]
+            if not response.context['url_siguiente']:
+                break
+            response = self.client.get(reverse('reporte-arqueos') + '?' + response.context['url_siguiente'])
+        self.assertEqual(vistos, [self.hoy - timedelta(days=dias) for dias in range(40)])
+        self.assertEqual(response.context['resumen']['arqueos'], 40)
+
+
+class DevolucionesTestCase(CatalogoLimpioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.empresa = Empresa.objects.create(nombre="Carnicería Devoluciones")
+        self.user = User.objects.create_user('mostrador', 'mostrador@example.com', 'password')
+        UserProfile.objects.create(user=self.user, empresa=self.empresa)
+        self.client.force_login(self.user)
+        self.productos = [
+            Producto.objects.create(empresa=self.empresa, nombre=f"Corte {i}", precio=Decimal('150.00'), costo=Decimal('99.99'), stock=Decimal('20.000'))
+            for i in range(5)
+        ]
+        self.hoy = timezone.localdate()
+
+    def vender(self, cantidades):
+        carrito = {str(producto.id): cantidad for producto, cantidad in zip(self.productos, cantidades)}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        return registrar_venta(self.empresa, items, total, 'Efectivo')
+
+    def stock(self):
+        return [producto.stock for producto in Producto.objects.filter(empresa=self.empresa).order_by('id')]
+
+    def assertCuadra(self):
+        self.assertEqual(comparar_libro(self.empresa), [])
+        self.assertEqual(comparar_resumenes(self.empresa), [])
+
+    def test_cancelar_repone_stock_en_consultas_constantes(self):
+        consultas = []
+        for cantidades in (['1.000', '1.000'], ['1.000'] * 5):
+            pedido = self.vender(cantidades)
+            with CaptureQueriesContext(connection) as capturadas:
+                cancelar_venta(pedido, self.user)
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertEqual(self.stock(), [Decimal('20.000')] * 5)
+        self.assertEqual(Pedido.objects.get(id=pedido.id).estado, 'Cancelado')
+        self.assertCuadra()
+
+    def test_bloquea_la_caja_antes_que_el_pedido(self):
+        """Como cerrar_dias y cerrar_turno: primero la caja (libro o turno), luego el pedido."""
+        def primera(consultas, tabla):
+            return next(i for i, q in enumerate(consultas.captured_queries) if f'FROM "{tabla}"' in q['sql'])
+
+        pedido = self.vender(['1.000', '1.000'])
+        with CaptureQueriesContext(connection) as consultas:
+            devolver_lineas(pedido, {pedido.items.first().id: Decimal('0.500')})
+        self.assertLess(primera(consultas, 'inventario_cajadia'), primera(consultas, 'inventario_pedido'))
+
+        turno = abrir_turno(self.empresa, 'Caja 1', self.user)
+        items, total = cotizar_carrito(self.empresa, {str(self.productos[0].id): '1.000'})
+        pedido = registrar_venta(self.empresa, items, total, 'Efectivo', turno=turno)
+        with CaptureQueriesContext(connection) as consultas:
+            cancelar_venta(pedido)
+        self.assertLess(primera(consultas, 'inventario_turno'), primera(consultas, 'inventario_pedido'))
+
+    def test_devolucion_parcial_descuenta_sin_recorrer_el_ticket(self):
+        pedido = self.vender(['2.000', '0.750'])
+        lineas = {linea.producto_id: linea for linea in pedido.items.all()}
+        response = self.client.post(reverse('devolver-pedido', args=[pedido.id]), {
+            f'devolver_{lineas[self.productos[0].id].id}': '0.500',
+        })
+        self.assertRedirects(response, reverse('detalle-pedido', args=[pedido.id]), fetch_redirect_response=False)
+
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.total, Decimal('337.50'))
+        self.assertEqual(self.stock()[:2], [Decimal('18.500'), Decimal('19.250')])
+        self.assertEqual(caja_del_dia(self.empresa, self.hoy).ventas_efectivo, Decimal('337.50'))
+        self.assertEqual(totales_por_dia(self.empresa, self.hoy, self.hoy)[self.hoy]['total_vendido'], Decimal('337.50'))
+        fila = VentaProductoDia.objects.get(producto=self.productos[0], fecha=self.hoy)
+        self.assertEqual((fila.cantidad, fila.total), (Decimal('1.500'), Decimal('225.00')))
+        self.assertCuadra()
+        self.assertIn('DEV Corte 0', self.client.get(reverse('detalle-pedido', args=[pedido.id])).context['texto_del_ticket_json'])
+
+    def test_cantidades_no_numericas_se_rechazan(self):
+        pedido = self.vender(['1.000'])
+        linea = pedido.items.get()
+        for valor in ('NaN', 'Infinity', '-inf', 'abc'):
+            response = self.client.post(reverse('devolver-pedido', args=[pedido.id]), {f'devolver_{linea.id}': valor})
+            self.assertRedirects(response, reverse('detalle-pedido', args=[pedido.id]), fetch_redirect_response=False)
+        self.assertFalse(Devolucion.objects.filter(pedido=pedido).exists())
+        self.assertEqual(self.stock()[0], Decimal('19.000'))
+
+    def test_devoluciones_sucesivas_y_cancelacion_cuadran_al_centavo(self):
+        pedido = self.vender(['1.000'])
+        linea = pedido.items.get()
+        for cantidad in ('0.333', '0.333'):
+            devolver_lineas(pedido, {linea.id: Decimal(cantidad)}, self.user)
+        with self.assertRaises(DevolucionInvalida):
+            devolver_lineas(pedido, {linea.id: Decimal('0.400')}, self.user)
+        self.client.post(reverse('cancelar-pedido', args=[pedido.id]))
+
+        self.assertEqual(sum(d.importe for d in Devolucion.objects.filter(pedido=pedido)), Decimal('99.90'))
+        self.assertEqual(self.stock()[0], Decimal('20.000'))
+        self.assertEqual(caja_del_dia(self.empresa, self.hoy).ventas_efectivo, Decimal('0.00'))
+        fila = VentaProductoDia.objects.get(producto=self.productos[0], fecha=self.hoy)
+        self.assertEqual((fila.cantidad, fila.total, fila.costo), (Decimal('0.000'), Decimal('0.00'), Decimal('0.00')))
+        self.assertCuadra()
+
+    def test_devolucion_en_turno_y_cierre(self):
+        turno = abrir_turno(self.empresa, 'Caja 1', self.user, Decimal('100.00'))
+        carrito = {str(self.productos[0].id): '2.000'}
+        items, total = cotizar_carrito(self.empresa, carrito)
+        pedido = registrar_venta(self.empresa, items, total, 'Efectivo', turno=turno)
+        devolver_lineas(pedido, {pedido.items.get().id: Decimal('1.000')})
+        turno.refresh_from_db()
+        self.assertEqual(turno.ventas_efectivo, Decimal('150.00'))
+        arqueo = cerrar_turno(turno, Decimal('250.00'))
+        self.assertEqual((arqueo.ventas_efectivo, arqueo.diferencia), (Decimal('150.00'), Decimal('0.00')))
+        response = self.client.post(reverse('devolver-pedido', args=[pedido.id]), {f'devolver_{pedido.items.get().id}': '1'})
+        self.assertEqual(Devolucion.objects.filter(pedido=pedido).count(), 1)
+        self.assertRedirects(response, reverse('detalle-pedido', args=[pedido.id]), fetch_redirect_response=False)
@@ -0,0 +1,63 @@
+# inventario/turnos.py
+
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from .caja import suma_sellada
+from .models import Arqueo, Pedido, Retiro, Turno
+from .reportes import invalidar_reportes
+
+
+class TurnoInvalido(Exception):
+    """No se puede abrir o cerrar el turno pedido."""
+
+
+def abrir_turno(empresa, caja, usuario=None, fondo_inicial=Decimal('0.00')):
+    """Abre un turno en la caja indicada; cada caja tiene a lo más un turno abierto."""
+    try:
+        with transaction.atomic():
+            return Turno.objects.create(empresa=empresa, caja=caja, abierto_por=usuario, fondo_inicial=fondo_inicial)
+    except IntegrityError:
+        raise TurnoInvalido(f"La {caja} ya tiene un turno abierto.") from None
+
+
+def turno_abierto(empresa, turno_id):
+    """El turno si sigue abierto y es de la empresa, o None."""
+    return Turno.objects.filter(id=turno_id, empresa=empresa, cierre__isnull=True).first()
+
+
+def cerrar_turno(turno, monto_contado, usuario=None):
+    """
+    Cierra el turno con su propio arqueo y lo devuelve. Bloquea solo la fila del turno (las
+    otras cajas siguen vendiendo), sella sus pedidos y retiros y calcula el arqueo sobre lo
+    sellado en una consulta. El efectivo esperado incluye el fondo inicial del turno. Una venta
+    que llegue a la mitad encuentra el turno cerrado y se revierte (ver caja.registrar_en_turno).
+    """
+    with transaction.atomic():
+        turno = Turno.objects.select_for_update().get(id=turno.id)
+        if turno.cierre is not None:
+            raise TurnoInvalido("El turno ya fue cerrado.")
+        arqueo = Arqueo.objects.create(empresa=turno.empresa, fecha=timezone.localdate(turno.apertura), cerrado_por=usuario)
+        Pedido.objects.filter(turno=turno, arqueo__isnull=True).update(arqueo=arqueo)
+        Retiro.objects.filter(turno=turno, arqueo__isnull=True).update(arqueo=arqueo)
+        sellado = Arqueo.objects.filter(id=arqueo.id).annotate(
+            efectivo=suma_sellada(Pedido, 'total', estado='Completado', metodo_pago='Efectivo'),
+            tarjeta=suma_sellada(Pedido, 'total', estado='Completado', metodo_pago='Tarjeta'),
+            suma_retiros=suma_sellada(Retiro, 'monto'),
+        ).values('efectivo', 'tarjeta', 'suma_retiros').get()
+
+        arqueo.ventas_efectivo, arqueo.ventas_tarjeta, arqueo.retiros = sellado['efectivo'], sellado['tarjeta'], sellado['suma_retiros']
+        arqueo.efectivo_esperado = turno.fondo_inicial + arqueo.ventas_efectivo - arqueo.retiros
+        arqueo.monto_contado = monto_contado
+        arqueo.diferencia = monto_contado - arqueo.efectivo_esperado
+        arqueo.save()
+
+        turno.cierre = timezone.now()
+        turno.arqueo = arqueo
+        turno.save(update_fields=['cierre', 'arqueo'])
+
+        inicio = timezone.localdate(turno.apertura)
+        dias = [inicio + timedelta(days=i) for i in range((timezone.localdate(turno.cierre) - inicio).days + 1)]
+        invalidar_reportes(turno.empresa, dias)
+    return arqueo
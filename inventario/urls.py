@@ -16,13 +16,19 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
 
     # Punto de Venta (POS)
+    path('catalogo/', views.catalogo_json, name='catalogo-json'),
+    path('catalogo/stock/', views.catalogo_stock_json, name='catalogo-stock'),
     path('carrito/agregar/<int:producto_id>/', views.agregar_al_carrito, name='agregar-al-carrito'),
     path('carrito/eliminar/<int:producto_id>/', views.eliminar_del_carrito, name='eliminar-del-carrito'),
     path('carrito/actualizar/<int:producto_id>/', views.actualizar_cantidad, name='actualizar-cantidad'),
+    path('carrito/operaciones/', views.operaciones_carrito, name='operaciones-carrito'),
+    path('carrito/escanear/', views.escanear_codigo, name='escanear-codigo'),
     path('cliente/seleccionar/<int:cliente_id>/', views.seleccionar_cliente, name='seleccionar-cliente'),
     path('cliente/quitar/', views.quitar_cliente, name='quitar-cliente'),
     path('venta/finalizar/<str:metodo_pago>/', views.finalizar_venta, name='finalizar-venta'),
+    path('venta/lote/', views.ingresar_ventas_lote, name='ingresar-ventas-lote'),
     path('reportes/pedido/<int:pedido_id>/cancelar/', views.cancelar_pedido, name='cancelar-pedido'),
+    path('reportes/pedido/<int:pedido_id>/devolver/', views.devolver_pedido, name='devolver-pedido'),
 
     # Gestión de Inventario
     path('inventario/', views.gestion_inventario, name='gestion-inventario'),
@@ -30,9 +36,11 @@ urlpatterns = [
     path('inventario/eliminar/<int:producto_id>/', views.eliminar_producto, name='eliminar-producto'),
     path('inventario/reactivar/<int:producto_id>/', views.reactivar_producto, name='reactivar-producto'),
     path('inventario/archivados/', views.lista_productos_archivados, name='lista-productos-archivados'),
+    path('inventario/catalogo/estadisticas/', views.estadisticas_catalogo_view, name='estadisticas-catalogo'),
 
     # Reportes y Gráficas
     path('reportes/', views.reporte_ventas, name='reporte-ventas'),
+    path('reportes/exportar/', views.exportar_ventas, name='exportar-ventas'),
     path('reportes/pedido/<int:pedido_id>/', views.detalle_pedido, name='detalle-pedido'),
     path('reportes/pedido/<int:pedido_id>/reimprimir/', views.reimprimir_pedido, name='reimprimir-pedido'),
 
@@ -42,6 +50,9 @@ urlpatterns = [
     path('venta/exitosa/<int:pedido_id>/', views.venta_exitosa, name='venta-exitosa'),
     path('caja/retiro/exitoso/<int:retiro_id>/', views.retiro_exitoso, name='retiro-exitoso'),
     path('caja/cerrar/', views.cerrar_caja, name='cerrar-caja'),
+    path('caja/cerrar/pendientes/', views.cerrar_dias_pendientes, name='cerrar-dias-pendientes'),
+    path('caja/turno/', views.turno_caja, name='turno-caja'),
+    path('caja/turno/cerrar/', views.cerrar_turno_view, name='cerrar-turno'),
     path('caja/cierre/exitoso/<int:arqueo_id>/', views.cierre_caja_exitoso, name='cierre-caja-exitoso'),
     path('reportes/arqueos/', views.reporte_arqueos, name='reporte-arqueos'),
     path('clientes/', views.gestion_clientes, name='gestion-clientes'),
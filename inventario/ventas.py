@@ -0,0 +1,391 @@
+# inventario/ventas.py
+
+import uuid
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, DecimalField
+from django.db.models.functions import Coalesce
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .caja import registrar_en_caja, registrar_devolucion_en_caja, registrar_venta_en_caja
+from .carrito import aplicar_operaciones, cotizar_carrito
+from .models import CajaDia, ContadorTicket, Devolucion, Pedido, PedidoItem, Producto, Turno
+from .resumenes import registrar_devoluciones_en_resumen, registrar_en_resumen
+
+
+class StockInsuficiente(Exception):
+    """La venta no se registró porque uno o más productos no alcanzan la cantidad pedida."""
+
+    def __init__(self, productos):
+        self.productos = productos
+        nombres = ', '.join(f'"{p.nombre}" ({p.stock} disponible)' for p in productos)
+        super().__init__(f"No hay suficiente stock para {nombres}.")
+
+
+class VentaInvalida(Exception):
+    """Los datos de una venta recibida en lote no son válidos."""
+
+
+class VentaNoModificable(Exception):
+    """El pedido ya se canceló o ya se selló en un arqueo: no admite cancelación ni devoluciones."""
+
+
+class DevolucionInvalida(Exception):
+    """Las cantidades a devolver no corresponden a lo que queda de las líneas del pedido."""
+
+
+class _DescuentoIncompleto(Exception):
+    pass
+
+
+def descontar_stock(items):
+    """
+    Descuenta el stock de todas las líneas con un solo UPDATE condicional basado en F().
+    La condición `stock >= cantidad` va en el WHERE, así que dos terminales vendiendo el
+    mismo corte no pueden dejarlo en negativo. Si alguna línea no alcanza, lanza
+    StockInsuficiente con los productos que fallaron.
+    """
+    cantidades = {}
+    for item in items:
+        if item['producto'].requiere_stock:
+            cantidades[item['producto'].id] = cantidades.get(item['producto'].id, 0) + item['cantidad']
+    if not cantidades:
+        return
+
+    condicion = Q()
+    for producto_id, cantidad in cantidades.items():
+        condicion |= Q(id=producto_id, stock__gte=cantidad)
+
+    try:
+        with transaction.atomic():
+            actualizados = Producto.objects.filter(condicion, requiere_stock=True).update(
+                stock=Case(
+                    *[When(id=producto_id, then=F('stock') - cantidad) for producto_id, cantidad in cantidades.items()],
+                    output_field=DecimalField(max_digits=10, decimal_places=3),
+                )
+            )
+            if actualizados != len(cantidades):
+                raise _DescuentoIncompleto()
+    except _DescuentoIncompleto:
+        # El savepoint ya se revirtió, así que aquí se lee el stock previo a la venta
+        # y se averigua exactamente qué productos no alcanzaron.
+        fallidos = [
+            producto for producto in Producto.objects.filter(id__in=cantidades).order_by('nombre')
+            if producto.stock is None or producto.stock < cantidades[producto.id]
+        ]
+        raise StockInsuficiente(fallidos) from None
+
+
+def reponer_stock(cantidades):
+    """
+    Devuelve al inventario {producto_id: cantidad} con un solo UPDATE basado en F(), el
+    espejo de descontar_stock. Los productos que no llevan stock se ignoran.
+    """
+    if not cantidades:
+        return
+    Producto.objects.filter(id__in=cantidades, requiere_stock=True).update(
+        stock=Case(
+            *[When(id=producto_id, then=F('stock') + cantidad) for producto_id, cantidad in cantidades.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=3),
+        )
+    )
+
+
+def _item_de_pedido(pedido, item):
+    """Línea de pedido a partir de una línea cotizada, con el costo y el subtotal de ese momento."""
+    return PedidoItem(
+        pedido=pedido, producto=item['producto'], cantidad=item['cantidad'],
+        precio_unitario=item['precio_unitario'], costo_unitario=item['producto'].costo,
+        subtotal=item['subtotal'].quantize(Decimal('0.01'), ROUND_HALF_UP),
+    )
+
+
+def registrar_venta(empresa, items, total, metodo_pago, cliente=None, monto_recibido=None, cambio_entregado=None, turno=None):
+    """
+    Registra una venta ya cotizada (ver carrito.cotizar_carrito) como un conjunto:
+    un UPDATE condicional para el stock, un INSERT para el pedido, un bulk_create
+    para todas sus líneas y los incrementos del libro de caja y de los resúmenes del día. Todo corre en un
+    savepoint propio, de modo que si el stock no alcanza no queda nada a medias aunque
+    el llamador siga dentro de su transacción. Con `turno`, la venta se suma a ese turno de
+    caja en lugar del libro del día (y lanza TurnoCerrado si el turno ya se cerró).
+    """
+    with transaction.atomic():
+        descontar_stock(items)
+        pedido = Pedido.objects.create(
+            empresa=empresa, total=total, cliente=cliente, metodo_pago=metodo_pago,
+            monto_recibido=monto_recibido, cambio_entregado=cambio_entregado, turno=turno
+        )
+        lineas = PedidoItem.objects.bulk_create([_item_de_pedido(pedido, item) for item in items])
+        registrar_venta_en_caja(pedido)
+        registrar_en_resumen(empresa, [(pedido, lineas)])
+    return pedido
+
+
+def _preparar_venta_en_lote(empresa, datos):
+    """
+    Valida y cotiza una venta recibida en lote con las mismas reglas que finalizar_venta:
+    mismos precios (mayoreo incluido) y mismos requisitos de stock.
+    """
+    if not isinstance(datos, dict):
+        raise VentaInvalida("Formato de venta inválido.")
+    try:
+        venta_uuid = uuid.UUID(str(datos['uuid']))
+    except (KeyError, ValueError):
+        raise VentaInvalida("La venta no trae un UUID válido.")
+
+    try:
+        fecha = parse_datetime(str(datos.get('fecha', '')))
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        raise VentaInvalida("La fecha de la venta no es válida.")
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    if fecha > timezone.now():
+        raise VentaInvalida("La fecha de la venta está en el futuro.")
+
+    metodo_pago = datos.get('metodo_pago')
+    if metodo_pago not in dict(Pedido.METODO_PAGO_CHOICES):
+        raise VentaInvalida("Método de pago inválido.")
+
+    carrito = {}
+    try:
+        aplicar_operaciones(carrito, [
+            {'op': 'agregar', 'producto_id': linea['producto_id'], 'cantidad': linea['cantidad']}
+            for linea in datos.get('lineas') or []
+        ])
+    except (InvalidOperation, ValueError, KeyError, TypeError):
+        raise VentaInvalida("Una de las líneas de la venta no es válida.")
+    if not carrito:
+        raise VentaInvalida("La venta no tiene líneas.")
+    # Se cotiza y se descuenta del stock lo mismo que se guarda en PedidoItem.cantidad (3 decimales).
+    for producto_id, cantidad in carrito.items():
+        cantidad = Decimal(cantidad).quantize(Decimal('0.001'), ROUND_HALF_UP)
+        if cantidad <= 0:
+            raise VentaInvalida("Una de las líneas de la venta tiene una cantidad menor a un gramo.")
+        carrito[producto_id] = str(cantidad)
+
+    try:
+        items, total = cotizar_carrito(empresa, carrito)
+    except Http404:
+        raise VentaInvalida("Uno de los productos de la venta no existe.")
+    for item in items:
+        producto = item['producto']
+        if producto.requiere_stock and producto.stock_indefinido:
+            raise VentaInvalida(f'El producto "{producto.nombre}" requiere stock, pero no tiene un valor definido.')
+
+    monto_recibido = cambio_entregado = None
+    if metodo_pago == 'Efectivo' and datos.get('monto_recibido') not in (None, ''):
+        try:
+            monto_recibido = Decimal(str(datos['monto_recibido']))
+        except InvalidOperation:
+            raise VentaInvalida("El monto recibido no es un número válido.")
+        if not monto_recibido.is_finite():
+            raise VentaInvalida("El monto recibido no es un número válido.")
+        if monto_recibido < total:
+            raise VentaInvalida("El monto recibido es menor que el total de la venta.")
+        cambio_entregado = monto_recibido - total
+
+    return {
+        'uuid': venta_uuid, 'fecha': fecha, 'metodo_pago': metodo_pago, 'items': items, 'total': total,
+        'monto_recibido': monto_recibido, 'cambio_entregado': cambio_entregado,
+    }
+
+
+def _resultado(venta_uuid, estado, pedido=None, mensaje=None):
+    resultado = {'uuid': str(venta_uuid) if venta_uuid is not None else None, 'estado': estado}
+    if pedido is not None:
+        resultado.update({'pedido_id': pedido.id, 'ticket_numero': pedido.ticket_numero, 'total': str(Decimal(pedido.total).quantize(Decimal('0.01'), ROUND_HALF_UP))})
+    if mensaje:
+        resultado['mensaje'] = mensaje
+    return resultado
+
+
+def registrar_ventas_en_lote(empresa, lote):
+    """
+    Registra muchas ventas ya cobradas (p. ej. capturadas sin conexión) en una transacción:
+    un descuento de stock para todo el lote, un bloque de números de ticket, un bulk_create
+    para los pedidos, otro para las líneas y un movimiento del libro de caja por día.
+    Las ventas cuyo UUID ya existe se reportan como 'duplicada' sin volver a registrarse,
+    así que reenviar el mismo lote es seguro. Si el stock no alcanza para todo el lote, las
+    ventas se descuentan una por una en orden y solo las que no alcanzan se rechazan.
+    Devuelve un resultado por venta, en el mismo orden del lote.
+    """
+    resultados = [None] * len(lote)
+    preparadas, vistos = [], set()
+    for posicion, datos in enumerate(lote):
+        try:
+            venta = _preparar_venta_en_lote(empresa, datos)
+        except VentaInvalida as error:
+            venta_uuid = datos.get('uuid') if isinstance(datos, dict) else None
+            resultados[posicion] = _resultado(venta_uuid, 'error', mensaje=str(error))
+            continue
+        if venta['uuid'] in vistos:
+            resultados[posicion] = _resultado(venta['uuid'], 'duplicada', mensaje="La venta viene repetida en el mismo lote.")
+            continue
+        vistos.add(venta['uuid'])
+        preparadas.append((posicion, venta))
+
+    with transaction.atomic():
+        existentes = {pedido.uuid: pedido for pedido in Pedido.objects.filter(empresa=empresa, uuid__in=vistos)}
+        nuevas = []
+        for posicion, venta in preparadas:
+            if venta['uuid'] in existentes:
+                resultados[posicion] = _resultado(venta['uuid'], 'duplicada', existentes[venta['uuid']])
+            else:
+                nuevas.append((posicion, venta))
+
+        try:
+            descontar_stock([item for _, venta in nuevas for item in venta['items']])
+            aceptadas = nuevas
+        except StockInsuficiente:
+            aceptadas = []
+            for posicion, venta in nuevas:
+                try:
+                    descontar_stock(venta['items'])
+                    aceptadas.append((posicion, venta))
+                except StockInsuficiente as error:
+                    resultados[posicion] = _resultado(venta['uuid'], 'error', mensaje=str(error))
+
+        if not aceptadas:
+            return resultados
+
+        primer_ticket = ContadorTicket.reservar(empresa, cantidad=len(aceptadas))
+        pedidos = Pedido.objects.bulk_create([
+            Pedido(
+                empresa=empresa, uuid=venta['uuid'], fecha=venta['fecha'], total=venta['total'],
+                metodo_pago=venta['metodo_pago'], monto_recibido=venta['monto_recibido'],
+                cambio_entregado=venta['cambio_entregado'], ticket_numero=primer_ticket + indice,
+            ) for indice, (_, venta) in enumerate(aceptadas)
+        ])
+        lineas = PedidoItem.objects.bulk_create([
+            _item_de_pedido(pedido, item) for pedido, (_, venta) in zip(pedidos, aceptadas) for item in venta['items']
+        ])
+
+        # Un solo movimiento del libro de caja por día de negocio.
+        por_dia = {}
+        for pedido in pedidos:
+            importes = por_dia.setdefault(timezone.localdate(pedido.fecha), {
+                'ventas_efectivo': Decimal('0.00'), 'ventas_tarjeta': Decimal('0.00'), 'movimientos_pendientes': 0,
+            })
+            importes['ventas_efectivo' if pedido.metodo_pago == 'Efectivo' else 'ventas_tarjeta'] += pedido.total
+            importes['movimientos_pendientes'] += 1
+        for dia, importes in por_dia.items():
+            registrar_en_caja(empresa, dia, **importes)
+        lineas_por_pedido = {}
+        for linea in lineas:
+            lineas_por_pedido.setdefault(linea.pedido_id, []).append(linea)
+        registrar_en_resumen(empresa, [(pedido, lineas_por_pedido.get(pedido.id, [])) for pedido in pedidos])
+
+    for pedido, (posicion, venta) in zip(pedidos, aceptadas):
+        resultados[posicion] = _resultado(venta['uuid'], 'registrada', pedido)
+    return resultados
+
+
+def _bloquear_pedido(pedido):
+    """
+    Bloquea la caja del pedido (su turno o la fila del libro de su día) y después el pedido: el
+    mismo orden que cerrar_dias y turnos.cerrar_turno, que bloquean la caja y luego sellan sus
+    pedidos. Relee el pedido y confirma que todavía se puede modificar.
+    """
+    if pedido.turno_id:
+        list(Turno.objects.select_for_update().filter(id=pedido.turno_id).values_list('id', flat=True))
+    else:
+        list(CajaDia.objects.select_for_update().filter(
+            empresa_id=pedido.empresa_id, fecha=timezone.localdate(pedido.fecha),
+        ).values_list('id', flat=True))
+    actual = Pedido.objects.select_for_update().select_related('empresa').get(id=pedido.id)
+    if actual.estado == 'Cancelado':
+        raise VentaNoModificable(f"El pedido #{actual.ticket_numero} ya se encuentra cancelado.")
+    if actual.arqueo_id is not None:
+        raise VentaNoModificable(f"El pedido #{actual.ticket_numero} pertenece a una caja que ya fue cerrada.")
+    return actual
+
+
+def lineas_con_devuelto(pedido):
+    """Líneas del pedido con su producto y `devuelto`, la cantidad ya devuelta de cada una."""
+    return list(pedido.items.select_related('producto').annotate(
+        devuelto=Coalesce(Sum('devoluciones__cantidad'), Decimal('0.000'), output_field=DecimalField(max_digits=10, decimal_places=3)),
+    ).order_by('id'))
+
+
+def _proporcion(valor, parte, todo):
+    return (valor * parte / todo).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+
+def cancelar_venta(pedido, usuario=None):
+    """
+    Cancela un pedido todavía sin arqueo: repone en un solo UPDATE el stock que no se haya
+    devuelto ya, y descuenta del libro de caja (o del turno) y de los resúmenes lo que quedaba
+    de la venta. Lanza VentaNoModificable si otro usuario lo canceló o lo selló primero.
+    """
+    with transaction.atomic():
+        pedido = _bloquear_pedido(pedido)
+        # Lo que queda de cada línea después de las devoluciones parciales (sin guardar).
+        lineas = []
+        for linea in lineas_con_devuelto(pedido):
+            restante = linea.cantidad - linea.devuelto
+            if restante:
+                linea.subtotal = _proporcion(linea.subtotal, restante, linea.cantidad)
+                linea.cantidad = restante
+                lineas.append(linea)
+        cantidades = {}
+        for linea in lineas:
+            if linea.producto.requiere_stock:
+                cantidades[linea.producto_id] = cantidades.get(linea.producto_id, 0) + linea.cantidad
+        reponer_stock(cantidades)
+
+        pedido.estado = 'Cancelado'
+        pedido.cancelado_por = usuario
+        pedido.fecha_cancelacion = timezone.now()
+        pedido.save(update_fields=['estado', 'cancelado_por', 'fecha_cancelacion'])
+        registrar_venta_en_caja(pedido, signo=-1)
+        registrar_en_resumen(pedido.empresa, [(pedido, lineas)], signo=-1)
+    return pedido
+
+
+def devolver_lineas(pedido, cantidades, usuario=None):
+    """
+    Devuelve parte de un pedido sin arqueo. `cantidades` es {item_id: cantidad} (kilos o piezas
+    de cada línea). Guarda una Devolucion por línea, repone el stock en un solo UPDATE y resta
+    el importe del pedido, del libro de caja (o del turno) y de los resúmenes del día.
+
+    El importe y el costo de cada devolución se calculan como la diferencia entre lo que
+    quedaba de la línea antes y después de devolver, así que varias devoluciones de una misma
+    línea nunca suman más que su subtotal y su costo, y al devolverla completa cuadran al centavo.
+    """
+    with transaction.atomic():
+        pedido = _bloquear_pedido(pedido)
+        lineas = {linea.id: linea for linea in lineas_con_devuelto(pedido)}
+        devoluciones = []
+        for item_id, cantidad in cantidades.items():
+            linea = lineas.get(item_id)
+            if linea is None:
+                raise DevolucionInvalida("Una de las líneas no pertenece a este pedido.")
+            cantidad = cantidad.quantize(Decimal('0.001'), ROUND_HALF_UP)
+            antes = linea.cantidad - linea.devuelto
+            despues = antes - cantidad
+            if cantidad <= 0 or despues < 0:
+                raise DevolucionInvalida(f'De "{linea.producto.nombre}" solo quedan {antes} por devolver.')
+            devoluciones.append(Devolucion(
+                pedido=pedido, item=linea, cantidad=cantidad, usuario=usuario,
+                importe=_proporcion(linea.subtotal, antes, linea.cantidad) - _proporcion(linea.subtotal, despues, linea.cantidad),
+                costo=_proporcion(linea.costo_unitario, antes, 1) - _proporcion(linea.costo_unitario, despues, 1),
+            ))
+        if not devoluciones:
+            raise DevolucionInvalida("Indica la cantidad a devolver de al menos una línea.")
+
+        Devolucion.objects.bulk_create(devoluciones)
+        importe = sum(devolucion.importe for devolucion in devoluciones)
+        Pedido.objects.filter(id=pedido.id).update(total=F('total') - importe)
+        pedido.total -= importe
+        cantidades_stock = {}
+        for devolucion in devoluciones:
+            if devolucion.item.producto.requiere_stock:
+                producto_id = devolucion.item.producto_id
+                cantidades_stock[producto_id] = cantidades_stock.get(producto_id, 0) + devolucion.cantidad
+        reponer_stock(cantidades_stock)
+        registrar_devolucion_en_caja(pedido, importe)
+        registrar_devoluciones_en_resumen(pedido.empresa, pedido, devoluciones)
+    return devoluciones
@@ -1,21 +1,36 @@
 # inventario/views.py
 
 import json
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 import requests, locale
 from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum, Count, F, DecimalField, ExpressionWrapper
-from .models import Producto, Pedido, PedidoItem, Cliente, Retiro, Empresa, UserProfile, Arqueo
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q, ExpressionWrapper
+from .models import Producto, Pedido, Cliente, Retiro, Empresa, UserProfile, Arqueo, PronosticoProducto, Turno
 from decimal import Decimal, InvalidOperation
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.utils import timezone
-from datetime import datetime, timedelta
-from .forms import RetiroForm, ProductoForm, ClienteForm, ClienteDomicilioForm, UserRegistrationForm, EmpresaOnboardingForm
-from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from datetime import datetime, timedelta, timezone as dt_timezone
+from .carrito import cotizar_carrito, aplicar_operaciones
+from .etiquetas import interpretar_codigo, variantes_plu, CodigoInvalido
+from .ventas import registrar_venta, registrar_ventas_en_lote, cancelar_venta, devolver_lineas, lineas_con_devuelto, StockInsuficiente, VentaNoModificable, DevolucionInvalida
+from .catalogo import obtener_catalogo, estadisticas_catalogo, stock_actual
+from .histograma import ventas_por_dia, ventas_por_hora
+from .analitica import analitica_del_dia
+from .rangos import filtro_de_dias
+from .reportes import arqueos_del_periodo, resumen_de_arqueos, sumar_totales, totales_por_dia
+from .exportar import csv_en_flujo, gzip_en_flujo, filas_lineas, filas_pedidos
+from .caja import caja_del_dia, cerrar_dias, dia_pendiente_mas_antiguo, dias_pendientes, registrar_retiro_en_caja, TurnoCerrado
+from .turnos import abrir_turno, cerrar_turno, turno_abierto, TurnoInvalido
+from .forms import RetiroForm, TurnoForm, ProductoForm, ClienteForm, ClienteDomicilioForm, UserRegistrationForm, EmpresaOnboardingForm
 from .models import Arqueo
 
 # --- CORRECCIÓN: URL CENTRALIZADA ---
@@ -83,7 +98,7 @@ def inicio_view(request):
         except (locale.Error, TypeError):
             pass
 
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     hoy = timezone.localtime(timezone.now())
 
     # --- Lógica de Reporte Tabular (Ya existente en inicio_view) ---
@@ -91,7 +106,6 @@ def inicio_view(request):
     time_range = request.GET.get('time_range', '7dias')
 
     if group_by == 'mes':
-        trunc_func = TruncMonth('fecha')
         if time_range == '6meses':
             fecha_inicio = hoy - timedelta(days=180)
             titulo_reporte = "Resumen de los Últimos 6 Meses"
@@ -104,9 +118,8 @@ def inicio_view(request):
             titulo_reporte = "Resumen de los Últimos 3 Meses"
     else:
         group_by = 'dia'
-        trunc_func = TruncDay('fecha')
         if time_range == 'hoy':
-            fecha_inicio = hoy.replace(hour=0, minute=0, second=0, microsecond=0)
+            fecha_inicio = hoy
             titulo_reporte = "Resumen del Día de Hoy"
         elif time_range == 'mes':
             fecha_inicio = hoy - timedelta(days=29)
@@ -116,28 +129,28 @@ def inicio_view(request):
             fecha_inicio = hoy - timedelta(days=6)
             titulo_reporte = "Resumen de los Últimos 7 Días"
 
-    pedidos_agrupados = Pedido.objects.filter(
-        empresa=empresa_del_usuario,
-        fecha__gte=fecha_inicio
-    ).annotate(
-        periodo_agg=trunc_func
-    ).values('periodo_agg').annotate(
-        ventas_count=Count('id'),
-        ventas_totales=Sum('total'),
-        costo_total=Sum(F('items__cantidad') * F('items__producto__costo'), output_field=DecimalField())
-    ).order_by('-periodo_agg')
+    # Totales por día del cache de reportes: los días sellados no se vuelven a calcular.
+    por_dia = totales_por_dia(empresa_del_usuario, fecha_inicio.date(), hoy.date())
+    periodos = {}
+    for fecha, dia in sorted(por_dia.items(), reverse=True):
+        if not dia['num_completados'] and not dia['num_cancelados']:
+            continue
+        periodo = fecha.replace(day=1) if group_by == 'mes' else fecha
+        periodos.setdefault(periodo, []).append(dia)
 
     reporte_agrupado = []
-    for item in pedidos_agrupados:
-        reembolsos = Decimal('0.00')
-        ventas_netas = item['ventas_totales'] - reembolsos
-        costo_valido = item['costo_total'] or Decimal('0.00')
+    for periodo, dias in periodos.items():
+        suma = sumar_totales(dias)
+        reembolsos = suma['total_cancelado']
+        ventas_totales = suma['total_vendido'] + reembolsos
+        ventas_netas = ventas_totales - reembolsos
+        costo_valido = suma['costo']
         margen = ventas_netas - costo_valido
         
         reporte_agrupado.append({
-            'fecha': item['periodo_agg'],
-            'ventas': item['ventas_count'],
-            'ventas_totales': item['ventas_totales'],
+            'fecha': periodo,
+            'ventas': suma['num_completados'] + suma['num_cancelados'],
+            'ventas_totales': ventas_totales,
             'reembolsos': reembolsos,
             'ventas_netas': ventas_netas,
             'costo': costo_valido,
@@ -171,21 +184,16 @@ def inicio_view(request):
 
     etiquetas, datos = [], []
     if dias_a_mostrar > 1:
-        ventas_agrupadas = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date__range=[fecha_inicio_grafica, hoy]).values('fecha__date').annotate(total=Sum('total')).order_by('fecha__date')
-        ventas_dict = {item['fecha__date'].strftime('%d/%m'): item['total'] for item in ventas_agrupadas}
-        for i in range(dias_a_mostrar):
-            fecha = fecha_inicio_grafica + timedelta(days=i)
-            fecha_str = fecha.strftime('%d/%m')
-            etiquetas.append(fecha_str)
-            datos.append(float(ventas_dict.get(fecha_str, 0)))
+        ventas_dict = ventas_por_dia(empresa_del_usuario, fecha_inicio_grafica.date(), hoy.date())
+        for fecha, total in sorted(ventas_dict.items()):
+            etiquetas.append(fecha.strftime('%d/%m'))
+            datos.append(float(total))
         tipo_grafica = 'bar'
     else:
-        ventas_agrupadas = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy).annotate(hora=TruncHour('fecha')).values('hora').annotate(total=Sum('total')).order_by('hora')
-        ventas_dict = {item['hora'].strftime('%H:00'): item['total'] for item in ventas_agrupadas}
+        ventas_dict = ventas_por_hora(empresa_del_usuario)
         for i in range(24):
-            hora_str = f"{i:02d}:00"
-            etiquetas.append(hora_str)
-            datos.append(float(ventas_dict.get(hora_str, 0)))
+            etiquetas.append(f"{i:02d}:00")
+            datos.append(float(ventas_dict.get(i, 0)))
         tipo_grafica = 'line'
     
     # --- Combinar los contextos en uno solo ---
@@ -213,46 +221,24 @@ def inicio_view(request):
 
 @login_required
 def lista_productos(request, tipo_venta):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     
-    # --- LÓGICA DE BLOQUEO CON CORRECCIÓN DE ZONA HORARIA ---
-    
-    # 1. Obtenemos el momento exacto de la medianoche de hoy en la zona horaria local
-    hoy_medianoche_local = timezone.localtime(timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
-
-    # 2. Buscamos el pedido pendiente más antiguo (cuya fecha sea anterior a la medianoche de hoy)
-    pedido_pendiente = Pedido.objects.filter(
-        empresa=empresa_del_usuario,
-        fecha__lt=hoy_medianoche_local,  # Usamos __lt (menor que) con el DateTime completo
-        arqueo__isnull=True
-    ).order_by('fecha').first()
-
-    # 3. Buscamos el retiro pendiente más antiguo
-    retiro_pendiente = Retiro.objects.filter(
-        empresa=empresa_del_usuario,
-        fecha__lt=hoy_medianoche_local,
-        arqueo__isnull=True
-    ).order_by('fecha').first()
-
-    # 4. Determinamos la fecha pendiente más antigua de las dos
-    dia_pendiente = None
-    if pedido_pendiente and retiro_pendiente:
-        # Convertimos la fecha a local antes de compararla
-        dia_pendiente = min(timezone.localtime(pedido_pendiente.fecha).date(), timezone.localtime(retiro_pendiente.fecha).date())
-    elif pedido_pendiente:
-        dia_pendiente = timezone.localtime(pedido_pendiente.fecha).date()
-    elif retiro_pendiente:
-        dia_pendiente = timezone.localtime(retiro_pendiente.fecha).date()
-
-    # 5. Si encontramos cualquier día pendiente, bloqueamos el acceso
+    # --- LÓGICA DE BLOQUEO ---
+    # La empresa ya cargada trae el día pendiente más antiguo (Empresa.pendiente_desde): no hay consulta extra.
+    hoy_fecha = timezone.localdate()
+    dia_pendiente = dia_pendiente_mas_antiguo(empresa_del_usuario, hoy_fecha)
+
+    # Si encontramos cualquier día pendiente, bloqueamos el acceso
     if dia_pendiente:
-        contexto = {'dia_pendiente': dia_pendiente}
+        contexto = {
+            'dia_pendiente': dia_pendiente, 'dias_pendientes': len(dias_pendientes(empresa_del_usuario, hoy_fecha)),
+            'puede_cerrar_sin_conteo': _es_dueno_o_staff(request),
+        }
         return render(request, 'inventario/arqueo_pendiente.html', contexto)
 
     # --- FIN DE LA LÓGICA DE BLOQUEO ---
 
     # Si no hay bloqueo, la función continúa normalmente...
-    hoy_fecha = timezone.localdate()
     request.session['tipo_venta'] = tipo_venta
     cliente_seleccionado = None
     if 'cliente_id' in request.session:
@@ -267,48 +253,78 @@ def lista_productos(request, tipo_venta):
         empresa=empresa_del_usuario
     ).order_by('nombre') if busqueda_cliente else None
     
-    productos = Producto.objects.filter(empresa=empresa_del_usuario, is_active=True).order_by('nombre')
+    # La cuadrícula de productos se dibuja en el navegador a partir de catalogo_json.
     items_del_carrito, total_carrito = _obtener_datos_carrito(request)
 
-    total_efectivo = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy_fecha, metodo_pago='Efectivo', arqueo__isnull=True, estado='Completado').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-    total_tarjeta = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy_fecha, metodo_pago='Tarjeta', arqueo__isnull=True, estado='Completado').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-    total_retiros = Retiro.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy_fecha, arqueo__isnull=True).aggregate(Sum('monto'))['monto__sum'] or Decimal('0.00')
+    # Con un turno abierto en esta caja, el encabezado muestra los totales del turno.
+    caja = _turno_de_sesion(request) or caja_del_dia(empresa_del_usuario, hoy_fecha)
+    total_efectivo, total_tarjeta, total_retiros = caja.ventas_efectivo, caja.ventas_tarjeta, caja.retiros
     
     contexto = {
-        'productos': productos, 'busqueda_cliente': busqueda_cliente, 'clientes_encontrados': clientes_encontrados, 'cliente_seleccionado': cliente_seleccionado,
+        'busqueda_cliente': busqueda_cliente, 'clientes_encontrados': clientes_encontrados, 'cliente_seleccionado': cliente_seleccionado,
         'tipo_venta': tipo_venta, 'items_del_carrito': items_del_carrito, 'total_carrito': total_carrito,
+        'carrito_estado': {
+            'rev': request.session.get('carrito_rev', 0),
+            'total': float(total_carrito),
+            'items': [_linea_carrito_json(item) for item in items_del_carrito],
+        },
         'total_efectivo': total_efectivo, 'total_tarjeta': total_tarjeta, 'total_retiros': total_retiros,
         'efectivo_esperado': total_efectivo - total_retiros, 'total_ventas_dia': total_efectivo + total_tarjeta,
     }
     return render(request, 'inventario/lista_productos.html', contexto)
 
+def _etag_catalogo(request):
+    empresa_del_usuario = request.empresa
+    return f"catalogo-{empresa_del_usuario.id}-v{empresa_del_usuario.version_catalogo}"
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_catalogo)
+def catalogo_json(request):
+    """
+    Catálogo compacto para la cuadrícula del POS. El ETag sale de la versión del catálogo,
+    así que mientras no cambie ningún producto el navegador recibe un 304 sin cuerpo.
+    """
+    empresa_del_usuario = request.empresa
+    decimal_o_nulo = lambda valor: str(valor) if valor is not None else None
+    return JsonResponse({
+        'version': empresa_del_usuario.version_catalogo,
+        'productos': [
+            {
+                'id': producto.id,
+                'nombre': producto.nombre,
+                'precio': str(producto.precio),
+                'precio_mayoreo': decimal_o_nulo(producto.precio_mayoreo),
+                'mayoreo_desde_kg': decimal_o_nulo(producto.mayoreo_desde_kg),
+                'unidad_medida': producto.unidad_medida,
+            } for producto in obtener_catalogo(empresa_del_usuario)
+        ],
+    })
+
+@login_required
+@cache_control(private=True, no_cache=True)
+def catalogo_stock_json(request):
+    """
+    Stock actual de los productos activos. Va aparte del catálogo porque cambia con cada venta
+    y el catálogo (con su ETag) solo cambia cuando se edita un producto.
+    """
+    return JsonResponse({
+        'stock': {producto_id: str(stock) if stock is not None else None for producto_id, stock in stock_actual(request.empresa).items()},
+    })
+
 @login_required
 def agregar_al_carrito(request, producto_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     producto = get_object_or_404(Producto, id=producto_id, empresa=empresa_del_usuario)
     carrito = request.session.get('carrito', {})
     cantidad_actual = Decimal(carrito.get(str(producto_id), '0'))
     nueva_cantidad = cantidad_actual + Decimal('1')
     carrito[str(producto_id)] = str(nueva_cantidad)
-    request.session['carrito'] = carrito
-    request.session.modified = True
+    _guardar_carrito(request, carrito)
 
     # Responde con JSON si la petición es AJAX (hecha con JavaScript)
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        items_del_carrito, total_carrito = _obtener_datos_carrito(request)
-        return JsonResponse({
-            'success': True,
-            'items': [
-                {
-                    'id': item['producto'].id,
-                    'nombre': item['producto'].nombre,
-                    'cantidad': float(item['cantidad']),
-                    'subtotal': float(item['subtotal']),
-                    'unidad_medida': item['producto'].unidad_medida,
-                } for item in items_del_carrito
-            ],
-            'total': float(total_carrito)
-        })
+        return _respuesta_carrito_json(request)
     
     # Redirige si es una petición normal (aunque con la interfaz actual, casi nunca se usará)
     tipo_venta = request.session.get('tipo_venta', 'mostrador')
@@ -324,52 +340,141 @@ def agregar_al_carrito(request, producto_id):
 # === NUEVA FUNCIÓN AUXILIAR ===
 def _obtener_datos_carrito(request):
     """Función auxiliar para procesar los datos del carrito."""
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     carrito = request.session.get('carrito', {})
-    items_del_carrito = []
-    total_carrito = Decimal('0.00')
+    return cotizar_carrito(empresa_del_usuario, carrito)
 
-    for producto_id, cantidad in carrito.items():
-        producto = get_object_or_404(Producto, id=int(producto_id), empresa=empresa_del_usuario)
-        
-        precio_unitario = producto.precio
-        if producto.precio_mayoreo and producto.mayoreo_desde_kg and Decimal(str(cantidad)) >= producto.mayoreo_desde_kg:
-            precio_unitario = producto.precio_mayoreo
-
-        subtotal = precio_unitario * Decimal(str(cantidad))
-        total_carrito += subtotal
-        items_del_carrito.append({
-            'producto': producto,
-            'cantidad': cantidad,
-            'subtotal': subtotal
-        })
-    return items_del_carrito, total_carrito
+def _guardar_carrito(request, carrito):
+    """Guarda el carrito en la sesión y avanza su número de revisión."""
+    request.session['carrito'] = carrito
+    request.session['carrito_rev'] = request.session.get('carrito_rev', 0) + 1
+    # Forzamos el guardado de la sesión para evitar el error del total en cero
+    request.session.modified = True
+    return request.session['carrito_rev']
+
+def _linea_carrito_json(item):
+    return {
+        'id': item['producto'].id,
+        'nombre': item['producto'].nombre,
+        'cantidad': float(item['cantidad']),
+        'subtotal': float(item['subtotal']),
+        'unidad_medida': item['producto'].unidad_medida,
+    }
+
+def _respuesta_carrito_json(request):
+    """Respuesta JSON con el carrito completo, usada por los endpoints AJAX del POS."""
+    try:
+        items_del_carrito, total_carrito = _obtener_datos_carrito(request)
+    except Http404 as error:
+        return JsonResponse({'success': False, 'message': str(error)}, status=404)
+    return JsonResponse({
+        'success': True,
+        'items': [_linea_carrito_json(item) for item in items_del_carrito],
+        'total': float(total_carrito),
+        'rev': request.session.get('carrito_rev', 0),
+    })
+
+@login_required
+def operaciones_carrito(request):
+    """
+    Protocolo por deltas del carrito. Recibe {"rev": n, "ops": [...]} y responde solo
+    con las líneas modificadas, el nuevo total y la nueva revisión. Si la revisión del
+    cliente no coincide con la del servidor, se devuelve el carrito completo para resincronizar.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+    carrito = dict(request.session.get('carrito', {}))
+    try:
+        data = json.loads(request.body)
+        tocados = aplicar_operaciones(carrito, data.get('ops', []))
+    except (InvalidOperation, json.JSONDecodeError, ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Operación de carrito inválida.'}, status=400)
+
+    return _respuesta_operaciones(request, carrito, tocados, data.get('rev'))
+
+
+def _respuesta_operaciones(request, carrito, tocados, rev_cliente):
+    """Guarda el carrito ya modificado y arma la respuesta por deltas (o completa si la revisión no coincide)."""
+    # Se cotiza antes de guardar: si algún producto no existe, el carrito de la sesión no se toca.
+    try:
+        items_del_carrito, total_carrito = cotizar_carrito(request.empresa, carrito)
+    except Http404 as error:
+        return JsonResponse({'success': False, 'message': str(error)}, status=404)
+    rev_anterior = request.session.get('carrito_rev', 0)
+    rev = _guardar_carrito(request, carrito)
+
+    respuesta = {'success': True, 'rev': rev, 'total': float(total_carrito)}
+    if rev_cliente != rev_anterior:
+        respuesta['completo'] = True
+        respuesta['items'] = [_linea_carrito_json(item) for item in items_del_carrito]
+    else:
+        items_por_id = {str(item['producto'].id): item for item in items_del_carrito}
+        respuesta['lineas'] = [
+            _linea_carrito_json(items_por_id[producto_id]) if producto_id in items_por_id
+            else {'id': int(producto_id), 'eliminado': True}
+            for producto_id in tocados
+        ]
+    return JsonResponse(respuesta)
+
+@login_required
+def escanear_codigo(request):
+    """
+    Agrega al carrito el producto de un código escaneado. Acepta {"codigo": "...", "rev": n}.
+    Las etiquetas de báscula (EAN-13 con prefijo 20-29) traen el PLU y el peso o importe;
+    cualquier otro código se busca tal cual y agrega una pieza. El producto se resuelve con
+    una sola consulta sobre el índice (empresa, codigo) y la respuesta es la misma que la
+    de operaciones_carrito.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        codigo = str(data['codigo']).strip()
+        plu, tipo_valor, valor = interpretar_codigo(codigo)
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Solicitud inválida.'}, status=400)
+    except CodigoInvalido as error:
+        return JsonResponse({'success': False, 'message': str(error)}, status=400)
+
+    # Un EAN-13 completo dado de alta como código de empaque tiene prioridad sobre la lectura como etiqueta.
+    candidatos = {
+        producto.codigo: producto for producto in Producto.objects.filter(
+            empresa=request.empresa, is_active=True, codigo__in={codigo, *variantes_plu(plu)}
+        )
+    }
+    if codigo in candidatos:
+        producto, tipo_valor = candidatos[codigo], None
+    else:
+        producto = next((candidatos[v] for v in variantes_plu(plu) if v in candidatos), None)
+    if producto is None:
+        return JsonResponse({'success': False, 'message': f'No hay ningún producto con el código {plu}.'}, status=404)
+
+    if tipo_valor == 'peso':
+        cantidad = valor
+    elif tipo_valor == 'importe':
+        if producto.precio <= 0:
+            return JsonResponse({'success': False, 'message': f'"{producto.nombre}" no tiene precio para calcular el peso.'}, status=400)
+        cantidad = (valor / producto.precio).quantize(Decimal('0.001'))
+    else:
+        cantidad = Decimal('1')
+
+    carrito = dict(request.session.get('carrito', {}))
+    tocados = aplicar_operaciones(carrito, [{'op': 'agregar', 'producto_id': producto.id, 'cantidad': str(cantidad)}])
+    return _respuesta_operaciones(request, carrito, tocados, data.get('rev'))
 
 @login_required
 def eliminar_del_carrito(request, producto_id):
     carrito = request.session.get('carrito', {})
     if str(producto_id) in carrito:
         del carrito[str(producto_id)]
-    request.session['carrito'] = carrito
-    request.session.modified = True
+    _guardar_carrito(request, carrito)
 
     # === CAMBIO CLAVE ===
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         # Si la solicitud es AJAX, devuelve una respuesta JSON
-        items_del_carrito, total_carrito = _obtener_datos_carrito(request)
-        return JsonResponse({
-            'success': True,
-            'items': [
-                {
-                    'id': item['producto'].id,
-                    'nombre': item['producto'].nombre,
-                    'cantidad': float(item['cantidad']),
-                    'subtotal': float(item['subtotal']),
-                    'unidad_medida': item['producto'].unidad_medida
-                } for item in items_del_carrito
-            ],
-            'total': float(total_carrito)
-        })
+        return _respuesta_carrito_json(request)
     # ====================
     
     tipo_venta = request.session.get('tipo_venta', 'mostrador')
@@ -405,24 +510,9 @@ def actualizar_cantidad(request, producto_id):
         except (InvalidOperation, json.JSONDecodeError):
             return JsonResponse({'success': False, 'message': 'Cantidad inválida.'}, status=400)
 
-        request.session['carrito'] = carrito
-        # Forzamos el guardado de la sesión para evitar el error del total en cero
-        request.session.modified = True
+        _guardar_carrito(request, carrito)
         
-        items_del_carrito, total_carrito = _obtener_datos_carrito(request)
-        return JsonResponse({
-            'success': True,
-            'items': [
-                {
-                    'id': item['producto'].id,
-                    'nombre': item['producto'].nombre,
-                    'cantidad': float(item['cantidad']),
-                    'subtotal': float(item['subtotal']),
-                    'unidad_medida': item['producto'].unidad_medida
-                } for item in items_del_carrito
-            ],
-            'total': float(total_carrito)
-        })
+        return _respuesta_carrito_json(request)
 
     # Comportamiento para peticiones no-AJAX (fallback)
     else:
@@ -437,16 +527,14 @@ def actualizar_cantidad(request, producto_id):
             except ValueError:
                 pass
         
-        request.session['carrito'] = carrito
-        # Forzamos el guardado de la sesión aquí también
-        request.session.modified = True
+        _guardar_carrito(request, carrito)
 
         tipo_venta = request.session.get('tipo_venta', 'mostrador')
         return redirect('pos', tipo_venta=tipo_venta)
 
 @login_required
 def seleccionar_cliente(request, cliente_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     cliente = get_object_or_404(Cliente, id=cliente_id, empresa=empresa_del_usuario)
     request.session['cliente_id'] = cliente.id
     tipo_venta = request.session.get('tipo_venta', 'mostrador')
@@ -459,10 +547,42 @@ def quitar_cliente(request):
     tipo_venta = request.session.get('tipo_venta', 'mostrador')
     return redirect('pos', tipo_venta=tipo_venta)
 
+
+# Máximo de ventas aceptadas por solicitud en la captura por lote.
+MAXIMO_VENTAS_POR_LOTE = 500
+
+
+@login_required
+def ingresar_ventas_lote(request):
+    """
+    Recibe {"ventas": [{"uuid", "fecha", "metodo_pago", "lineas": [{"producto_id", "cantidad"}], "monto_recibido"?}]}
+    con ventas ya cobradas y las registra en una sola transacción. El UUID lo genera la
+    terminal, así que reenviar un lote tras un corte de red no duplica ventas.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+    try:
+        ventas = json.loads(request.body)['ventas']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Formato de lote inválido.'}, status=400)
+    if not isinstance(ventas, list) or not ventas:
+        return JsonResponse({'success': False, 'message': 'El lote no contiene ventas.'}, status=400)
+    if len(ventas) > MAXIMO_VENTAS_POR_LOTE:
+        return JsonResponse({'success': False, 'message': f'El lote admite como máximo {MAXIMO_VENTAS_POR_LOTE} ventas.'}, status=400)
+
+    try:
+        resultados = registrar_ventas_en_lote(request.empresa, ventas)
+    except IntegrityError:
+        # Otra terminal registró alguno de los mismos UUID al mismo tiempo; al reintentar se reportarán como duplicados.
+        return JsonResponse({'success': False, 'message': 'El lote chocó con otro envío simultáneo. Vuelve a enviarlo.'}, status=409)
+    return JsonResponse({'success': True, 'resultados': resultados})
+
+
 @login_required
 @transaction.atomic
 def finalizar_venta(request, metodo_pago):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     carrito = request.session.get('carrito', {})
     tipo_venta = request.session.get('tipo_venta', 'mostrador')
 
@@ -470,43 +590,22 @@ def finalizar_venta(request, metodo_pago):
         messages.warning(request, 'El carrito está vacío.')
         return redirect('pos', tipo_venta=tipo_venta)
 
-    total_final = Decimal('0.00')
-    items_para_procesar = []
-    for producto_id, cantidad in carrito.items():
-        producto = get_object_or_404(Producto, id=int(producto_id), empresa=empresa_del_usuario)
-        cantidad_decimal = Decimal(str(cantidad))
-        
-        precio_unitario_final = producto.precio
-        if producto.precio_mayoreo and producto.mayoreo_desde_kg and cantidad_decimal >= producto.mayoreo_desde_kg:
-            precio_unitario_final = producto.precio_mayoreo
-
-        items_para_procesar.append({
-            'producto': producto, 
-            'cantidad': cantidad_decimal, 
-            'precio_unitario': precio_unitario_final
-        })
-        total_final += precio_unitario_final * cantidad_decimal
+    items_para_procesar, total_final = cotizar_carrito(empresa_del_usuario, carrito)
 
     for item in items_para_procesar:
         producto = item['producto']
-        cantidad = item['cantidad']
-        if producto.requiere_stock:
-            if producto.stock is None:
-                messages.error(request, f'El producto "{producto.nombre}" requiere stock, pero no tiene un valor definido. Venta cancelada.')
-                return redirect('pos', tipo_venta=tipo_venta)
-            if producto.stock < cantidad:
-                messages.error(request, f'No hay suficiente stock para "{producto.nombre}" ({producto.stock} disponible). Venta cancelada.')
-                return redirect('pos', tipo_venta=tipo_venta)
+        if producto.requiere_stock and producto.stock_indefinido:
+            messages.error(request, f'El producto "{producto.nombre}" requiere stock, pero no tiene un valor definido. Venta cancelada.')
+            return redirect('pos', tipo_venta=tipo_venta)
 
     cliente = None
     if 'cliente_id' in request.session:
         cliente = get_object_or_404(Cliente, id=request.session['cliente_id'], empresa=empresa_del_usuario)
     
-    pedido = None
+    monto_recibido = None
+    cambio = None
 
-    if metodo_pago == 'Tarjeta':
-        pedido = Pedido.objects.create(empresa=empresa_del_usuario, total=total_final, cliente=cliente, metodo_pago='Tarjeta')
-    elif metodo_pago == 'Efectivo':
+    if metodo_pago == 'Efectivo':
         if request.method != 'POST':
             messages.error(request, 'Acción no permitida para pagos en efectivo.')
             return redirect('pos', tipo_venta=tipo_venta)
@@ -527,21 +626,30 @@ def finalizar_venta(request, metodo_pago):
             return redirect('pos', tipo_venta=tipo_venta)
         
         cambio = monto_recibido - total_final
-        pedido = Pedido.objects.create(
-            empresa=empresa_del_usuario, total=total_final, cliente=cliente, 
-            metodo_pago='Efectivo', monto_recibido=monto_recibido, cambio_entregado=cambio
-        )
 
-    if pedido:
-        for item in items_para_procesar:
-            PedidoItem.objects.create(
-                pedido=pedido, producto=item['producto'], 
-                cantidad=item['cantidad'], precio_unitario=item['precio_unitario']
+    turno = None
+    if 'turno_id' in request.session:
+        turno = _turno_de_sesion(request)
+        if turno is None:
+            return redirect('turno-caja')
+
+    pedido = None
+    if metodo_pago in ('Tarjeta', 'Efectivo'):
+        # El stock se valida y descuenta en un solo UPDATE condicional dentro de registrar_venta.
+        try:
+            pedido = registrar_venta(
+                empresa_del_usuario, items_para_procesar, total_final, metodo_pago,
+                cliente=cliente, monto_recibido=monto_recibido, cambio_entregado=cambio, turno=turno
             )
-            if item['producto'].requiere_stock:
-                item['producto'].stock -= item['cantidad']
-                item['producto'].save()
+        except StockInsuficiente as error:
+            messages.error(request, f'{error} Venta cancelada.')
+            return redirect('pos', tipo_venta=tipo_venta)
+        except TurnoCerrado:
+            request.session.pop('turno_id', None)
+            messages.error(request, 'El turno de esta caja se cerró antes de registrar la venta. Abre un turno nuevo. Venta cancelada.')
+            return redirect('turno-caja')
 
+    if pedido:
         del request.session['carrito']
         if 'cliente_id' in request.session: del request.session['cliente_id']
         if 'tipo_venta' in request.session: del request.session['tipo_venta']
@@ -559,9 +667,9 @@ def finalizar_venta(request, metodo_pago):
 
 @login_required
 def gestion_inventario(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     if request.method == 'POST':
-        form = ProductoForm(request.POST)
+        form = ProductoForm(request.POST, empresa=empresa_del_usuario)
         if form.is_valid():
             producto = form.save(commit=False)
             producto.empresa = empresa_del_usuario
@@ -569,29 +677,45 @@ def gestion_inventario(request):
             messages.success(request, f'Producto "{producto.nombre}" añadido correctamente.')
             return redirect('gestion-inventario')
     else:
-        form = ProductoForm()
-    productos_de_la_empresa = Producto.objects.filter(empresa=empresa_del_usuario, is_active=True).order_by('nombre')
-    contexto = {'form': form, 'productos': productos_de_la_empresa}
+        form = ProductoForm(empresa=empresa_del_usuario)
+    productos_de_la_empresa = obtener_catalogo(empresa_del_usuario)
+    # Desempeño de los últimos días (en cache por día) junto a cada producto del inventario.
+    analitica = analitica_del_dia(empresa_del_usuario)
+    nombres = {producto.id: producto.nombre for producto in productos_de_la_empresa}
+    # Cobertura y resurtido sugerido del último pronóstico nocturno (manage.py actualizar_pronosticos).
+    pronosticos = {p.producto_id: p for p in PronosticoProducto.objects.filter(empresa=empresa_del_usuario)}
+    # El catálogo en cache no trae el stock; se lee al momento en una sola consulta.
+    stock = stock_actual(empresa_del_usuario)
+    contexto = {
+        'form': form,
+        'productos': [
+            (producto, stock.get(producto.id), analitica['productos'].get(producto.id), pronosticos.get(producto.id))
+            for producto in productos_de_la_empresa
+        ],
+        'analitica': analitica,
+        'top_ingreso': [(nombres[i], analitica['productos'][i]) for i in analitica['top_ingreso'] if i in nombres],
+        'top_margen': [(nombres[i], analitica['productos'][i]) for i in analitica['top_margen'] if i in nombres],
+    }
     return render(request, 'inventario/gestion_inventario.html', contexto)
 
 @login_required
 def editar_producto(request, producto_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     producto = get_object_or_404(Producto, id=producto_id, empresa=empresa_del_usuario)
     if request.method == 'POST':
-        form = ProductoForm(request.POST, instance=producto)
+        form = ProductoForm(request.POST, instance=producto, empresa=empresa_del_usuario)
         if form.is_valid():
             form.save()
             messages.success(request, f'Producto "{producto.nombre}" actualizado correctamente.')
             return redirect('gestion-inventario')
     else:
-        form = ProductoForm(instance=producto)
+        form = ProductoForm(instance=producto, empresa=empresa_del_usuario)
     contexto = {'form': form, 'producto': producto}
     return render(request, 'inventario/editar_producto.html', contexto)
 
 @login_required
 def eliminar_producto(request, producto_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     producto = get_object_or_404(Producto, id=producto_id, empresa=empresa_del_usuario)
     
     producto.is_active = False
@@ -602,16 +726,21 @@ def eliminar_producto(request, producto_id):
 
 @login_required
 def reactivar_producto(request, producto_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     producto = get_object_or_404(Producto, id=producto_id, empresa=empresa_del_usuario)
     producto.is_active = True
     producto.save()
     messages.success(request, f'El producto "{producto.nombre}" ha sido reactivado.')
     return redirect('gestion-inventario')
 
+@staff_member_required
+def estadisticas_catalogo_view(request):
+    """Aciertos y fallos del cache de catálogo en este proceso, para monitoreo."""
+    return JsonResponse(estadisticas_catalogo())
+
 @login_required
 def lista_productos_archivados(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     productos_archivados = Producto.objects.filter(empresa=empresa_del_usuario, is_active=False).order_by('nombre')
     contexto = {
         'productos': productos_archivados,
@@ -622,43 +751,128 @@ def lista_productos_archivados(request):
 # VISTAS DE REPORTES Y GRÁFICAS
 # =================================================================================
 
+# Tamaño de página por defecto de reporte_ventas; `?por_pagina=` lo cambia hasta el máximo.
+PEDIDOS_POR_PAGINA = getattr(settings, 'REPORTE_VENTAS_POR_PAGINA', 50)
+MAXIMO_PEDIDOS_POR_PAGINA = 500
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def _cursor_pedido(fecha, pedido_id):
+    """Posición (fecha, id) de un pedido como texto para la URL; los microsegundos se conservan exactos."""
+    return f"{(fecha - _EPOCH) // timedelta(microseconds=1)}_{pedido_id}"
+
+def _leer_cursor_pedido(valor):
+    try:
+        microsegundos, pedido_id = valor.split('_')
+        return _EPOCH + timedelta(microseconds=int(microsegundos)), int(pedido_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
 @login_required
 def reporte_ventas(request):
-    empresa_del_usuario = request.user.profile.empresa
+    """
+    Pedidos del período por páginas con paginación por llave (fecha, id): cada página es
+    una consulta acotada por índice sin OFFSET, y solo trae las columnas de la tabla.
+    Los totales se calculan en la base de datos y excluyen los tickets cancelados.
+    """
+    empresa_del_usuario = request.empresa
     fecha_inicio_str = request.GET.get('fecha_inicio')
     fecha_fin_str = request.GET.get('fecha_fin')
     hoy = timezone.localtime(timezone.now()).date()
 
+    fecha_inicio = fecha_fin = hoy
+    titulo_reporte = f"Ventas del Día ({hoy.strftime('%d/%m/%Y')})"
     if fecha_inicio_str and fecha_fin_str:
-        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
-        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
-        pedidos = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date__range=[fecha_inicio, fecha_fin]).order_by('-fecha')
-        titulo_reporte = f"Ventas del {fecha_inicio.strftime('%d/%m/%Y')} al {fecha_fin.strftime('%d/%m/%Y')}"
-    else:
-        fecha_inicio = hoy
-        fecha_fin = hoy
-        pedidos = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy).order_by('-fecha')
-        titulo_reporte = f"Ventas del Día ({hoy.strftime('%d/%m/%Y')})"
+        try:
+            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
+            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
+            titulo_reporte = f"Ventas del {fecha_inicio.strftime('%d/%m/%Y')} al {fecha_fin.strftime('%d/%m/%Y')}"
+        except ValueError:
+            messages.error(request, "Las fechas del reporte no son válidas.")
+            fecha_inicio = fecha_fin = hoy
+
+    try:
+        por_pagina = min(max(int(request.GET.get('por_pagina', PEDIDOS_POR_PAGINA)), 1), MAXIMO_PEDIDOS_POR_PAGINA)
+    except ValueError:
+        por_pagina = PEDIDOS_POR_PAGINA
+
+    pedidos_del_periodo = Pedido.objects.filter(empresa=empresa_del_usuario, **filtro_de_dias('fecha', fecha_inicio, fecha_fin))
+
+    # Los totales del período salen del cache de reportes por día, no de recorrer los pedidos.
+    totales = sumar_totales(totales_por_dia(empresa_del_usuario, fecha_inicio, fecha_fin).values())
+
+    pagina = pedidos_del_periodo
+    cursor = _leer_cursor_pedido(request.GET.get('despues'))
+    if cursor:
+        fecha_cursor, id_cursor = cursor
+        pagina = pagina.filter(Q(fecha__lt=fecha_cursor) | Q(fecha=fecha_cursor, id__lt=id_cursor))
+    pedidos = list(pagina.order_by('-fecha', '-id').values(
+        'id', 'ticket_numero', 'fecha', 'cliente__nombre', 'total', 'estado'
+    )[:por_pagina + 1])
+
+    siguiente = None
+    if len(pedidos) > por_pagina:
+        pedidos = pedidos[:por_pagina]
+        parametros = request.GET.copy()
+        parametros['despues'] = _cursor_pedido(pedidos[-1]['fecha'], pedidos[-1]['id'])
+        siguiente = parametros.urlencode()
+    primera = request.GET.copy()
+    primera.pop('despues', None)
 
-    total_vendido = sum(p.total for p in pedidos)
     contexto = {
         'pedidos': pedidos,
-        'total_vendido': total_vendido,
+        'totales': totales,
+        'total_vendido': totales['total_vendido'] or Decimal('0.00'),
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin,
         'titulo_reporte': titulo_reporte,
+        'por_pagina': por_pagina,
+        'url_siguiente': siguiente,
+        'url_primera': primera.urlencode() if cursor else None,
     }
     return render(request, 'inventario/reporte_ventas.html', contexto)
 
+@login_required
+def exportar_ventas(request):
+    """
+    Descarga en CSV los pedidos (o, con ?detalle=lineas, cada línea vendida) de un rango de
+    fechas. Las filas se leen por lotes con iterator() y se envían conforme se generan, así
+    que la memoria no crece con el rango. Con ?gzip=1 el archivo se comprime al vuelo.
+    """
+    empresa_del_usuario = request.empresa
+    hoy = timezone.localdate()
+    try:
+        fecha_inicio = datetime.strptime(request.GET.get('fecha_inicio', ''), '%Y-%m-%d').date()
+        fecha_fin = datetime.strptime(request.GET.get('fecha_fin', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fecha_inicio = fecha_fin = hoy
+
+    if request.GET.get('detalle') == 'lineas':
+        filas, nombre = filas_lineas(empresa_del_usuario, fecha_inicio, fecha_fin), 'lineas'
+    else:
+        filas, nombre = filas_pedidos(empresa_del_usuario, fecha_inicio, fecha_fin), 'ventas'
+    contenido = csv_en_flujo(filas)
+    nombre_archivo = f"{nombre}_{fecha_inicio:%Y%m%d}_{fecha_fin:%Y%m%d}.csv"
+
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(gzip_en_flujo(contenido), content_type='application/gzip')
+        nombre_archivo += '.gz'
+    else:
+        response = StreamingHttpResponse(contenido, content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return response
+
 @login_required
 def detalle_pedido(request, pedido_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     pedido = get_object_or_404(Pedido, id=pedido_id, empresa=empresa_del_usuario)
 
     texto_del_ticket = _generar_texto_ticket_venta(pedido)
 
     contexto = {
         'pedido': pedido,
+        'lineas': lineas_con_devuelto(pedido),
+        'devolvible': pedido.estado == 'Completado' and pedido.arqueo_id is None,
+        'devoluciones': pedido.devoluciones.select_related('item__producto', 'usuario').order_by('fecha'),
         'texto_del_ticket_json': json.dumps(texto_del_ticket),
         'url_puente_impresora': URL_PUENTE_IMPRESORA
     }
@@ -666,7 +880,7 @@ def detalle_pedido(request, pedido_id):
 
 @login_required
 def dashboard_ventas(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     periodo = request.GET.get('periodo', 'hoy')
     hoy = timezone.localtime(timezone.now()).date()
     
@@ -685,20 +899,15 @@ def dashboard_ventas(request):
 
     etiquetas, datos = [], []
     if dias_a_mostrar > 1:
-        ventas_agrupadas = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date__range=[fecha_inicio, hoy]).values('fecha__date').annotate(total=Sum('total')).order_by('fecha__date')
-        ventas_dict = {item['fecha__date'].strftime('%d/%m'): item['total'] for item in ventas_agrupadas}
-        for i in range(dias_a_mostrar):
-            fecha = fecha_inicio + timedelta(days=i)
-            fecha_str = fecha.strftime('%d/%m')
-            etiquetas.append(fecha_str)
-            datos.append(float(ventas_dict.get(fecha_str, 0)))
+        ventas_dict = ventas_por_dia(empresa_del_usuario, fecha_inicio, hoy)
+        for fecha, total in sorted(ventas_dict.items()):
+            etiquetas.append(fecha.strftime('%d/%m'))
+            datos.append(float(total))
     else:
-        ventas_agrupadas = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy).annotate(hora=TruncHour('fecha')).values('hora').annotate(total=Sum('total')).order_by('hora')
-        ventas_dict = {item['hora'].strftime('%H:00'): item['total'] for item in ventas_agrupadas}
+        ventas_dict = ventas_por_hora(empresa_del_usuario)
         for i in range(24):
-            hora_str = f"{i:02d}:00"
-            etiquetas.append(hora_str)
-            datos.append(float(ventas_dict.get(hora_str, 0)))
+            etiquetas.append(f"{i:02d}:00")
+            datos.append(float(ventas_dict.get(i, 0)))
 
     contexto = {
         'titulo': titulo,
@@ -714,14 +923,22 @@ def dashboard_ventas(request):
 
 @login_required
 def gestion_caja(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     
     if request.method == 'POST':
         form = RetiroForm(request.POST)
         if form.is_valid():
             retiro = form.save(commit=False)
             retiro.empresa = empresa_del_usuario
-            retiro.save()
+            retiro.turno = _turno_de_sesion(request)
+            try:
+                with transaction.atomic():
+                    retiro.save()
+                    registrar_retiro_en_caja(retiro)
+            except TurnoCerrado:
+                request.session.pop('turno_id', None)
+                messages.error(request, 'El turno de esta caja ya fue cerrado. El retiro no se registró.')
+                return redirect('turno-caja')
             messages.success(request, 'Retiro registrado con éxito.')
             return redirect('retiro-exitoso', retiro_id=retiro.id)
     else:
@@ -729,7 +946,7 @@ def gestion_caja(request):
     
     hoy = timezone.localtime(timezone.now()).date()
     # --- CAMBIO IMPORTANTE: Solo mostrar retiros que NO han sido asignados a un arqueo ---
-    retiros_de_hoy = Retiro.objects.filter(empresa=empresa_del_usuario, fecha__date=hoy, arqueo__isnull=True).order_by('-fecha')
+    retiros_de_hoy = Retiro.objects.filter(empresa=empresa_del_usuario, arqueo__isnull=True, **filtro_de_dias('fecha', hoy)).order_by('-fecha')
     
     contexto = {
         'form': form,
@@ -739,8 +956,7 @@ def gestion_caja(request):
 
 @login_required
 def arqueo_caja(request):
-    print(f"DEBUG: Parámetro de fecha recibido: {request.GET.get('fecha')}")
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     fecha_str = request.GET.get('fecha')
     
     try:
@@ -750,10 +966,9 @@ def arqueo_caja(request):
         # Si el formato de fecha en la URL es inválido, usa hoy por seguridad.
         fecha_a_procesar = timezone.localdate()
 
-    # Todas las consultas usan la 'fecha_a_procesar' determinada.
-    ventas_efectivo = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=fecha_a_procesar, metodo_pago='Efectivo', arqueo__isnull=True, estado='Completado').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-    ventas_tarjeta = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=fecha_a_procesar, metodo_pago='Tarjeta', arqueo__isnull=True, estado='Completado').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-    retiros_del_dia = Retiro.objects.filter(empresa=empresa_del_usuario, fecha__date=fecha_a_procesar, arqueo__isnull=True).aggregate(Sum('monto'))['monto__sum'] or Decimal('0.00')
+    # Los totales pendientes del día salen de una sola fila del libro de caja.
+    caja = caja_del_dia(empresa_del_usuario, fecha_a_procesar)
+    ventas_efectivo, ventas_tarjeta, retiros_del_dia = caja.ventas_efectivo, caja.ventas_tarjeta, caja.retiros
     
     efectivo_esperado = ventas_efectivo - retiros_del_dia
     total_ventas = ventas_efectivo + ventas_tarjeta
@@ -777,7 +992,7 @@ def cerrar_caja(request):
     desde un campo oculto en el formulario para asegurar que se cierra el día correcto.
     """
     if request.method == 'POST':
-        empresa_del_usuario = request.user.profile.empresa
+        empresa_del_usuario = request.empresa
         
         try:
             # Lee la fecha del campo oculto del formulario.
@@ -791,26 +1006,8 @@ def cerrar_caja(request):
             # Si hay un error, redirige de vuelta a la página de arqueo del día problemático.
             return redirect(f"{reverse('arqueo-caja')}?fecha={fecha_arqueo_str}")
 
-        # Filtra los registros del día a cerrar que no tengan arqueo.
-        pedidos_del_dia = Pedido.objects.filter(empresa=empresa_del_usuario, fecha__date=fecha_a_cerrar, arqueo__isnull=True)
-        retiros_del_dia = Retiro.objects.filter(empresa=empresa_del_usuario, fecha__date=fecha_a_cerrar, arqueo__isnull=True)
-
-        total_efectivo = pedidos_del_dia.filter(metodo_pago='Efectivo').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-        total_tarjeta = pedidos_del_dia.filter(metodo_pago='Tarjeta').aggregate(Sum('total'))['total__sum'] or Decimal('0.00')
-        total_retiros = retiros_del_dia.aggregate(Sum('monto'))['monto__sum'] or Decimal('0.00')
-
-        efectivo_esperado = total_efectivo - total_retiros
-        diferencia = monto_contado - efectivo_esperado
-
-        arqueo = Arqueo.objects.create(
-            empresa=empresa_del_usuario, fecha=fecha_a_cerrar, ventas_efectivo=total_efectivo,
-            ventas_tarjeta=total_tarjeta, retiros=total_retiros, efectivo_esperado=efectivo_esperado,
-            monto_contado=monto_contado, diferencia=diferencia, cerrado_por=request.user 
-        )
-
-        # "Sella" los pedidos y retiros asociándolos al nuevo arqueo.
-        pedidos_del_dia.update(arqueo=arqueo)
-        retiros_del_dia.update(arqueo=arqueo)
+        # Bloquea el libro del día, sella los pendientes y calcula el arqueo sobre lo sellado.
+        arqueo, = cerrar_dias(empresa_del_usuario, {fecha_a_cerrar: monto_contado}, request.user)
         
         messages.success(request, f"Caja del día {fecha_a_cerrar.strftime('%d/%m/%Y')} cerrada exitosamente.")
         return redirect('cierre-caja-exitoso', arqueo_id=arqueo.id)
@@ -819,13 +1016,107 @@ def cerrar_caja(request):
     return redirect('arqueo-caja')
 
 
+def _es_dueno_o_staff(request):
+    """El dueño de la cuenta es el primer perfil de la empresa, igual que en el admin."""
+    if request.user.is_staff:
+        return True
+    dueno_id = UserProfile.objects.filter(empresa=request.empresa).order_by('id').values_list('user_id', flat=True).first()
+    return dueno_id == request.user.id
+
+
+@login_required
+@require_POST
+def cerrar_dias_pendientes(request):
+    """
+    Cierra de una vez todos los días anteriores a hoy que quedaron sin arqueo (un arqueo por
+    día, sin conteo de efectivo) para desbloquear el punto de venta. Solo el dueño de la
+    cuenta o el staff pueden hacerlo, porque esos días quedan sin diferencia registrada.
+    """
+    if not _es_dueno_o_staff(request):
+        messages.error(request, "Solo el dueño de la cuenta puede cerrar días sin conteo de efectivo.")
+        return redirect('arqueo-caja')
+    empresa_del_usuario = request.empresa
+    pendientes = dias_pendientes(empresa_del_usuario, timezone.localdate())
+    if not pendientes:
+        messages.info(request, "No hay días pendientes de cierre.")
+        return redirect('reporte-arqueos')
+    arqueos = cerrar_dias(empresa_del_usuario, dict.fromkeys(pendientes), request.user)
+    messages.success(
+        request, f"Se cerraron {len(arqueos)} días pendientes, del {pendientes[0].strftime('%d/%m/%Y')} "
+                 f"al {pendientes[-1].strftime('%d/%m/%Y')}. Quedaron sin conteo de efectivo en el historial de arqueos."
+    )
+    return redirect('reporte-arqueos')
+
+
+def _turno_de_sesion(request):
+    """
+    Turno abierto de la caja de esta sesión, o None. Si el turno se cerró desde otra sesión,
+    se olvida y se avisa al cajero.
+    """
+    turno_id = request.session.get('turno_id')
+    if not turno_id:
+        return None
+    turno = turno_abierto(request.empresa, turno_id)
+    if turno is None:
+        del request.session['turno_id']
+        messages.warning(request, "El turno de esta caja ya fue cerrado. Abre un turno nuevo para seguir cobrando por turno.")
+    return turno
+
+
+@login_required
+def turno_caja(request):
+    """Abre un turno para esta caja o, si ya hay uno, muestra sus totales para cerrarlo."""
+    empresa_del_usuario = request.empresa
+    turno = _turno_de_sesion(request)
+    form = TurnoForm()
+    if request.method == 'POST' and turno is None:
+        form = TurnoForm(request.POST)
+        if form.is_valid():
+            try:
+                turno = abrir_turno(empresa_del_usuario, form.cleaned_data['caja'], request.user, form.cleaned_data['fondo_inicial'])
+            except TurnoInvalido as error:
+                messages.error(request, str(error))
+            else:
+                request.session['turno_id'] = turno.id
+                messages.success(request, f"Turno abierto en {turno.caja}.")
+                return redirect('pos', tipo_venta='mostrador')
+
+    contexto = {
+        'form': form,
+        'turno': turno,
+        'turnos_abiertos': Turno.objects.filter(empresa=empresa_del_usuario, cierre__isnull=True).select_related('abierto_por').order_by('caja'),
+    }
+    return render(request, 'inventario/turno_caja.html', contexto)
+
+
+@login_required
+@require_POST
+def cerrar_turno_view(request):
+    turno = _turno_de_sesion(request)
+    if turno is None:
+        return redirect('turno-caja')
+    try:
+        monto_contado = Decimal(request.POST.get('monto_contado'))
+    except (TypeError, InvalidOperation):
+        messages.error(request, "Datos de cierre inválidos. Por favor, intenta de nuevo.")
+        return redirect('turno-caja')
+    try:
+        arqueo = cerrar_turno(turno, monto_contado, request.user)
+    except TurnoInvalido as error:
+        messages.error(request, str(error))
+        return redirect('turno-caja')
+    del request.session['turno_id']
+    messages.success(request, f"Turno de {turno.caja} cerrado exitosamente.")
+    return redirect('cierre-caja-exitoso', arqueo_id=arqueo.id)
+
+
 # =================================================================================
 # VISTAS SOLO PARA IMPRESIÓN
 # =================================================================================
 
 @login_required
 def reimprimir_pedido(request, pedido_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     pedido = get_object_or_404(Pedido, id=pedido_id, empresa=empresa_del_usuario)
 
     texto_del_ticket = _generar_texto_ticket_venta(pedido)
@@ -894,11 +1185,15 @@ def _generar_texto_ticket_venta(pedido):
             producto_display = producto_display[:15]
 
         cantidad_str = f"{item.cantidad}kg"
-        subtotal_item = item.cantidad * item.precio_unitario
-        total_item_str = f"${subtotal_item:.2f}"
+        total_item_str = f"${item.subtotal:.2f}"
         linea = f"{cantidad_str:<5} {producto_display:<18} {total_item_str:>15}\n"
         texto_ticket += linea
     
+    for devolucion in pedido.devoluciones.select_related('item__producto').order_by('fecha'):
+        cantidad_str = f"-{devolucion.cantidad}kg"
+        linea = f"{cantidad_str:<5} {'DEV ' + devolucion.item.producto.nombre[:14]:<18} {f'-${devolucion.importe:.2f}':>15}\n"
+        texto_ticket += linea
+
     texto_ticket += "-" * 42 + "\n"
     texto_ticket += f"{'TOTAL:':>32} ${pedido.total:.2f}\n"
     texto_ticket += f"{'PAGO:':>32} {pedido.metodo_pago.upper()}\n"
@@ -947,11 +1242,15 @@ def _generar_texto_ticket_arqueo(arqueo):
     texto_ticket += f"{'TOTAL DE RETIROS:':>32} -${arqueo.retiros:.2f}\n"
     texto_ticket += "=" * 42 + "\n"
     texto_ticket += f"{'EFECTIVO ESPERADO:':>32} ${arqueo.efectivo_esperado:.2f}\n"
-    texto_ticket += f"{'MONTO CONTADO:':>32} ${arqueo.monto_contado:.2f}\n"
-    texto_ticket += "-" * 42 + "\n"
-    
-    diferencia_signo = "+" if arqueo.diferencia >= 0 else ""
-    texto_ticket += f"{'DIFERENCIA:':>32} {diferencia_signo}${arqueo.diferencia:.2f}\n"
+    if arqueo.monto_contado is None:
+        texto_ticket += f"{'MONTO CONTADO:':>32} SIN CONTEO\n"
+        texto_ticket += "-" * 42 + "\n"
+    else:
+        texto_ticket += f"{'MONTO CONTADO:':>32} ${arqueo.monto_contado:.2f}\n"
+        texto_ticket += "-" * 42 + "\n"
+
+        diferencia_signo = "+" if arqueo.diferencia >= 0 else ""
+        texto_ticket += f"{'DIFERENCIA:':>32} {diferencia_signo}${arqueo.diferencia:.2f}\n"
     
     texto_ticket += "=" * 42 + "\n"
     texto_ticket += "FIRMA: __________________\n".center(42)
@@ -961,7 +1260,7 @@ def _generar_texto_ticket_arqueo(arqueo):
 
 @login_required
 def venta_exitosa(request, pedido_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     pedido = get_object_or_404(Pedido, id=pedido_id, empresa=empresa_del_usuario)
 
     texto_del_ticket = _generar_texto_ticket_venta(pedido)
@@ -975,7 +1274,7 @@ def venta_exitosa(request, pedido_id):
 
 @login_required
 def retiro_exitoso(request, retiro_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     retiro = get_object_or_404(Retiro, id=retiro_id, empresa=empresa_del_usuario)
 
     texto_del_ticket = _generar_texto_ticket_retiro(retiro)
@@ -990,7 +1289,7 @@ def retiro_exitoso(request, retiro_id):
 
 @login_required
 def cierre_caja_exitoso(request, arqueo_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     arqueo = get_object_or_404(Arqueo, id=arqueo_id, empresa=empresa_del_usuario)
 
     texto_del_ticket = _generar_texto_ticket_arqueo(arqueo)
@@ -1002,19 +1301,68 @@ def cierre_caja_exitoso(request, arqueo_id):
     }
     return render(request, 'inventario/cierre_caja_exitoso.html', contexto)
 
+# Tamaño de página de reporte_arqueos y período que muestra si no se eligen fechas.
+ARQUEOS_POR_PAGINA = getattr(settings, 'REPORTE_ARQUEOS_POR_PAGINA', 31)
+DIAS_REPORTE_ARQUEOS = 30
+
+def _leer_cursor_arqueo(valor):
+    try:
+        fecha, arqueo_id = valor.split('_')
+        return datetime.strptime(fecha, '%Y%m%d').date(), int(arqueo_id)
+    except (AttributeError, ValueError):
+        return None
+
 @login_required
 def reporte_arqueos(request):
-    empresa_del_usuario = request.user.profile.empresa
-    arqueos = Arqueo.objects.filter(empresa=empresa_del_usuario).order_by('-fecha')
-    
+    """
+    Historial de arqueos del período por páginas, con la misma paginación por llave (fecha, id)
+    que reporte_ventas. El resumen de diferencias (total, faltantes, sobrantes, peor faltante y
+    por cajero) y el acumulado de 30 días de cada renglón se calculan en la base de datos.
+    """
+    empresa_del_usuario = request.empresa
+    hoy = timezone.localdate()
+    fecha_fin = hoy
+    fecha_inicio = hoy - timedelta(days=DIAS_REPORTE_ARQUEOS - 1)
+    fecha_inicio_str = request.GET.get('fecha_inicio')
+    fecha_fin_str = request.GET.get('fecha_fin')
+    if fecha_inicio_str and fecha_fin_str:
+        try:
+            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
+            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
+        except ValueError:
+            messages.error(request, "Las fechas del reporte no son válidas.")
+            fecha_fin = hoy
+            fecha_inicio = hoy - timedelta(days=DIAS_REPORTE_ARQUEOS - 1)
+
+    pagina = arqueos_del_periodo(empresa_del_usuario, fecha_inicio, fecha_fin)
+    cursor = _leer_cursor_arqueo(request.GET.get('despues'))
+    if cursor:
+        fecha_cursor, id_cursor = cursor
+        pagina = pagina.filter(Q(fecha__lt=fecha_cursor) | Q(fecha=fecha_cursor, id__lt=id_cursor))
+    arqueos = list(pagina[:ARQUEOS_POR_PAGINA + 1])
+
+    siguiente = None
+    if len(arqueos) > ARQUEOS_POR_PAGINA:
+        arqueos = arqueos[:ARQUEOS_POR_PAGINA]
+        parametros = request.GET.copy()
+        parametros['despues'] = f"{arqueos[-1]['fecha']:%Y%m%d}_{arqueos[-1]['id']}"
+        siguiente = parametros.urlencode()
+    primera = request.GET.copy()
+    primera.pop('despues', None)
+
     contexto = {
         'arqueos': arqueos,
+        'resumen': resumen_de_arqueos(empresa_del_usuario, fecha_inicio, fecha_fin),
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'url_siguiente': siguiente,
+        'url_primera': primera.urlencode() if cursor else None,
     }
     return render(request, 'inventario/reporte_arqueos.html', contexto)
 
 @login_required
 def gestion_clientes(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     clientes = Cliente.objects.filter(empresa=empresa_del_usuario).order_by('nombre')
     contexto = {'clientes': clientes}
     return render(request, 'inventario/gestion_clientes.html', contexto)
@@ -1022,7 +1370,7 @@ def gestion_clientes(request):
 
 @login_required
 def agregar_cliente(request):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     telefono_autocompletar = request.GET.get('telefono', '')
     next_url = request.GET.get('next', 'gestion-clientes') 
     
@@ -1048,7 +1396,7 @@ def agregar_cliente(request):
 
 @login_required
 def editar_cliente(request, cliente_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     cliente = get_object_or_404(Cliente, id=cliente_id, empresa=empresa_del_usuario)
     if request.method == 'POST':
         form = ClienteForm(request.POST, instance=cliente)
@@ -1063,7 +1411,7 @@ def editar_cliente(request, cliente_id):
 
 @login_required
 def eliminar_cliente(request, cliente_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     cliente = get_object_or_404(Cliente, id=cliente_id, empresa=empresa_del_usuario)
     if request.method == 'POST':
         nombre_cliente = cliente.nombre
@@ -1076,7 +1424,7 @@ def eliminar_cliente(request, cliente_id):
 @login_required
 @transaction.atomic
 def cancelar_pedido(request, pedido_id):
-    empresa_del_usuario = request.user.profile.empresa
+    empresa_del_usuario = request.empresa
     pedido = get_object_or_404(Pedido, id=pedido_id, empresa=empresa_del_usuario)
     
     # Regla 1: No cancelar tickets de un día ya cerrado
@@ -1090,19 +1438,16 @@ def cancelar_pedido(request, pedido_id):
         return redirect('detalle-pedido', pedido_id=pedido.id)
 
     if request.method == 'POST':
-        # 1. Devolver el stock al inventario
-        for item in pedido.items.all():
-            if item.producto.requiere_stock:
-                producto = item.producto
-                producto.stock += item.cantidad
-                producto.save()
-        
-        # 2. Actualizar el estado del pedido
-        pedido.estado = 'Cancelado'
-        pedido.cancelado_por = request.user
-        pedido.fecha_cancelacion = timezone.now()
-        pedido.save()
-        
+        # Repone el stock, marca el pedido y lo quita del libro de caja (o del turno) y de los resúmenes.
+        try:
+            cancelar_venta(pedido, request.user)
+        except VentaNoModificable as error:
+            messages.error(request, str(error))
+            return redirect('detalle-pedido', pedido_id=pedido.id)
+        except TurnoCerrado:
+            messages.error(request, f"El pedido #{pedido.ticket_numero} no puede ser cancelado porque su turno de caja se acaba de cerrar.")
+            return redirect('detalle-pedido', pedido_id=pedido.id)
+
         messages.success(request, f"El pedido #{pedido.ticket_numero} ha sido cancelado y el stock ha sido restaurado.")
         return redirect('reporte-ventas')
 
@@ -1110,4 +1455,34 @@ def cancelar_pedido(request, pedido_id):
         'pedido': pedido
     }
     # Apuntaremos a una nueva plantilla de confirmación
-    return render(request, 'inventario/pedido_confirm_cancel.html', contexto)
\ No newline at end of file
+    return render(request, 'inventario/pedido_confirm_cancel.html', contexto)
+
+@login_required
+@require_POST
+def devolver_pedido(request, pedido_id):
+    """Devolución parcial: los campos `devolver_<id de línea>` traen los kilos o piezas a devolver."""
+    empresa_del_usuario = request.empresa
+    pedido = get_object_or_404(Pedido, id=pedido_id, empresa=empresa_del_usuario)
+    cantidades = {}
+    try:
+        for campo, valor in request.POST.items():
+            if campo.startswith('devolver_') and valor.strip():
+                cantidad = Decimal(valor)
+                if not cantidad.is_finite():
+                    raise InvalidOperation(valor)
+                if cantidad:
+                    cantidades[int(campo.removeprefix('devolver_'))] = cantidad
+    except (InvalidOperation, ValueError):
+        messages.error(request, "Las cantidades a devolver no son válidas.")
+        return redirect('detalle-pedido', pedido_id=pedido.id)
+
+    try:
+        devoluciones = devolver_lineas(pedido, cantidades, request.user)
+    except (VentaNoModificable, DevolucionInvalida) as error:
+        messages.error(request, str(error))
+    except TurnoCerrado:
+        messages.error(request, f"El pedido #{pedido.ticket_numero} no admite devoluciones porque su turno de caja se acaba de cerrar.")
+    else:
+        importe = sum(devolucion.importe for devolucion in devoluciones)
+        messages.success(request, f"Devolución registrada: ${importe:.2f} del pedido #{pedido.ticket_numero}. El stock ha sido restaurado.")
+    return redirect('detalle-pedido', pedido_id=pedido.id)